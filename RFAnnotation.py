@@ -1,7 +1,11 @@
+import unittest
+
+import numpy as np
 import vtk, qt, slicer
+from vtk.util.numpy_support import vtk_to_numpy
 from slicer.ScriptedLoadableModule import *
 from RFAnnotationLib import RFLineProfileWidget
-from RFAnnotationLib import RFAnnotationCanalWidget
+from RFAnnotationLib import RFAnnotationCanalWidget, RFAnnotationCanalLogic, RFCanalGeometry
 from RFViewerHomeLib import RFViewerWidget, jumpSlicesToNthMarkupPosition, removeNodeFromMRMLScene, getNodeByID, \
   translatable
 from RFVisualizationLib import setNodeVisibleInMainViewsOnly
@@ -219,9 +223,10 @@ class RFAnnotationWidget(RFViewerWidget):
     # of the PlotSerie. When loaded a session, then the GetName() of the PlotSeries doesn't
     # work properly. Even if we set the correct name, the name displayed in the chart is not
     # the correct one
-    removeNodeFromMRMLScene(getNodeByID(parameter.GetParameter("PlotSerieID")))
-    removeNodeFromMRMLScene(getNodeByID(parameter.GetParameter("TableID")))
-    removeNodeFromMRMLScene(getNodeByID(parameter.GetParameter("PlotChartID")))
+    # Profile tables and plot series IDs are comma separated, as they are pooled
+    for parameterName in ["PlotSerieID", "TableID", "PlotChartID"]:
+      for nodeId in parameter.GetParameter(parameterName).split(","):
+        removeNodeFromMRMLScene(getNodeByID(nodeId))
 
     nodes = slicer.util.getNodesByClass("vtkMRMLMarkupsLineNode")
     markupNode = None
@@ -246,3 +251,125 @@ class RFAnnotationWidget(RFViewerWidget):
         canalParameters[name] = parameter.GetParameter(name)
 
     self.canalWidget.loadFromParameterDict(canalParameters)
+
+
+def an_arch_of_control_points():
+  return np.array([[0, 0, 0], [10, 2, 1], [20, -3, 2], [30, 0, 5], [40, 4, 3], [50, 0, 0], [60, 1, 1]], dtype=float)
+
+
+def ringCenters(polyData, numberOfSides=8):
+  """Returns the centers of the tube rings of a canal polydata, which are the points of its center line"""
+  return vtk_to_numpy(polyData.GetPoints().GetData()).reshape(-1, numberOfSides, 3).mean(axis=1)
+
+
+class RFCanalGeometryTestCase(unittest.TestCase):
+  def test_center_line_is_the_kochanek_spline_of_the_control_points(self):
+    controlPoints = an_arch_of_control_points()
+    geometry = RFCanalGeometry(numberOfSides=8)
+    geometry.update(controlPoints, 1.5, 15)
+
+    # Kochanek spline with the default parameters and end constraints, parametrized by the control point indices
+    splines = [vtk.vtkKochanekSpline() for _ in range(3)]
+    for axis, spline in enumerate(splines):
+      for i, point in enumerate(controlPoints):
+        spline.AddPoint(i, point[axis])
+    parameters = np.linspace(0, len(controlPoints) - 1, (len(controlPoints) - 1) * 15 + 1)
+    expected = [[spline.Evaluate(t) for spline in splines] for t in parameters]
+    np.testing.assert_allclose(ringCenters(geometry.polyData), expected, atol=1e-4)
+
+  def test_rings_are_at_the_radius_of_the_center_line_and_closed_by_caps(self):
+    geometry = RFCanalGeometry(numberOfSides=8)
+    geometry.update(an_arch_of_control_points(), 1.5, 10)
+
+    rings = vtk_to_numpy(geometry.polyData.GetPoints().GetData()).reshape(-1, 8, 3)
+    self.assertEqual(6 * 10 + 1, len(rings))
+    np.testing.assert_allclose(np.linalg.norm(rings - rings.mean(axis=1, keepdims=True), axis=2), 1.5, atol=1e-4)
+    self.assertEqual((len(rings) - 1) * 8 + 2, geometry.polyData.GetNumberOfPolys())
+
+  def test_moving_a_point_only_samples_its_segments_again_and_matches_a_new_geometry(self):
+    controlPoints = an_arch_of_control_points()
+    geometry = RFCanalGeometry(numberOfSides=8)
+    self.assertEqual(6, geometry.update(controlPoints, 1.5, 10))
+    self.assertEqual(0, geometry.update(controlPoints, 1.5, 10))
+
+    controlPoints[3] += [0, 1, 0]
+    self.assertEqual(4, geometry.update(controlPoints, 1.5, 10))
+    newGeometry = RFCanalGeometry(numberOfSides=8)
+    newGeometry.update(controlPoints, 1.5, 10)
+    np.testing.assert_allclose(vtk_to_numpy(geometry.polyData.GetPoints().GetData()),
+                               vtk_to_numpy(newGeometry.polyData.GetPoints().GetData()), atol=1e-5)
+    np.testing.assert_allclose(vtk_to_numpy(geometry.polyData.GetPointData().GetNormals()),
+                               vtk_to_numpy(newGeometry.polyData.GetPointData().GetNormals()), atol=1e-5)
+
+  def test_inserting_a_point_matches_a_new_geometry(self):
+    controlPoints = an_arch_of_control_points()
+    geometry = RFCanalGeometry(numberOfSides=8)
+    geometry.update(controlPoints, 1.5, 10)
+
+    controlPoints = np.insert(controlPoints, 4, [35, 2, 4], axis=0)
+    geometry.update(controlPoints, 1.5, 10)
+    newGeometry = RFCanalGeometry(numberOfSides=8)
+    newGeometry.update(controlPoints, 1.5, 10)
+    np.testing.assert_allclose(vtk_to_numpy(geometry.polyData.GetPoints().GetData()),
+                               vtk_to_numpy(newGeometry.polyData.GetPoints().GetData()), atol=1e-5)
+    self.assertEqual(newGeometry.polyData.GetNumberOfPolys(), geometry.polyData.GetNumberOfPolys())
+
+
+class RFAnnotationCanalLogicTestCase(unittest.TestCase):
+  def setUp(self):
+    slicer.mrmlScene.Clear(0)
+
+  def a_canal_markup(self, controlPoints):
+    markupNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsFiducialNode')
+    for point in controlPoints:
+      markupNode.AddControlPoint(vtk.vtkVector3d(*point))
+    return markupNode
+
+  def test_kochanek_canal_matches_the_markups_to_model_tube(self):
+    radius = 1.5
+    markupNode = self.a_canal_markup(an_arch_of_control_points())
+    logic = RFAnnotationCanalLogic()
+    canalModel = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode')
+    logic.updateModelFromMarkup(markupNode, canalModel, radius=radius)
+
+    tubeModel = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode')
+    slicer.modules.markupstomodel.logic().UpdateOutputCurveModel(markupNode, tubeModel, logic.interpolationType, False,
+      radius, 8, logic.numberOfLineSegmentsBetweenControlPoints, True, 3, slicer.vtkMRMLMarkupsToModelNode.RawIndices,
+      slicer.vtkCurveGenerator(), logic.polynomialFitType)
+
+    # Every point of the markupstomodel tube is at the radius of the canal center line
+    centers = ringCenters(canalModel.GetPolyData())
+    segmentStarts, segmentVectors = centers[:-1], centers[1:] - centers[:-1]
+    tubePoints = vtk_to_numpy(tubeModel.GetPolyData().GetPoints().GetData())
+    t = np.einsum('pkd,kd->pk', tubePoints[:, None] - segmentStarts[None], segmentVectors) / \
+      np.einsum('kd,kd->k', segmentVectors, segmentVectors)
+    closestPoints = segmentStarts[None] + np.clip(t, 0, 1)[..., None] * segmentVectors[None]
+    distances = np.linalg.norm(tubePoints[:, None] - closestPoints, axis=2).min(axis=1)
+    np.testing.assert_allclose(distances, radius, atol=0.01)
+
+    # Rings of both tubes are only rotated around the center line
+    maximumRingOffset = radius * (1 - np.cos(np.pi / 8))
+    np.testing.assert_allclose(canalModel.GetPolyData().GetBounds(), tubeModel.GetPolyData().GetBounds(),
+                               atol=maximumRingOffset + 0.01)
+
+  def test_updating_a_canal_after_moving_a_point_matches_a_new_canal(self):
+    markupNode = self.a_canal_markup(an_arch_of_control_points())
+    logic = RFAnnotationCanalLogic()
+    canalModel = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode')
+    logic.updateModelFromMarkup(markupNode, canalModel)
+    markupNode.SetNthControlPointPosition(2, 20, -1, 3)
+    logic.updateModelFromMarkup(markupNode, canalModel)
+
+    newCanalModel = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLModelNode')
+    RFAnnotationCanalLogic().updateModelFromMarkup(markupNode, newCanalModel)
+    np.testing.assert_allclose(vtk_to_numpy(canalModel.GetPolyData().GetPoints().GetData()),
+                               vtk_to_numpy(newCanalModel.GetPolyData().GetPoints().GetData()), atol=1e-5)
+
+
+class RFAnnotationTest(ScriptedLoadableModuleTest):
+  def runTest(self):
+    # Gather tests for the plugin and run them in a test suite
+    testCases = [RFCanalGeometryTestCase, RFAnnotationCanalLogicTestCase]
+    suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
+    unittest.TextTestRunner(verbosity=3).run(suite)
+    slicer.mrmlScene.Clear()
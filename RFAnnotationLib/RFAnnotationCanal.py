@@ -1,8 +1,9 @@
 import vtk, qt, slicer, os
 
-from RFViewerHomeLib import translatable
-from RFAnnotationLib import RFCanal
+from RFViewerHomeLib import translatable, UpdateScheduler
+from RFAnnotationLib import RFCanal, RFCanalGeometry
 import json
+import numpy as np
 
 #
 # RFAnnotationCanal
@@ -17,6 +18,9 @@ class RFAnnotationCanalWidget(qt.QWidget):
     self.canals = {}
     self.currentCanal = None
     self.defaultRadius = 1.0
+    # Canals whose markup points were modified since their last final model update
+    self._modifiedCanals = []
+    self._canalUpdateScheduler = UpdateScheduler(self.updateModifiedCanalModels)
 
     # Create button used to create a new canal
     self.addCanalButton = qt.QPushButton(self.icon(), '')
@@ -35,6 +39,7 @@ class RFAnnotationCanalWidget(qt.QWidget):
                                                             self._onSceneNodeRemoved)
 
   def __del__(self):
+    self._canalUpdateScheduler.cancel()
     slicer.mrmlScene.RemoveObserver(self._removeNodeObserver)
 
   @vtk.calldata_type(vtk.VTK_OBJECT)
@@ -46,6 +51,9 @@ class RFAnnotationCanalWidget(qt.QWidget):
         self.currentCanal = None
 
       canal = self.canals[nodeId]
+      if canal in self._modifiedCanals:
+        self._modifiedCanals.remove(canal)
+      self.logic.removeModelGeometry(canal.modelNode)
       canal.deleteFromScene()
       self.canals.pop(nodeId)
 
@@ -107,6 +115,7 @@ class RFAnnotationCanalWidget(qt.QWidget):
       if canalID in self.canals:
         self.canals.pop(canalID)
 
+      self.logic.removeModelGeometry(self.currentCanal.modelNode)
       self.currentCanal.deleteFromScene()
       self.currentCanal = None
 
@@ -146,7 +155,19 @@ class RFAnnotationCanalWidget(qt.QWidget):
   def onMarkupPointsModified(self, canal):
     self.currentCanal = canal
     self.updateUI(enablePlaceMode=None)
-    self.updateModelFromSegmentMarkupNode()
+
+    # Point events are coalesced, canal models are drafts while the points are dragged
+    if canal not in self._modifiedCanals:
+      self._modifiedCanals.append(canal)
+    self._canalUpdateScheduler.requestUpdate()
+
+  def updateModifiedCanalModels(self, isDraft=False):
+    for canal in self._modifiedCanals:
+      if canal.isPresentInScene():
+        self.logic.updateModelFromMarkup(canal.markupNode, canal.modelNode, isDraft=isDraft, radius=canal.radius)
+
+    if not isDraft:
+      self._modifiedCanals = []
 
   def onEndPlacingFiducial(self, *args):
     if self.currentCanal is not None:
@@ -181,21 +202,57 @@ class RFAnnotationCanalLogic(object):
   def __init__(self):
     self.radius = 1.0
     self.numberOfLineSegmentsBetweenControlPoints = 15
+    self.draftNumberOfLineSegmentsBetweenControlPoints = 5
     self.interpolationType = slicer.vtkMRMLMarkupsToModelNode.KochanekSpline
     self.polynomialFitType = slicer.vtkMRMLMarkupsToModelNode.MovingLeastSquares
     self.curveGenerator = slicer.vtkCurveGenerator()
+    # Canal geometries of the Kochanek spline models, by model node ID
+    self._geometries = {}
 
-  def updateModelFromMarkup(self, inputMarkup, outputModel):
+  def updateModelFromMarkup(self, inputMarkup, outputModel, isDraft=False, radius=None):
     """
     Update model to enclose all points in the input markup list
+    Draft models are sampled with less line segments between control points. The logic radius is used if radius is None.
+    Kochanek spline canals are incrementally updated by RFCanalGeometry, only the segments around the modified points are
+    computed again.
     """
-    markupsToModel = slicer.modules.markupstomodel.logic()
     tubeLoop = False
     tubeNumberOfSides = 8
     cleanMarkups = True
     polynomialOrder = 3
+    radius = self.radius if radius is None else radius
+    numberOfLineSegments = self.draftNumberOfLineSegmentsBetweenControlPoints if isDraft else \
+      self.numberOfLineSegmentsBetweenControlPoints
+
+    if self.interpolationType == slicer.vtkMRMLMarkupsToModelNode.KochanekSpline:
+      geometry = self._geometries.get(outputModel.GetID())
+      if geometry is None:
+        geometry = RFCanalGeometry(numberOfSides=tubeNumberOfSides)
+        self._geometries[outputModel.GetID()] = geometry
+
+      geometry.update(self.getControlPointPositions(inputMarkup), radius, numberOfLineSegments)
+      if outputModel.GetPolyData() is not geometry.polyData:
+        outputModel.SetAndObservePolyData(geometry.polyData)
+      return
+
     # Create Canal from points
+    markupsToModel = slicer.modules.markupstomodel.logic()
     markupsToModel.UpdateOutputCurveModel( inputMarkup, outputModel,
-      self.interpolationType, tubeLoop, self.radius, tubeNumberOfSides, self.numberOfLineSegmentsBetweenControlPoints,
+      self.interpolationType, tubeLoop, radius, tubeNumberOfSides, numberOfLineSegments,
       cleanMarkups, polynomialOrder, slicer.vtkMRMLMarkupsToModelNode.RawIndices, self.curveGenerator,
-      self.polynomialFitType )
\ No newline at end of file
+      self.polynomialFitType )
+
+  def removeModelGeometry(self, modelNode):
+    """Releases the canal geometry cached for the model node"""
+    if modelNode is not None:
+      self._geometries.pop(modelNode.GetID(), None)
+
+  @staticmethod
+  def getControlPointPositions(markupNode):
+    """Returns the (N, 3) world positions of the markup control points"""
+    positions = np.zeros((markupNode.GetNumberOfControlPoints(), 3))
+    coord = [0, 0, 0]
+    for i in range(len(positions)):
+      markupNode.GetNthControlPointPositionWorld(i, coord)
+      positions[i] = coord
+    return positions
@@ -0,0 +1,174 @@
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+
+class RFCanalGeometry(object):
+  """
+  Tube geometry of a canal, incrementally updated when its control points are modified.
+
+  The canal center line is the uniform Catmull-Rom spline of the control points, which is the Kochanek spline with null
+  tension, bias and continuity, parametrized by the control point indices. As with the default end constraints of
+  vtkKochanekSpline used by the markupstomodel curve generator, the derivative is null at both curve ends. Each spline
+  segment only depends on the 4 surrounding control points : when a point is moved, only the 4 segments around it are
+  sampled again. The tube rings of the other segments are taken from the segment cache.
+
+  The tube polydata is created once and its point and normal arrays are updated in place. Cells are only rebuilt when the
+  number of tube rings changes.
+  """
+
+  # Maximum absolute cosine between the center line tangent and the reference axis of the tube frames
+  maximumReferenceAlignment = 0.95
+
+  def __init__(self, numberOfSides=8):
+    self.numberOfSides = numberOfSides
+    self.polyData = vtk.vtkPolyData()
+    self._points = vtk.vtkPoints()
+    self._points.SetDataTypeToFloat()
+    self._normals = vtk.vtkFloatArray()
+    self._normals.SetName("Normals")
+    self._normals.SetNumberOfComponents(3)
+    self.polyData.SetPoints(self._points)
+    self.polyData.GetPointData().SetNormals(self._normals)
+    self._numberOfRings = 0
+    self._referenceAxis = None
+    self._segmentCache = {}
+    self._writtenSegmentKeys = []
+
+  def clear(self):
+    self._segmentCache = {}
+    self._writtenSegmentKeys = []
+    self._referenceAxis = None
+    self._setNumberOfRings(0)
+    self.polyData.Modified()
+
+  def update(self, controlPoints, radius, numberOfLineSegmentsBetweenControlPoints):
+    """
+    Updates the tube polydata for the (N, 3) control points. Returns the number of spline segments sampled again.
+    """
+    controlPoints = self.removeDuplicatedPoints(np.asarray(controlPoints, dtype=np.float64).reshape(-1, 3))
+    if len(controlPoints) < 2:
+      self.clear()
+      return 0
+
+    samplesPerSegment = max(1, int(numberOfLineSegmentsBetweenControlPoints))
+    numberOfSegments = len(controlPoints) - 1
+    # Repeating the second and the second to last points nulls the derivative at the curve ends
+    extendedPoints = np.concatenate([[controlPoints[1]], controlPoints, [controlPoints[-2]]])
+
+    segmentKeys = [(extendedPoints[i:i + 4].tobytes(), samplesPerSegment, radius) for i in range(numberOfSegments)]
+    changedSegments = [i for i, key in enumerate(segmentKeys) if key not in self._segmentCache]
+    if self._referenceAxis is None or not self._isReferenceAxisValid(extendedPoints, changedSegments, samplesPerSegment):
+      # Tube frames changed, every ring is computed again
+      self._referenceAxis = self.referenceAxis(controlPoints)
+      self._segmentCache = {}
+      self._writtenSegmentKeys = []
+      changedSegments = list(range(numberOfSegments))
+
+    # Segments are cached by control points, the rings of shifted segments are reused when points are added or removed
+    u = np.arange(samplesPerSegment) / samplesPerSegment
+    for i in changedSegments:
+      self._segmentCache[segmentKeys[i]] = self._rings(extendedPoints[i:i + 4], u, radius)
+    self._segmentCache = {key: self._segmentCache[key] for key in segmentKeys}
+
+    if self._setNumberOfRings(numberOfSegments * samplesPerSegment + 1):
+      self._writtenSegmentKeys = []
+    ringPoints = vtk_to_numpy(self._points.GetData()).reshape(self._numberOfRings, self.numberOfSides, 3)
+    ringNormals = vtk_to_numpy(self._normals).reshape(self._numberOfRings, self.numberOfSides, 3)
+    for i, key in enumerate(segmentKeys):
+      if i < len(self._writtenSegmentKeys) and self._writtenSegmentKeys[i] == key:
+        continue
+      points, normals = self._segmentCache[key]
+      ringPoints[i * samplesPerSegment:(i + 1) * samplesPerSegment] = points
+      ringNormals[i * samplesPerSegment:(i + 1) * samplesPerSegment] = normals
+    self._writtenSegmentKeys = segmentKeys
+
+    # Last ring, at the end of the last segment
+    lastRingPoints, lastRingNormals = self._rings(extendedPoints[-4:], np.ones(1), radius)
+    ringPoints[-1] = lastRingPoints[0]
+    ringNormals[-1] = lastRingNormals[0]
+
+    self._points.Modified()
+    self._normals.Modified()
+    self.polyData.Modified()
+    return len(changedSegments)
+
+  @staticmethod
+  def removeDuplicatedPoints(controlPoints):
+    if len(controlPoints) < 2:
+      return controlPoints
+    isDuplicated = np.all(np.isclose(controlPoints[1:], controlPoints[:-1]), axis=1)
+    return controlPoints[np.concatenate([[True], ~isDuplicated])]
+
+  @staticmethod
+  def splinePositionsAndTangents(segmentPoints, u):
+    """
+    Returns the positions and unit tangents of the Catmull-Rom spline segment between segmentPoints[1] and
+    segmentPoints[2] at the u parameters in [0, 1]
+    """
+    p0, p1, p2, p3 = segmentPoints
+    a = 2 * p1
+    b = p2 - p0
+    c = 2 * p0 - 5 * p1 + 4 * p2 - p3
+    d = -p0 + 3 * p1 - 3 * p2 + p3
+    u = u.reshape(-1, 1)
+    positions = 0.5 * (a + b * u + c * u ** 2 + d * u ** 3)
+    tangents = 0.5 * (b + 2 * c * u + 3 * d * u ** 2)
+    norms = np.linalg.norm(tangents, axis=1, keepdims=True)
+    # Degenerated tangents (coincident points) fall back to the segment direction
+    tangents = np.where(norms > 1e-9, tangents / np.maximum(norms, 1e-9), (p2 - p1) / max(np.linalg.norm(p2 - p1), 1e-9))
+    return positions, tangents
+
+  @staticmethod
+  def referenceAxis(controlPoints):
+    """Returns the coordinate axis the least aligned with the canal direction, used to orient the tube rings"""
+    direction = controlPoints[-1] - controlPoints[0]
+    if np.linalg.norm(direction) < 1e-9:
+      direction = controlPoints[1] - controlPoints[0]
+    return np.eye(3)[int(np.argmin(np.abs(direction)))]
+
+  def _isReferenceAxisValid(self, extendedPoints, segments, samplesPerSegment):
+    u = np.arange(samplesPerSegment + 1) / samplesPerSegment
+    for i in segments:
+      _, tangents = self.splinePositionsAndTangents(extendedPoints[i:i + 4], u)
+      if np.max(np.abs(np.dot(tangents, self._referenceAxis))) > self.maximumReferenceAlignment:
+        return False
+    return True
+
+  def _rings(self, segmentPoints, u, radius):
+    """Returns the (len(u), numberOfSides, 3) tube ring points and normals of a spline segment"""
+    positions, tangents = self.splinePositionsAndTangents(segmentPoints, u)
+    normals = self._referenceAxis - np.dot(tangents, self._referenceAxis)[:, None] * tangents
+    normals /= np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-9)
+    binormals = np.cross(tangents, normals)
+
+    angles = 2 * np.pi * np.arange(self.numberOfSides) / self.numberOfSides
+    ringNormals = np.cos(angles)[None, :, None] * normals[:, None, :] + np.sin(angles)[None, :, None] * binormals[:, None, :]
+    return positions[:, None, :] + radius * ringNormals, ringNormals
+
+  def _setNumberOfRings(self, numberOfRings):
+    """Resizes the point arrays and rebuilds the tube cells if the number of rings changed. Returns True if changed."""
+    if numberOfRings == self._numberOfRings:
+      return False
+
+    self._numberOfRings = numberOfRings
+    sides = self.numberOfSides
+    self._points.SetNumberOfPoints(numberOfRings * sides)
+    self._normals.SetNumberOfTuples(numberOfRings * sides)
+
+    polys = vtk.vtkCellArray()
+    if numberOfRings > 1:
+      ring = np.arange(numberOfRings - 1).reshape(-1, 1) * sides
+      side = np.arange(sides).reshape(1, -1)
+      nextSide = (side + 1) % sides
+      quads = np.stack([ring + side, ring + nextSide, ring + sides + nextSide, ring + sides + side], axis=-1).reshape(-1, 4)
+      cells = np.concatenate([np.full((len(quads), 1), 4), quads], axis=1)
+      # Caps closing both tube ends
+      firstCap = np.concatenate([[sides], np.arange(sides)[::-1]])
+      lastCap = np.concatenate([[sides], (numberOfRings - 1) * sides + np.arange(sides)])
+      cellIds = vtk.vtkIdTypeArray()
+      cellIds.SetNumberOfTuples(cells.size + 2 * (sides + 1))
+      vtk_to_numpy(cellIds)[:] = np.concatenate([cells.reshape(-1), firstCap, lastCap])
+      polys.SetCells(len(quads) + 2, cellIds)
+    self.polyData.SetPolys(polys)
+    return True
@@ -1,10 +1,16 @@
+from collections import OrderedDict
+
+import numpy as np
 import qt
 import slicer
 import vtk
+from slicer.ScriptedLoadableModule import ScriptedLoadableModuleTest
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
 
 from RFAnnotationLib import getLineResolutionFromLineLength, getOrCreateTableColumn, getCurrentLayout
 from RFVisualizationLib import RFLayoutType
-from RFViewerHomeLib import translatable, removeNodeFromMRMLScene, nodeID
+from RFViewerHomeLib import translatable, removeNodeFromMRMLScene, nodeID, UpdateScheduler
+from RFPanoramaLib import CurvedPlanarReformatLogic
 
 
 #
@@ -16,6 +22,7 @@ class RFLineProfileWidget(qt.QWidget):
   def __init__(self, parent=None):
     qt.QWidget.__init__(self, parent)
     self.logic = RFLineProfileLogic()
+    self.currentMarkupNode = None
     mainLayout = qt.QFormLayout()
 
     #
@@ -25,33 +32,45 @@ class RFLineProfileWidget(qt.QWidget):
     self.applyButton.enabled = False
     mainLayout.addRow(self.applyButton)
 
+    #
+    # Multi profile mode
+    #
+    self.compareCheckBox = qt.QCheckBox(self.tr("Compare all lines"))
+    self.compareCheckBox.toolTip = self.tr("Plot the intensity profiles of all the lines and curves at once")
+    mainLayout.addRow(self.compareCheckBox)
+
     self.setLayout(mainLayout)
 
     # connections
     self.applyButton.connect('clicked(bool)', self.onApplyButton)
+    self.compareCheckBox.connect('toggled(bool)', self.onCompareToggled)
+    self._sceneObservers = [slicer.mrmlScene.AddObserver(event, self.onSceneNodesModified) for event in
+                            [slicer.vtkMRMLScene.NodeAddedEvent, slicer.vtkMRMLScene.NodeRemovedEvent]]
 
     # Refresh Apply button state
     self.enableApplyButton()
 
   def __del__(self):
-    self.logic.setAutoUpdate(False)
+    for observer in self._sceneObservers:
+      slicer.mrmlScene.RemoveObserver(observer)
 
   def reinitialize(self, markupNode):
     self.logic = RFLineProfileLogic()
-    self.logic.setMarkupNode(markupNode)
+    self.currentMarkupNode = markupNode
+    self.updateProfiledMarkupNodes()
 
     if getCurrentLayout() == RFLayoutType.RFLineProfileLayout:
       self.logic.showPlot()
 
   def getParameterDict(self):
     return {
-      'PlotSerieID': nodeID(self.logic.plotSeriesNode),
-      'TableID': nodeID(self.logic.tableNode),
+      'PlotSerieID': ",".join(nodeID(node) for node in self.logic.nodePool.plotSeriesNodes()),
+      'TableID': ",".join(nodeID(node) for node in self.logic.nodePool.tableNodes()),
       'PlotChartID': nodeID(self.logic.plotChartNode)
     }
 
   def enableApplyButton(self):
-    self.applyButton.enabled = self.logic.getInputVolumeNode() and self.currentMarkupNode
+    self.applyButton.enabled = bool(self.logic.getInputVolumeNode() and (self.currentMarkupNode or self.isComparing()))
 
   def onApplyButton(self):
     self.logic.showPlot()
@@ -62,31 +81,252 @@ class RFLineProfileWidget(qt.QWidget):
   def setMarkupNode(self, node):
     self.currentMarkupNode = node
     self.enableApplyButton()
-    self.logic.setMarkupNode(node)
+    self.updateProfiledMarkupNodes()
+
+  def isComparing(self):
+    return self.compareCheckBox.checked
+
+  def onCompareToggled(self, isComparing):
+    self.enableApplyButton()
+    self.updateProfiledMarkupNodes()
+
+  @vtk.calldata_type(vtk.VTK_OBJECT)
+  def onSceneNodesModified(self, caller, event, node):
+    if self.isComparing() and self.isProfileableMarkupNode(node):
+      self.updateProfiledMarkupNodes()
+
+  def updateProfiledMarkupNodes(self):
+    """Profiles all the lines and curves of the scene in compare mode, the current markup otherwise"""
+    if self.isComparing():
+      self.logic.setMarkupNodes(self.profileableMarkupNodes())
+    else:
+      self.logic.setMarkupNode(self.currentMarkupNode)
+
+  @staticmethod
+  def isProfileableMarkupNode(node):
+    """Lines and curves, except the hidden ones used internally (e.g. temporary curves of the panorama)"""
+    return isinstance(node, (slicer.vtkMRMLMarkupsLineNode, slicer.vtkMRMLMarkupsCurveNode)) and \
+      not node.GetHideFromEditors()
+
+  @classmethod
+  def profileableMarkupNodes(cls):
+    markupNodes = slicer.util.getNodesByClass('vtkMRMLMarkupsLineNode') + \
+      slicer.util.getNodesByClass('vtkMRMLMarkupsCurveNode')
+    return [markupNode for markupNode in markupNodes if cls.isProfileableMarkupNode(markupNode)]
+
+#
+# RFProfileSampler
+#
+class RFProfileSampler(object):
+  """
+  Samples the intensity profiles of markups in volumes, shared by all the profiles of a line profile logic.
+
+  The sampled array and the RAS to IJK matrix of the last sampled volume are cached while its image data and transform
+  are unchanged. The last profile of each markup is cached as well : when only one of the compared lines is moved, the
+  other ones are not probed again.
+  """
+
+  def __init__(self, maximumNumberOfCachedProfiles=64):
+    self.maximumNumberOfCachedProfiles = maximumNumberOfCachedProfiles
+    # (volume state, volume array) of the last sampled volume
+    self._volumeCache = None
+    self._profileCache = OrderedDict()
+
+  def clear(self):
+    self._volumeCache = None
+    self._profileCache.clear()
+
+  def sampleProfile(self, markupNode, volumeNode, maximumNumberOfSamples=None):
+    """
+    Returns the (distances, intensities) numpy arrays of the profile of the markup line or curve in the volume,
+    None if the markup has less than 2 points.
+    """
+    if markupNode.GetNumberOfDefinedControlPoints() < 2:
+      return None
+
+    curvePoints_RAS = markupNode.GetCurvePointsWorld()
+    volumeState, rasToIJK, volumeArray = self._getVolumeSamplingData(volumeNode)
+    profileKey = (markupNode.GetID(), volumeNode.GetID())
+    profileState = (markupNode.GetMTime(), curvePoints_RAS.GetMTime(), volumeState, maximumNumberOfSamples)
+    cachedProfile = self._profileCache.get(profileKey)
+    if cachedProfile is not None and cachedProfile[0] == profileState:
+      self._profileCache.move_to_end(profileKey)
+      return cachedProfile[1]
+
+    isClosedCurve = markupNode.IsA('vtkMRMLClosedCurveNode')
+    curveLengthMm = slicer.vtkMRMLMarkupsCurveNode.GetCurveLength(curvePoints_RAS, isClosedCurve)
+    lineResolution = getLineResolutionFromLineLength(curveLengthMm)
+
+    numberOfSamples = max(2, int(round(lineResolution)) + 1)
+    if maximumNumberOfSamples is not None:
+      numberOfSamples = min(numberOfSamples, maximumNumberOfSamples)
+    sampledPoints_RAS = self.resampleCurvePoints(vtk_to_numpy(curvePoints_RAS.GetData()), numberOfSamples, isClosedCurve)
+    if rasToIJK is not None:
+      sampledPoints_IJK = np.dot(sampledPoints_RAS, rasToIJK[0:3, 0:3].T) + rasToIJK[0:3, 3]
+    else:
+      sampledPoints_IJK = vtk_to_numpy(self._transformRASToIJK(sampledPoints_RAS, volumeNode).GetPoints().GetData())
+    intensities = CurvedPlanarReformatLogic.sampleTrilinear(volumeArray, sampledPoints_IJK[:, 2], sampledPoints_IJK[:, 1],
+                                                           sampledPoints_IJK[:, 0])
+
+    profile = (np.linspace(0, curveLengthMm, numberOfSamples), intensities)
+    self._profileCache[profileKey] = (profileState, profile)
+    self._profileCache.move_to_end(profileKey)
+    while len(self._profileCache) > self.maximumNumberOfCachedProfiles:
+      self._profileCache.popitem(last=False)
+    return profile
+
+  def _getVolumeSamplingData(self, volumeNode):
+    """
+    Returns the cache state, RAS to IJK matrix (None under a non linear transform) and (K, J, I) array of the volume first
+    component.
+    """
+    imageData = volumeNode.GetImageData()
+    rasToIJK = self.getRASToIJKArray(volumeNode)
+    parentTransformNode = volumeNode.GetParentTransformNode()
+    # The modification time is global to VTK objects : replaced image data have another one
+    volumeState = (volumeNode.GetID(), imageData.GetMTime(), None if rasToIJK is None else rasToIJK.tobytes(),
+                   nodeID(parentTransformNode), parentTransformNode.GetMTime() if parentTransformNode else 0)
+
+    if self._volumeCache is not None and self._volumeCache[0] == volumeState:
+      return volumeState, rasToIJK, self._volumeCache[1]
+
+    # Only the current volume is kept, the array of a previous volume is released
+    self._volumeCache = None
+    volumeArray = slicer.util.arrayFromVolume(volumeNode)
+    if volumeArray.ndim > 3:
+      volumeArray = np.ascontiguousarray(volumeArray[..., 0])
+    self._volumeCache = (volumeState, volumeArray)
+    return volumeState, rasToIJK, volumeArray
+
+  @staticmethod
+  def resampleCurvePoints(curvePoints_RAS, numberOfSamples, isClosedCurve):
+    """Returns numberOfSamples points equally spaced along the (N, 3) curve polyline, end points included"""
+    if isClosedCurve:
+      curvePoints_RAS = np.concatenate([curvePoints_RAS, curvePoints_RAS[:1]])
+    segmentLengths = np.linalg.norm(np.diff(curvePoints_RAS, axis=0), axis=1)
+    curvePointDistances = np.concatenate([[0], np.cumsum(segmentLengths)])
+    sampleDistances = np.linspace(0, curvePointDistances[-1], numberOfSamples)
+    return np.stack([np.interp(sampleDistances, curvePointDistances, curvePoints_RAS[:, axis]) for axis in range(3)], axis=1)
+
+  @staticmethod
+  def getRASToIJKArray(volume):
+    """Returns the RAS to IJK matrix of the volume as a numpy array, None if the volume is under a non linear transform"""
+    rasToIJK = vtk.vtkMatrix4x4()
+    volume.GetRASToIJKMatrix(rasToIJK)
+    rasToIJKArray = slicer.util.arrayFromVTKMatrix(rasToIJK)
+    parentTransformNode = volume.GetParentTransformNode()
+    if parentTransformNode is None:
+      return rasToIJKArray
+    if not parentTransformNode.IsTransformToWorldLinear():
+      return None
+
+    worldToParent = vtk.vtkMatrix4x4()
+    parentTransformNode.GetMatrixTransformFromWorld(worldToParent)
+    return np.dot(rasToIJKArray, slicer.util.arrayFromVTKMatrix(worldToParent))
+
+  @staticmethod
+  def _transformRASToIJK(points_RAS, volume):
+    # Non linear transforms cannot be expressed as a matrix, the points are transformed by the
+    # general transform between the world and the volume, as it is done for display.
+    inputVolumeToIJK = vtk.vtkMatrix4x4()
+    volume.GetRASToIJKMatrix(inputVolumeToIJK)
+    rasToInputVolumeTransform = vtk.vtkGeneralTransform()
+    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(None, volume.GetParentTransformNode(), rasToInputVolumeTransform)
+    rasToIJKTransform = vtk.vtkGeneralTransform()
+    rasToIJKTransform.Concatenate(inputVolumeToIJK)
+    rasToIJKTransform.Concatenate(rasToInputVolumeTransform)
+
+    curvePoints_RAS = vtk.vtkPoints()
+    curvePoints_RAS.SetData(numpy_to_vtk(np.ascontiguousarray(points_RAS, dtype=np.float64), deep=True))
+    curvePoly_RAS = vtk.vtkPolyData()
+    curvePoly_RAS.SetPoints(curvePoints_RAS)
+
+    transformRasToIjk = vtk.vtkTransformPolyDataFilter()
+    transformRasToIjk.SetInputData(curvePoly_RAS)
+    transformRasToIjk.SetTransform(rasToIJKTransform)
+    transformRasToIjk.Update()
+    return transformRasToIjk.GetOutput()
+
+#
+# RFLineProfileNodePool
+#
+class RFLineProfileNodePool(object):
+  """
+  Table and plot series nodes of the line profiles. Nodes released by a profile are emptied and kept for the next
+  profile instead of being removed from the scene.
+  """
+
+  def __init__(self):
+    self._nodes = []
+    self._freeNodes = []
+
+  def acquire(self):
+    """Returns a (tableNode, plotSeriesNode) pair"""
+    if self._freeNodes:
+      return self._freeNodes.pop()
+
+    nodes = (slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode"),
+             slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode"))
+    self._nodes.append(nodes)
+    return nodes
+
+  def release(self, nodes):
+    nodes[0].GetTable().SetNumberOfRows(0)
+    self._freeNodes.append(nodes)
+
+  def tableNodes(self):
+    return [tableNode for tableNode, _ in self._nodes]
+
+  def plotSeriesNodes(self):
+    return [plotSeriesNode for _, plotSeriesNode in self._nodes]
+
+  def clear(self):
+    """Removes all the pooled nodes from the scene"""
+    for nodes in self._nodes:
+      for node in nodes:
+        removeNodeFromMRMLScene(node)
+    self._nodes = []
+    self._freeNodes = []
 
 #
 # RFLineProfileLogic
 #
 @translatable
 class RFLineProfileLogic(object):
+  """
+  Intensity profiles of one or several line / curve markups, plotted in the same chart.
+  Each profiled markup has a table and a plot series node taken from the node pool, sampled by the shared sampler.
+  """
 
-  def __init__(self):
+  # Plot colors of the successive profiles
+  profileColors = [(0.0, 0.0, 0.9), (0.9, 0.0, 0.0), (0.0, 0.6, 0.0), (0.9, 0.5, 0.0), (0.6, 0.0, 0.8), (0.0, 0.7, 0.7)]
+
+  def __init__(self, sampler=None):
     self.inputVolumeNode = None
-    self.markupNode = None
-    self.markupObservation = None
-    self.tableNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLTableNode")
     self.distanceArrayName = "Distance"
     self.intensityArrayName = "Intensity"
-
-    self.plotSeriesNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotSeriesNode")
+    # Maximum number of profile samples while the line is dragged
+    self.draftNumberOfSamples = 256
+    self.sampler = sampler if sampler is not None else RFProfileSampler()
+    self.nodePool = RFLineProfileNodePool()
+    self._profiles = []
+    self._updateScheduler = UpdateScheduler(self.update)
 
     self.plotChartNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLPlotChartNode")
     self.plotChartNode.SetXAxisTitle(self.tr("Distance (mm)"))
     self.plotChartNode.SetYAxisTitle(self.tr("Intensity"))
-    self.plotChartNode.AddAndObservePlotSeriesNodeID(self.plotSeriesNode.GetID())
 
   def __del__(self):
-    self.setMarkupObservation(False)
+    self._updateScheduler.cancel()
+    self.setMarkupNodes([])
+
+  @property
+  def markupNode(self):
+    return self._profiles[0]["markupNode"] if self._profiles else None
+
+  @property
+  def markupNodes(self):
+    return [profile["markupNode"] for profile in self._profiles]
 
   def setInputVolumeNode(self, volumeNode):
     self.inputVolumeNode = volumeNode
@@ -96,79 +336,71 @@ class RFLineProfileLogic(object):
     return self.inputVolumeNode
 
   def setMarkupNode(self, markupNode):
-    if self.markupNode == markupNode:
+    self.setMarkupNodes([markupNode] if markupNode is not None else [])
+
+  def setMarkupNodes(self, markupNodes):
+    """Plots the profiles of the input markups. Profiles of the markups already plotted are kept."""
+    markupNodes = [markupNode for markupNode in markupNodes if markupNode is not None]
+    if markupNodes == self.markupNodes:
       return
 
-     # remove old observers
-    self.setMarkupObservation(False)
-    self.markupNode = markupNode
+    profilesByMarkup = {id(profile["markupNode"]): profile for profile in self._profiles}
+    for profile in self._profiles:
+      if profile["markupNode"] not in markupNodes:
+        self._releaseProfile(profile)
+    self._profiles = [profilesByMarkup.get(id(markupNode)) or self._createProfile(markupNode) for markupNode in markupNodes]
 
-    if self.markupNode is not None:
-      # add new observers
-      self.setMarkupObservation(True)
-      self.plotSeriesNode.SetName(self.markupNode.GetName())
+    for profileIndex, profile in enumerate(self._profiles):
+      profile["plotSeriesNode"].SetColor(*self.profileColors[profileIndex % len(self.profileColors)])
 
     self.update()
 
-  def update(self):
+  def _createProfile(self, markupNode):
+    tableNode, plotSeriesNode = self.nodePool.acquire()
+    for columnName in [self.distanceArrayName, self.intensityArrayName]:
+      getOrCreateTableColumn(tableNode, columnName)
+
+    plotSeriesNode.SetName(markupNode.GetName())
+    plotSeriesNode.SetAndObserveTableNodeID(tableNode.GetID())
+    plotSeriesNode.SetXColumnName(self.distanceArrayName)
+    plotSeriesNode.SetYColumnName(self.intensityArrayName)
+    plotSeriesNode.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
+    plotSeriesNode.SetMarkerStyle(slicer.vtkMRMLPlotSeriesNode.MarkerStyleNone)
+    self.plotChartNode.AddAndObservePlotSeriesNodeID(plotSeriesNode.GetID())
+
+    observation = markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onLineModified)
+    return {"markupNode": markupNode, "tableNode": tableNode, "plotSeriesNode": plotSeriesNode,
+            "observation": observation}
+
+  def _releaseProfile(self, profile):
+    profile["markupNode"].RemoveObserver(profile["observation"])
+    self.plotChartNode.RemovePlotSeriesNodeID(profile["plotSeriesNode"].GetID())
+    self.nodePool.release((profile["tableNode"], profile["plotSeriesNode"]))
+
+  def update(self, isDraft=False):
     if self.inputVolumeNode is None:
       return
-    if self.markupNode is None:
-      # reinitialize plot in order to show empty plot
-      self.reinitializePlot()
-    else:
-      self.updateOutputTable()
-    self.updatePlot()
+    for profile in self._profiles:
+      self.updateOutputTable(profile, isDraft)
 
     # We are already in plot view
     if getCurrentLayout() == slicer.vtkMRMLLayoutNode.SlicerLayoutFourUpPlotView:
       # Reinitialize the view in order to fit the whole plot
       slicer.app.layoutManager().plotWidget(0).plotView().fitToContent()
 
-  def setMarkupObservation(self, enable):
-    if self.markupObservation:
-      self.markupNode.RemoveObserver(self.markupObservation)
-      self.markupObservation = None
-    if enable and (self.markupNode is not None):
-      self.markupObservation = self.markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self.onLineModified)
-
   def onLineModified(self, caller=None, event=None):
-    self.update()
-
-  def updatePlot(self):
-    if self.plotSeriesNode is None:
+    # Point events are coalesced, the profile is sampled with less points while the line is dragged
+    self._updateScheduler.requestUpdate()
+
+  def updateOutputTable(self, profile, isDraft=False):
+    sampledProfile = self.sampler.sampleProfile(profile["markupNode"], self.inputVolumeNode,
+                                                self.draftNumberOfSamples if isDraft else None)
+    if sampledProfile is None:
+      profile["tableNode"].GetTable().SetNumberOfRows(0)
+      profile["tableNode"].GetTable().Modified()
       return
-    # Create plot
-    self.plotSeriesNode.SetAndObserveTableNodeID(self.tableNode.GetID())
-    self.plotSeriesNode.SetXColumnName(self.distanceArrayName)
-    self.plotSeriesNode.SetYColumnName(self.intensityArrayName)
-    self.plotSeriesNode.SetPlotType(slicer.vtkMRMLPlotSeriesNode.PlotTypeScatter)
-    self.plotSeriesNode.SetMarkerStyle(slicer.vtkMRMLPlotSeriesNode.MarkerStyleNone)
-    self.plotSeriesNode.SetColor(0.0, 0.0, 0.9)
-
-  def reinitializePlot(self):
-    for columnName in [self.distanceArrayName, self.intensityArrayName]:
-      getOrCreateTableColumn(self.tableNode, columnName).Initialize()
-
-  def updateOutputTable(self):
-    if self.markupNode.GetNumberOfDefinedControlPoints() < 2:
-      self.tableNode.GetTable().SetNumberOfRows(0)
-      return
-
-    curvePoints_RAS = self.markupNode.GetCurvePointsWorld()
-    isClosedCurve = self.markupNode.IsA('vtkMRMLClosedCurveNode')
-    curveLengthMm = slicer.vtkMRMLMarkupsCurveNode.GetCurveLength(curvePoints_RAS, isClosedCurve)
-    lineResolution = getLineResolutionFromLineLength(curveLengthMm)
-
-    curvePoly_IJK = self._transformRASToIJK(curvePoints_RAS, self.inputVolumeNode)
-    curvePoints_IJK = curvePoly_IJK.GetPoints()
-
-    self._moveCurvePointsEndPointsToFitSingleSliceVolume(curvePoints_IJK, self.inputVolumeNode)
 
-    samplingDistance = curveLengthMm / lineResolution
-    probedPoints = self._probeVolumeAlongCurve(curvePoints_IJK, samplingDistance, isClosedCurve, self.inputVolumeNode)
-
-    self._createArrayOfData(probedPoints, curveLengthMm)
+    self._createArrayOfData(profile["tableNode"], *sampledProfile)
 
   def showPlot(self):
     # Show plot in layout
@@ -176,85 +408,18 @@ class RFLineProfileLogic(object):
     slicer.modules.plots.logic().ShowChartInLayout(self.plotChartNode)
     slicer.app.layoutManager().plotWidget(0).plotView().fitToContent()
 
-  def _transformRASToIJK(self, curvePoints_RAS, volume):
-    # Need to get the start/end point of the line in the IJK coordinate system
-    # as VTK filters cannot take into account direction cosines
-    # We transform the curve points from RAS coordinate system (instead of directly from the inputCurve coordinate system)
-    # to make sure the curve is transformed to RAS exactly the same way as it is done for display.
-    inputVolumeToIJK = vtk.vtkMatrix4x4()
-    volume.GetRASToIJKMatrix(inputVolumeToIJK)
-    rasToInputVolumeTransform = vtk.vtkGeneralTransform()
-    slicer.vtkMRMLTransformNode.GetTransformBetweenNodes(None, volume.GetParentTransformNode(), rasToInputVolumeTransform)
-    rasToIJKTransform = vtk.vtkGeneralTransform()
-    rasToIJKTransform.Concatenate(inputVolumeToIJK)
-    rasToIJKTransform.Concatenate(rasToInputVolumeTransform)
-
-    curvePoly_RAS = vtk.vtkPolyData()
-    curvePoly_RAS.SetPoints(curvePoints_RAS)
-
-    transformRasToIjk = vtk.vtkTransformPolyDataFilter()
-    transformRasToIjk.SetInputData(curvePoly_RAS)
-    transformRasToIjk.SetTransform(rasToIJKTransform)
-    transformRasToIjk.Update()
-    return transformRasToIjk.GetOutput()
-
-  def _moveCurvePointsEndPointsToFitSingleSliceVolume(self, curvePoints_IJK, inputVolume):
-    startPointIndex = 0
-    endPointIndex = curvePoints_IJK.GetNumberOfPoints() - 1
-    lineStartPoint_IJK = curvePoints_IJK.GetPoint(startPointIndex)
-    lineEndPoint_IJK = curvePoints_IJK.GetPoint(endPointIndex)
-
-    # Special case: single-slice volume
-    # vtkProbeFilter treats vtkImageData as a general data set and it considers its bounds to end
-    # in the middle of edge voxels. This makes single-slice volumes to have zero thickness, which
-    # can be easily missed by a line that that is drawn on the plane (e.g., they happen to be
-    # extremely on the same side of the plane, very slightly off, due to runding errors).
-    # We move the start/end points very close to the plane and force them to be on opposite sides of the plane.
-    dims = inputVolume.GetImageData().GetDimensions()
-    for axisIndex in range(3):
-      if dims[axisIndex] == 1:
-        if abs(lineStartPoint_IJK[axisIndex]) < 0.5 and abs(lineEndPoint_IJK[axisIndex]) < 0.5:
-          # both points are inside the volume plane
-          # keep their distance the same (to keep the overall length of the line he same)
-          # but make sure the points are on the opposite side of the plane (to ensure probe filter
-          # considers the line crossing the image plane)
-          pointDistance = max(abs(lineStartPoint_IJK[axisIndex]-lineEndPoint_IJK[axisIndex]), 1e-6)
-          lineStartPoint_IJK[axisIndex] = -0.5 * pointDistance
-          lineEndPoint_IJK[axisIndex] = 0.5 * pointDistance
-          curvePoints_IJK.SetPoint(startPointIndex, lineStartPoint_IJK)
-          curvePoints_IJK.SetPoint(endPointIndex, lineEndPoint_IJK)
-
-  def _probeVolumeAlongCurve(self, curvePoints_IJK, samplingDistance, isClosedCurve, volumeNode):
-    sampledCurvePoints_IJK = vtk.vtkPoints()
-    slicer.vtkMRMLMarkupsCurveNode.ResamplePoints(curvePoints_IJK, sampledCurvePoints_IJK, samplingDistance, isClosedCurve)
-
-    sampledCurvePoly_IJK = vtk.vtkPolyData()
-    sampledCurvePoly_IJK.SetPoints(sampledCurvePoints_IJK)
-
-    probeFilter = vtk.vtkProbeFilter()
-    probeFilter.SetInputData(sampledCurvePoly_IJK)
-    probeFilter.SetSourceData(volumeNode.GetImageData())
-    probeFilter.ComputeToleranceOff()
-    probeFilter.Update()
-
-    return probeFilter.GetOutput()
-
-  def _createArrayOfData(self, probedPoints, curveLengthMm):
-    # Create arrays of data
-    distanceArray = getOrCreateTableColumn(self.tableNode, self.distanceArrayName)
-    intensityArray = getOrCreateTableColumn(self.tableNode, self.intensityArrayName)
-    self.tableNode.GetTable().SetNumberOfRows(probedPoints.GetNumberOfPoints())
-    x = range(0, probedPoints.GetNumberOfPoints())
-    xStep = curveLengthMm/(probedPoints.GetNumberOfPoints()-1)
-    probedPointScalars = probedPoints.GetPointData().GetScalars()
-    for i in range(len(x)):
-      distanceArray.SetValue(i, x[i]*xStep)
-      intensityArray.SetValue(i, probedPointScalars.GetTuple(i)[0])
+  def _createArrayOfData(self, tableNode, distances, intensities):
+    # Fill the table columns at once through numpy views of the column arrays
+    distanceArray = getOrCreateTableColumn(tableNode, self.distanceArrayName)
+    intensityArray = getOrCreateTableColumn(tableNode, self.intensityArrayName)
+    tableNode.GetTable().SetNumberOfRows(len(distances))
+    vtk_to_numpy(distanceArray)[:] = distances
+    vtk_to_numpy(intensityArray)[:] = intensities
     distanceArray.Modified()
     intensityArray.Modified()
-    self.tableNode.GetTable().Modified()
+    tableNode.GetTable().Modified()
 
-class RFLineProfileTest():
+class RFLineProfileTest(ScriptedLoadableModuleTest):
   """
   This is the test case for your scripted module.
   Uses ScriptedLoadableModuleTest base class, available at:
@@ -271,6 +436,16 @@ class RFLineProfileTest():
     """
     self.setUp()
     self.test_RFLineProfile1()
+    self.setUp()
+    self.test_SampleProfile()
+    self.setUp()
+    self.test_SampleProfileUnderLinearTransform()
+    self.setUp()
+    self.test_SampleProfileOfSingleSliceVolume()
+    self.setUp()
+    self.test_SwitchingMarkupsReusesProfileNodes()
+    self.setUp()
+    self.test_UnchangedLineIsNotProbedAgain()
 
   def test_RFLineProfile1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -296,3 +471,142 @@ class RFLineProfileTest():
 
     self.delayDisplay('Test passed!')
 
+  def test_SampleProfile(self):
+    """The profile of a line in a volume whose intensities are linear in IJK is the linear interpolation of its ends"""
+    self.delayDisplay("Starting the test")
+    volumeNode = self.createLinearVolume((6, 8, 10))
+    lineNode = self.createLine(volumeNode, (1, 1, 1), (8, 6, 4))
+    self.assertProfile(RFProfileSampler().sampleProfile(lineNode, volumeNode), lineNode, (1, 1, 1), (8, 6, 4))
+    self.delayDisplay('Test passed!')
+
+  def test_SampleProfileUnderLinearTransform(self):
+    """The line is sampled in world coordinates : moving the volume and the line together keeps the profile"""
+    self.delayDisplay("Starting the test")
+    volumeNode = self.createLinearVolume((6, 8, 10))
+    transformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLLinearTransformNode')
+    transform = vtk.vtkTransform()
+    transform.Translate(20, -10, 5)
+    transform.RotateZ(30)
+    transformNode.SetMatrixTransformToParent(transform.GetMatrix())
+    volumeNode.SetAndObserveTransformNodeID(transformNode.GetID())
+
+    lineNode = self.createLine(volumeNode, (1, 1, 1), (8, 6, 4), transform)
+    sampler = RFProfileSampler()
+    self.assertProfile(sampler.sampleProfile(lineNode, volumeNode), lineNode, (1, 1, 1), (8, 6, 4))
+
+    # Moving the volume by one voxel along I without its line shifts the sampled IJK points
+    transform.Translate(0.5, 0, 0)
+    transformNode.SetMatrixTransformToParent(transform.GetMatrix())
+    self.assertProfile(sampler.sampleProfile(lineNode, volumeNode), lineNode, (0, 1, 1), (7, 6, 4))
+    self.delayDisplay('Test passed!')
+
+  def test_SampleProfileOfSingleSliceVolume(self):
+    """A single slice volume is sampled in its slice plane"""
+    self.delayDisplay("Starting the test")
+    volumeNode = self.createLinearVolume((1, 8, 10))
+    lineNode = self.createLine(volumeNode, (1, 1, 0), (8, 6, 0))
+    self.assertProfile(RFProfileSampler().sampleProfile(lineNode, volumeNode), lineNode, (1, 1, 0), (8, 6, 0))
+    self.delayDisplay('Test passed!')
+
+  def test_SwitchingMarkupsReusesProfileNodes(self):
+    """Profiled markups are switched without adding table and plot series nodes to the scene"""
+    self.delayDisplay("Starting the test")
+    volumeNode = self.createLinearVolume((6, 8, 10))
+    lineA = self.createLine(volumeNode, (1, 1, 1), (8, 6, 4))
+    lineB = self.createLine(volumeNode, (0, 0, 0), (9, 7, 5))
+    lineC = self.createLine(volumeNode, (2, 7, 1), (7, 0, 3))
+
+    logic = RFLineProfileLogic()
+    logic.setInputVolumeNode(volumeNode)
+    logic.setMarkupNodes([lineA, lineB])
+    numberOfNodes = slicer.mrmlScene.GetNumberOfNodes()
+    pooledNodes = set(logic.nodePool.tableNodes() + logic.nodePool.plotSeriesNodes())
+    self.assertEqual(len(pooledNodes), 4)
+
+    for markupNodes in [[lineC], [lineA, lineC], [lineB, lineC]]:
+      logic.setMarkupNodes(markupNodes)
+      self.assertEqual(logic.markupNodes, markupNodes)
+      self.assertEqual(slicer.mrmlScene.GetNumberOfNodes(), numberOfNodes)
+      self.assertEqual(set(logic.nodePool.tableNodes() + logic.nodePool.plotSeriesNodes()), pooledNodes)
+
+      plotSeriesNodes = [logic.plotChartNode.GetNthPlotSeriesNode(seriesIndex)
+                         for seriesIndex in range(logic.plotChartNode.GetNumberOfPlotSeriesNodes())]
+      self.assertEqual(sorted(node.GetName() for node in plotSeriesNodes),
+                       sorted(markupNode.GetName() for markupNode in markupNodes))
+      for plotSeriesNode in plotSeriesNodes:
+        self.assertGreater(plotSeriesNode.GetTableNode().GetTable().GetNumberOfRows(), 0)
+    self.delayDisplay('Test passed!')
+
+  def test_UnchangedLineIsNotProbedAgain(self):
+    """Moving one of the compared lines only probes the volume along the moved line"""
+    self.delayDisplay("Starting the test")
+
+    class CountingProfileSampler(RFProfileSampler):
+      def __init__(self):
+        RFProfileSampler.__init__(self)
+        self.numberOfProbes = 0
+
+      def resampleCurvePoints(self, curvePoints_RAS, numberOfSamples, isClosedCurve):
+        self.numberOfProbes += 1
+        return RFProfileSampler.resampleCurvePoints(curvePoints_RAS, numberOfSamples, isClosedCurve)
+
+    volumeNode = self.createLinearVolume((6, 8, 10))
+    movedLine = self.createLine(volumeNode, (1, 1, 1), (8, 6, 4))
+    unchangedLine = self.createLine(volumeNode, (0, 0, 0), (9, 7, 5))
+
+    sampler = CountingProfileSampler()
+    logic = RFLineProfileLogic(sampler)
+    logic.setInputVolumeNode(volumeNode)
+    logic.setMarkupNodes([movedLine, unchangedLine])
+    self.assertEqual(sampler.numberOfProbes, 2)
+
+    logic.update()
+    self.assertEqual(sampler.numberOfProbes, 2)
+
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    movedLine.SetNthControlPointPositionWorld(1, ijkToRAS.MultiplyPoint([7, 6, 4, 1])[:3])
+    logic._updateScheduler.flush()
+    self.assertEqual(sampler.numberOfProbes, 3)
+    self.delayDisplay('Test passed!')
+
+  @staticmethod
+  def linearIntensity(i, j, k):
+    return 3 * i + 5 * j + 7 * k + 100
+
+  @classmethod
+  def createLinearVolume(cls, shape):
+    """Returns a volume of the (K, J, I) shape whose intensities are linear in IJK, with an anisotropic spacing"""
+    volumeName = slicer.mrmlScene.GetUniqueNameByString('LineProfileTest')
+    slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(volumeName)
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', volumeName)
+    volumeNode.SetSpacing(0.5, 1.0, 2.0)
+    volumeNode.SetOrigin(10.0, -5.0, 3.0)
+    k, j, i = np.indices(shape)
+    slicer.util.updateVolumeFromArray(volumeNode, cls.linearIntensity(i, j, k).astype(np.float32))
+    return volumeNode
+
+  @staticmethod
+  def createLine(volumeNode, startIJK, endIJK, volumeToWorld=None):
+    """Returns a line between the IJK points of the volume, placed in world coordinates"""
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    lineNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsLineNode')
+    for point_IJK in [startIJK, endIJK]:
+      point_RAS = ijkToRAS.MultiplyPoint(list(point_IJK) + [1])[:3]
+      if volumeToWorld is not None:
+        point_RAS = volumeToWorld.TransformPoint(point_RAS)
+      lineNode.AddControlPointWorld(vtk.vtkVector3d(*point_RAS))
+    return lineNode
+
+  def assertProfile(self, profile, lineNode, startIJK, endIJK):
+    """Checks the profile against the linear interpolation of the intensities of the sampled volume IJK points"""
+    self.assertIsNotNone(profile)
+    distances, intensities = profile
+    lineLength = lineNode.GetLineLengthWorld()
+    numberOfSamples = max(2, int(round(getLineResolutionFromLineLength(lineLength))) + 1)
+    self.assertEqual(len(distances), numberOfSamples)
+    np.testing.assert_allclose(distances, np.linspace(0, lineLength, numberOfSamples), atol=1e-6)
+
+    i, j, k = (np.linspace(start, end, numberOfSamples) for start, end in zip(startIJK, endIJK))
+    np.testing.assert_allclose(intensities, self.linearIntensity(i, j, k), rtol=1e-4)
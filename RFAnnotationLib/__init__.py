@@ -1,4 +1,5 @@
 from .RFAnnotationUtils import *
 from .RFCanal import *
+from .RFCanalGeometry import *
 from .RFAnnotationCanal import *
 from .RFLineProfile import *
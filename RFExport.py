@@ -10,7 +10,7 @@ import vtk
 from slicer.ScriptedLoadableModule import *
 
 from RFViewerHomeLib import RFViewerWidget, translatable, informationMessageBox, \
-  warningMessageBox, TemporarySymlink, ExportDirectorySettings
+  warningMessageBox, TemporarySymlink, ExportDirectorySettings, profiled
 
 
 @unique
@@ -161,6 +161,7 @@ class RFExportWidget(RFViewerWidget):
 
     img.save(filePath)
 
+  @profiled("Export volume to DICOM", "export")
   def exportVolumeToDicom(self):
     """
     Export the current volume node as a DICOM
@@ -180,6 +181,7 @@ class RFExportWidget(RFViewerWidget):
     exportDialog.setMRMLScene(slicer.mrmlScene)
     exportDialog.execDialog(self._volumeHierarchyId())
 
+  @profiled("Export DVD", "export")
   def DVDexport(self):
     """
     Export the current volume node as a DICOM
@@ -276,6 +278,7 @@ class RFExportWidget(RFViewerWidget):
   def _exportPath(fileName):
     return os.path.join(ExportDirectorySettings.load(), fileName)
 
+  @profiled("Export volume", "export")
   def exportVolume(self, exportType):
     """
     Export the current volume into the correct extension
@@ -321,6 +324,7 @@ class RFExportWidget(RFViewerWidget):
     else:
       warningMessageBox(self.tr('Export'), self.tr('Export failed'))
 
+  @profiled("Export segment to STL", "export")
   def exportSegmentToSTL(self):
     """
     Export the current segmentation node as an stl file
@@ -2,9 +2,9 @@ import vtk, qt
 import slicer
 from slicer.ScriptedLoadableModule import *
 
-from RFPanoramaLib import CurvedPlanarReformatLogic
+from RFPanoramaLib import CurvedPlanarReformatLogic, StraighteningWorker
 from RFViewerHomeLib import translatable, RFViewerWidget, createButton, removeNodeFromMRMLScene, horizontalSlider, \
-    showVolumeOnSlices, WindowLevelUpdater, nodeID, getNodeByID
+    showVolumeOnSlices, WindowLevelUpdater, nodeID, getNodeByID, profiled, profileSpan, profiler, getViewBySingletonTag
 from RFVisualizationLib import RFLayoutType, ViewTag
 from RFVisualizationLib import setNodeVisibleInMainViewsOnly
 
@@ -34,6 +34,18 @@ class RFPanoramaWidget(RFViewerWidget):
         self._straightenTransformNode = None
         self._straightenedVolume = None
         self._windowLevelUpdater = None
+        self._projectedVolume = None
+        self._projectedWindowLevelUpdater = None
+
+        self._straighteningWorker = StraighteningWorker(self._curvedReformatLogic)
+        self._straighteningProgress = None
+        self._straighteningSpan = None
+        self._observedCurveNode = None
+        self._curveObserverTags = []
+        self._curveModifiedTimer = qt.QTimer()
+        self._curveModifiedTimer.singleShot = True
+        self._curveModifiedTimer.interval = 300
+        self._curveModifiedTimer.connect("timeout()", self.onCurveModifiedTimeout)
 
         self._curveResolutionSlider = horizontalSlider(value=0.5, minimum=0.1, maximum=10,
                                                        toolTip=self.tr("Sampling distance along the curve (mm)"))
@@ -43,12 +55,18 @@ class RFPanoramaWidget(RFViewerWidget):
                                                       toolTip=self.tr("Height of the panorama image (mm)"))
         self._panoramaDepthSlider = horizontalSlider(value=40, minimum=10, maximum=100, singleStep=1, pageStep=1,
                                                      toolTip=self.tr("Depth of the panorama image (mm)"))
+        self._projectionModeComboBox = qt.QComboBox()
+        self._projectionModeComboBox.toolTip = self.tr("Projection of the panorama depth displayed in the panorama view")
+        self._slabThicknessSlider = horizontalSlider(value=10, minimum=1, maximum=100, singleStep=1, pageStep=1,
+                                                     toolTip=self.tr("Thickness of the projected slab (mm)"))
 
         # Initialize straightened volume name in the MRML Scene
         # GetUniqueNameByString may add an underscore to the name given the circumstances. The first call makes sure the
         # following names are consistent
         self._straightenedVolumeName = "PanoramicStraightenedVolume"
         slicer.mrmlScene.GetUniqueNameByString(self._straightenedVolumeName)
+        self._projectedVolumeName = "PanoramicProjectedVolume"
+        slicer.mrmlScene.GetUniqueNameByString(self._projectedVolumeName)
 
     def setup(self):
         RFViewerWidget.setup(self)
@@ -59,6 +77,17 @@ class RFPanoramaWidget(RFViewerWidget):
         advancedForm.addRow(self.tr("Panorama Height (mm)"), self._panoramaHeightSlider)
         advancedForm.addRow(self.tr("Panorama Depth (mm)"), self._panoramaDepthSlider)
 
+        projectionMode = CurvedPlanarReformatLogic.ProjectionMode
+        self._projectionModeComboBox.addItem(self.tr("Slice"), "")
+        self._projectionModeComboBox.addItem(self.tr("Mean"), projectionMode.Mean.value)
+        self._projectionModeComboBox.addItem(self.tr("MIP"), projectionMode.MIP.value)
+        self._projectionModeComboBox.addItem(self.tr("MinIP"), projectionMode.MinIP.value)
+        self._projectionModeComboBox.addItem(self.tr("Gaussian slab"), projectionMode.GaussianSlab.value)
+        self._projectionModeComboBox.connect("currentIndexChanged(int)", self.onProjectionModified)
+        self._slabThicknessSlider.connect("valueChanged(double)", self.onProjectionModified)
+        advancedForm.addRow(self.tr("Projection"), self._projectionModeComboBox)
+        advancedForm.addRow(self.tr("Slab Thickness (mm)"), self._slabThicknessSlider)
+
         self.layout.addLayout(advancedForm)
 
         self._widget = slicer.modules.markups.createNewWidgetRepresentation()
@@ -78,33 +107,55 @@ class RFPanoramaWidget(RFViewerWidget):
         On new volume node, save the new node for panoramic view, remove the previously straightened volume if any
         and update the 2D slices to avoid the panoramic views from displaying the new volume.
         """
+        self.cancelStraightening()
         self._volumeNode = volumeNode
 
         removeNodeFromMRMLScene(self._straightenedVolume)
+        removeNodeFromMRMLScene(self._projectedVolume)
         self._straightenedVolume = None
+        self._projectedVolume = None
         self._windowLevelUpdater = None
+        self._projectedWindowLevelUpdater = None
 
         self.updateSliceDisplayedVolume()
 
     def showPanoramicView(self):
+        """
+        Straightens the volume along the curve in a worker thread and shows the panoramic views when done. A running
+        straightening is cancelled and restarted with the current curve.
+        """
         curveNode = self.getCurveNode()
         if None in [self._volumeNode, curveNode]:
             return
 
+        self.cancelStraightening()
+
         # 処理開始したことをユーザに通知
-        msg = qt.QProgressDialog('処理中です...', None, 0, 0)
-        msg.setWindowTitle('パノラマビュー')
-        msg.setCancelButton(0)
-
-        msg.show()
-        slicer.app.processEvents()
- 
-        self.straightenVolumeNodeAlongCurve(curveNode)
-        self.showStraightenedVolume()
+        self._straighteningProgress = qt.QProgressDialog('処理中です...', 'キャンセル', 0, 100, slicer.util.mainWindow())
+        self._straighteningProgress.setWindowTitle('パノラマビュー')
+        self._straighteningProgress.setAutoClose(False)
+        self._straighteningProgress.setAutoReset(False)
+        self._straighteningProgress.setMinimumDuration(0)
+        self._straighteningProgress.connect("canceled()", self.cancelStraightening)
+        self._straighteningProgress.show()
+
+        self._straighteningSpan = profiler.startSpan("Show panoramic view", "panorama")
+        straighteningJob = self.straightenVolumeNodeAlongCurve(curveNode)
+        if straighteningJob is None:
+            # Volume straightened synchronously by the resample CLI
+            self.onStraighteningDone()
+            return
 
-        msg.done(0)
+        self.observeCurveNode(curveNode)
+        self._straighteningWorker.start(straighteningJob, onProgress=self.onStraighteningProgress,
+                                        onFinished=self.onStraighteningFinished, onError=self.onStraighteningError)
 
+    @profiled("Straighten volume along curve", "panorama")
     def straightenVolumeNodeAlongCurve(self, curveNode):
+        """
+        Computes the straightening transform and returns the job of the straightened volume resampling, to be run by the
+        straightening worker. Returns None if the volume could only be straightened synchronously by the resample CLI.
+        """
         if self._straightenTransformNode is None:
             self._straightenTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode',
                                                                                'Straightening transform')
@@ -114,8 +165,9 @@ class RFPanoramaWidget(RFViewerWidget):
         sliceResolutionMm = self._sliceResolutionSlider.value
         outputSpacing = [sliceResolutionMm, sliceResolutionMm, spacingAlongCurveMm]
 
-        self._curvedReformatLogic.computeStraighteningTransform(self._straightenTransformNode, curveNode, sliceSizeMm,
-                                                                spacingAlongCurveMm)
+        # Only the slices after the first modified curve frames are resampled again when the curve is edited
+        unchangedGridSlices = self._curvedReformatLogic.computeStraighteningTransform(
+            self._straightenTransformNode, curveNode, sliceSizeMm, spacingAlongCurveMm)
 
         if self._straightenedVolume is None:
             straightenedName = slicer.mrmlScene.GetUniqueNameByString(self._straightenedVolumeName)
@@ -125,9 +177,147 @@ class RFPanoramaWidget(RFViewerWidget):
                                                                                                   straightenedName)
             self._windowLevelUpdater = WindowLevelUpdater(self._volumeNode, self._straightenedVolume)
 
-        self._curvedReformatLogic.straightenVolume(self._straightenedVolume, self._volumeNode, outputSpacing,
-                                                   self._straightenTransformNode)
+        straighteningJob = self._curvedReformatLogic.straighteningJob(self._straightenedVolume, self._volumeNode,
+                                                                      outputSpacing, self._straightenTransformNode,
+                                                                      unchangedGridSlices)
+        if straighteningJob is None:
+            self._curvedReformatLogic.straightenVolume(self._straightenedVolume, self._volumeNode, outputSpacing,
+                                                       self._straightenTransformNode, unchangedGridSlices)
+        return straighteningJob
+
+    def onStraighteningProgress(self, processedChunks, numberOfChunks):
+        if self._straighteningProgress is not None:
+            self._straighteningProgress.setValue(int(100 * processedChunks / numberOfChunks))
+
+    def onStraighteningFinished(self, straighteningJob, straightenedArray):
+        """Swaps the straightened array computed by the worker in the straightened volume and shows it"""
+        if self._straightenedVolume is None:
+            return
+
+        with profileSpan("Apply straightened volume", "panorama"):
+            self._curvedReformatLogic.applyStraightenedArray(self._straightenedVolume, self._volumeNode,
+                                                             straighteningJob, straightenedArray)
+        self.onStraighteningDone()
+
+    def onStraighteningDone(self):
         self._windowLevelUpdater.synchroniseDisplayWithVolume()
+        self.projectStraightenedVolume()
+        self.showStraightenedVolume()
+        self.endStraightening()
+
+    def onStraighteningError(self, message):
+        self.endStraightening(error=message)
+        slicer.util.errorDisplay(message, windowTitle='パノラマビュー')
+
+    def cancelStraightening(self):
+        """Cancels the running straightening, the straightened volume keeps its previous content"""
+        self._curveModifiedTimer.stop()
+        self._straighteningWorker.cancel()
+        self.endStraightening(cancelled=True)
+
+    def endStraightening(self, keepObservingCurve=False, **spanArgs):
+        """
+        Closes the progress dialog, stops observing the curve unless keepObservingCurve and records the straightening
+        span
+        """
+        if not keepObservingCurve:
+            self.observeCurveNode(None)
+
+        progress, self._straighteningProgress = self._straighteningProgress, None
+        if progress is not None:
+            progress.blockSignals(True)
+            progress.close()
+            progress.deleteLater()
+
+        if self._straighteningSpan is not None:
+            self._straighteningSpan.finish(**spanArgs)
+            self._straighteningSpan = None
+
+    def observeCurveNode(self, curveNode):
+        """Observes the point modifications of curveNode while straightening, None to remove the observers"""
+        if self._observedCurveNode is not None:
+            for tag in self._curveObserverTags:
+                self._observedCurveNode.RemoveObserver(tag)
+        self._observedCurveNode = curveNode
+        self._curveObserverTags = []
+        if curveNode is None:
+            return
+
+        for event in [slicer.vtkMRMLMarkupsNode.PointModifiedEvent, slicer.vtkMRMLMarkupsNode.PointAddedEvent,
+                      slicer.vtkMRMLMarkupsNode.PointRemovedEvent]:
+            self._curveObserverTags.append(curveNode.AddObserver(event, self.onCurveModifiedWhileStraightening))
+
+    def onCurveModifiedWhileStraightening(self, *args):
+        """
+        The running straightening is outdated when the curve is edited : it is cancelled and started again once the curve
+        has not been modified for a while. The curve stays observed until the restart, each modification restarts the
+        timer.
+        """
+        self._straighteningWorker.cancel()
+        self.endStraightening(keepObservingCurve=True, cancelled=True)
+        self._curveModifiedTimer.start()
+
+    def onCurveModifiedTimeout(self):
+        if qt.QApplication.mouseButtons() != qt.Qt.NoButton:
+            # Control point still dragged, the straightening restarts once released
+            self._curveModifiedTimer.start()
+            return
+        self.showPanoramicView()
+
+    def projectionMode(self):
+        """Returns the selected CurvedPlanarReformatLogic.ProjectionMode value, None to display slices"""
+        return self._projectionModeComboBox.currentData or None
+
+    def projectStraightenedVolume(self):
+        """Projects the straightened volume with the selected projection mode and slab thickness"""
+        mode = self.projectionMode()
+        if mode is None or self._straightenedVolume is None:
+            return
+
+        if self._projectedVolume is None:
+            projectedName = slicer.mrmlScene.GetUniqueNameByString(self._projectedVolumeName)
+            slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(projectedName)
+            self._projectedVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", projectedName)
+
+        with profileSpan("Project straightened volume", "panorama", mode=mode):
+            self._curvedReformatLogic.projectVolume(self._projectedVolume, self._straightenedVolume, mode=mode,
+                                                    slabThicknessMm=self._slabThicknessSlider.value)
+
+        if self._projectedWindowLevelUpdater is None:
+            self._projectedWindowLevelUpdater = WindowLevelUpdater(self._volumeNode, self._projectedVolume)
+        self._projectedWindowLevelUpdater.synchroniseDisplayWithVolume()
+
+    def onProjectionModified(self):
+        """
+        Called when the projection mode or slab thickness is modified. Only the projection of the current straightened
+        volume is updated, the straightening is not recomputed.
+        """
+        if self._straightenedVolume is None:
+            return
+
+        previousFrontVolume = self.panoramaFrontVolume()
+        self.projectStraightenedVolume()
+        self.updateSliceDisplayedVolume()
+        if self.panoramaFrontVolume() is not previousFrontVolume:
+            self.orientPanoramaFrontView()
+            slicer.modules.RFVisualizationWidget.fitSlicesToBackground()
+
+    def panoramaFrontVolume(self):
+        """Returns the volume displayed in the panorama front view : projected volume if any, straightened otherwise"""
+        if self.projectionMode() is not None and self._projectedVolume is not None:
+            return self._projectedVolume
+        return self._straightenedVolume
+
+    def orientPanoramaFrontView(self):
+        """Aligns the panorama front view with the projected volume plane, the coronal plane when showing slices"""
+        sliceNode = getViewBySingletonTag(ViewTag.PanoramaFront)
+        if sliceNode is None:
+            return
+
+        if self.panoramaFrontVolume() is self._projectedVolume:
+            sliceNode.RotateToVolumePlane(self._projectedVolume)
+        else:
+            sliceNode.SetOrientationToCoronal()
 
     def processInteractionEvents(self, callerInteractor, eventId, viewWidget):
         print("processInteractionEvents")
@@ -138,11 +328,13 @@ class RFPanoramaWidget(RFViewerWidget):
     def showStraightenedVolume(self):
         slicer.modules.RFVisualizationWidget.setSlicerLayout(RFLayoutType.RFPanoramaLayout)
         self.updateSliceDisplayedVolume()
+        self.orientPanoramaFrontView()
         slicer.modules.RFVisualizationWidget.fitSlicesToBackground()
 
     def updateSliceDisplayedVolume(self):
-        # Display straightened volume
-        showVolumeOnSlices(nodeID(self._straightenedVolume), ViewTag.panoramicViewTags())
+        # Display straightened volume, or its projection in the front view
+        showVolumeOnSlices(nodeID(self.panoramaFrontVolume()), [ViewTag.PanoramaFront])
+        showVolumeOnSlices(nodeID(self._straightenedVolume), [ViewTag.PanoramaLateral])
 
         # Force the Axial, Coronal and Sagittal views to display the original volume (slices will switch automatically
         # to straightened volume when it's created due to the volume module logic)
@@ -169,6 +361,9 @@ class RFPanoramaWidget(RFViewerWidget):
         parameter.SetParameter("VolumeID", nodeID(self._volumeNode))
         parameter.SetParameter("StraightenedTransformID", nodeID(self._straightenTransformNode))
         parameter.SetParameter("StraightenedVolumeID", nodeID(self._straightenedVolume))
+        parameter.SetParameter("ProjectedVolumeID", nodeID(self._projectedVolume))
+        parameter.SetParameter("ProjectionMode", self.projectionMode() or "")
+        parameter.SetParameter("SlabThickness", str(self._slabThicknessSlider.value))
 
     def applyState(self):
         """Override from RFViewerWidget"""
@@ -176,10 +371,22 @@ class RFPanoramaWidget(RFViewerWidget):
         self._volumeNode = getNodeByID(parameter.GetParameter("VolumeID"))
         self._straightenTransformNode = getNodeByID(parameter.GetParameter("StraightenedTransformID"))
         self._straightenedVolume = getNodeByID(parameter.GetParameter("StraightenedVolumeID"))
+        self._projectedVolume = getNodeByID(parameter.GetParameter("ProjectedVolumeID"))
+
+        wasBlocked = self._projectionModeComboBox.blockSignals(True)
+        self._projectionModeComboBox.setCurrentIndex(
+            max(0, self._projectionModeComboBox.findData(parameter.GetParameter("ProjectionMode"))))
+        self._projectionModeComboBox.blockSignals(wasBlocked)
+        if parameter.GetParameter("SlabThickness"):
+            wasBlocked = self._slabThicknessSlider.blockSignals(True)
+            self._slabThicknessSlider.value = float(parameter.GetParameter("SlabThickness"))
+            self._slabThicknessSlider.blockSignals(wasBlocked)
 
         if None not in [self._volumeNode, self._straightenedVolume]:
             self._windowLevelUpdater = WindowLevelUpdater(self._volumeNode, self._straightenedVolume)
             self._windowLevelUpdater.synchroniseDisplayWithVolume()
+        if None not in [self._volumeNode, self._projectedVolume]:
+            self._projectedWindowLevelUpdater = WindowLevelUpdater(self._volumeNode, self._projectedVolume)
 
         self.updateSliceDisplayedVolume()
 
@@ -5,6 +5,8 @@ File copied from https://github.com/PerkLab/SlicerSandbox/tree/master/CurvedPlan
 import math
 import numpy as np
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from enum import unique, Enum
 import unittest
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
@@ -164,17 +166,45 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
   """
 
+  @unique
+  class ProjectionMode(Enum):
+    Mean = "mean"
+    MIP = "mip"
+    MinIP = "minip"
+    GaussianSlab = "gaussian"
+
   def __init__(self):
     ScriptedLoadableModuleLogic.__init__(self)
     # there is no need to compute displacement for each slice,
     # we just compute for every n-th to make computation faster and inverse computation more robust
     # (less contradiction because of there is less overlapping between neighbor slices)
     self.transformSpacingFactor = 5.0
+    # Straightened volumes are resampled in process unless disabled, by chunks of output slices along the curve
+    self.useInProcessResampling = True
+    self.resamplingThreadCount = min(4, os.cpu_count() or 1)
+    self.resamplingChunkVoxels = 2 ** 18
+    # Projections are reduced by chunks of depth layers in a float32 accumulator reused between calls
+    self.projectionChunkVoxels = 2 ** 22
+    self._projectionAccumulator = None
+    # When the curve only changed after its first curve frames, the grid placement of the previous straightening is
+    # kept and only the straightened slices depending on modified frames are resampled. The curve frames and placement
+    # of a straightening transform are only committed once the straightened volume is updated : a cancelled job never
+    # becomes the reference of the next one.
+    self.incrementalStraightening = True
+    self._straighteningState = None
+    self._pendingStraighteningState = None
+    self._straightenedVolumeState = None
 
   def computeStraighteningTransform(self, transformToStraightenedNode, curveNode, sliceSizeMm, outputSpacingMm):
     """
     Compute straightened volume (useful for example for visualization of curved vessels)
     resamplingCurveSpacingFactor: 
+
+    With incrementalStraightening, if the curve frames of the last straightened volume with the same transform node and
+    parameters are unchanged at the start of the curve, its grid axes and origin are kept. The straightened
+    voxels only depend on the curve frames, the kept placement only affects the position of the straightened volume.
+
+    Returns the number of leading grid slices identical to the last straightened volume, 0 if everything was recomputed.
     """
 
     # Create a temporary resampled curve
@@ -183,46 +213,56 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     sampledPoints = vtk.vtkPoints()
     if not slicer.vtkMRMLMarkupsCurveNode.ResamplePoints(originalCurvePoints, sampledPoints, resamplingCurveSpacing, False):
       raise("Redampling curve failed")
-    resampledCurveNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode", "CurvedPlanarReformat_resampled_curve_temp")
+    # Hidden before being added : scene observers (e.g. line profiles) ignore it
+    resampledCurveNode = slicer.mrmlScene.CreateNodeByClass("vtkMRMLMarkupsCurveNode")
+    resampledCurveNode.UnRegister(None)
+    resampledCurveNode.SetName("CurvedPlanarReformat_resampled_curve_temp")
+    resampledCurveNode.SetHideFromEditors(True)
+    resampledCurveNode.SetSaveWithScene(False)
+    slicer.mrmlScene.AddNode(resampledCurveNode)
     resampledCurveNode.SetNumberOfPointsPerInterpolatingSegment(1)
     resampledCurveNode.SetCurveTypeToLinear()
     resampledCurveNode.SetControlPointPositionsWorld(sampledPoints)
     numberOfSlices = resampledCurveNode.GetNumberOfControlPoints()
 
-    # Z axis (from first curve point to last, this will be the straightened curve long axis)
-    curveStartPoint = np.zeros(3)
-    curveEndPoint = np.zeros(3)
-    resampledCurveNode.GetNthControlPointPositionWorld(0, curveStartPoint)
-    resampledCurveNode.GetNthControlPointPositionWorld(resampledCurveNode.GetNumberOfControlPoints()-1, curveEndPoint)
-    transformGridAxisZ = (curveEndPoint-curveStartPoint)/np.linalg.norm(curveEndPoint-curveStartPoint)
+    curvePointToWorldArrays = self.curvePointToWorldArrays(resampledCurveNode, numberOfSlices)
+    straighteningParameters = (transformToStraightenedNode.GetID(), list(sliceSizeMm), resamplingCurveSpacing)
+    unchangedGridSlices = 0
+    if self.incrementalStraightening and self._straighteningState is not None \
+        and self._straighteningState["parameters"] == straighteningParameters:
+      unchangedGridSlices = self.numberOfUnchangedCurveFrames(self._straighteningState["curveFrames"], curvePointToWorldArrays)
+
+    if unchangedGridSlices > 0:
+      transformGridAxisX, transformGridAxisY, transformGridAxisZ, transformGridOrigin = self._straighteningState["placement"]
+    else:
+      # Z axis (from first curve point to last, this will be the straightened curve long axis)
+      curveStartPoint = np.zeros(3)
+      curveEndPoint = np.zeros(3)
+      resampledCurveNode.GetNthControlPointPositionWorld(0, curveStartPoint)
+      resampledCurveNode.GetNthControlPointPositionWorld(resampledCurveNode.GetNumberOfControlPoints()-1, curveEndPoint)
+      transformGridAxisZ = (curveEndPoint-curveStartPoint)/np.linalg.norm(curveEndPoint-curveStartPoint)
   
-    # X axis = average X axis of curve, to minimize torsion (and so have a simple displacement field, which can be robustly inverted)
-    sumCurveAxisX_RAS = np.zeros(3)
-    for gridK in range(numberOfSlices):
-      curvePointToWorld = vtk.vtkMatrix4x4()
-      resampledCurveNode.GetCurvePointToWorldTransformAtPointIndex(resampledCurveNode.GetCurvePointIndexFromControlPointIndex(gridK), curvePointToWorld)
-      curvePointToWorldArray = slicer.util.arrayFromVTKMatrix(curvePointToWorld)
-      curveAxisX_RAS = curvePointToWorldArray[0:3, 0]
-      sumCurveAxisX_RAS += curveAxisX_RAS
-    meanCurveAxisX_RAS = sumCurveAxisX_RAS/np.linalg.norm(sumCurveAxisX_RAS)
-    transformGridAxisX = meanCurveAxisX_RAS
-
-    # Y axis
-    transformGridAxisY = np.cross(transformGridAxisZ, transformGridAxisX)
-    transformGridAxisY = transformGridAxisY/np.linalg.norm(transformGridAxisY)
-
-    # Make sure that X axis is orthogonal to Y and Z
-    transformGridAxisX = np.cross(transformGridAxisY, transformGridAxisZ)
-    transformGridAxisX = transformGridAxisX/np.linalg.norm(transformGridAxisX)
-
-    # Origin (makes the grid centered at the curve)
-    curveLength = resampledCurveNode.GetCurveLengthWorld()
-    curveNodePlane = vtk.vtkPlane()
-    slicer.modules.markups.logic().GetBestFitPlane(resampledCurveNode, curveNodePlane)
-    transformGridOrigin = np.array(curveNodePlane.GetOrigin())
-    transformGridOrigin -= transformGridAxisX * sliceSizeMm[0]/2.0
-    transformGridOrigin -= transformGridAxisY * sliceSizeMm[1]/2.0
-    transformGridOrigin -= transformGridAxisZ * curveLength/2.0
+      # X axis = average X axis of curve, to minimize torsion (and so have a simple displacement field, which can be robustly inverted)
+      sumCurveAxisX_RAS = curvePointToWorldArrays[:, 0:3, 0].sum(axis=0)
+      meanCurveAxisX_RAS = sumCurveAxisX_RAS/np.linalg.norm(sumCurveAxisX_RAS)
+      transformGridAxisX = meanCurveAxisX_RAS
+
+      # Y axis
+      transformGridAxisY = np.cross(transformGridAxisZ, transformGridAxisX)
+      transformGridAxisY = transformGridAxisY/np.linalg.norm(transformGridAxisY)
+
+      # Make sure that X axis is orthogonal to Y and Z
+      transformGridAxisX = np.cross(transformGridAxisY, transformGridAxisZ)
+      transformGridAxisX = transformGridAxisX/np.linalg.norm(transformGridAxisX)
+
+      # Origin (makes the grid centered at the curve)
+      curveLength = resampledCurveNode.GetCurveLengthWorld()
+      curveNodePlane = vtk.vtkPlane()
+      slicer.modules.markups.logic().GetBestFitPlane(resampledCurveNode, curveNodePlane)
+      transformGridOrigin = np.array(curveNodePlane.GetOrigin())
+      transformGridOrigin -= transformGridAxisX * sliceSizeMm[0]/2.0
+      transformGridOrigin -= transformGridAxisY * sliceSizeMm[1]/2.0
+      transformGridOrigin -= transformGridAxisZ * curveLength/2.0
 
     # Create grid transform
     # Each corner of each slice is mapped from the original volume's reformatted slice
@@ -249,34 +289,117 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     transformToStraightenedNode.SetAndObserveTransformFromParent(transform)
 
     # Compute displacements
+    # Grid indices broadcast to the (K, J, I, 3) displacement array
+    gridK = np.arange(gridDimensions[2]).reshape(-1, 1, 1, 1)
+    gridJ = np.arange(gridDimensions[1]).reshape(1, -1, 1, 1)
+    gridI = np.arange(gridDimensions[0]).reshape(1, 1, -1, 1)
+    straightenedVolume_RAS = (transformGridOrigin
+      + gridI*gridSpacing[0]*transformGridAxisX
+      + gridJ*gridSpacing[1]*transformGridAxisY
+      + gridK*gridSpacing[2]*transformGridAxisZ)
+    curveAxisX_RAS = curvePointToWorldArrays[:, np.newaxis, np.newaxis, 0:3, 0]
+    curveAxisY_RAS = curvePointToWorldArrays[:, np.newaxis, np.newaxis, 0:3, 1]
+    curvePoint_RAS = curvePointToWorldArrays[:, np.newaxis, np.newaxis, 0:3, 3]
+    inputVolume_RAS = (curvePoint_RAS
+      + (gridI-0.5)*sliceSizeMm[0]*curveAxisX_RAS
+      + (gridJ-0.5)*sliceSizeMm[1]*curveAxisY_RAS)
     transformDisplacements_RAS = slicer.util.arrayFromGridTransform(transformToStraightenedNode)
-    for gridK in range(gridDimensions[2]):
-      curvePointToWorld = vtk.vtkMatrix4x4()
-      resampledCurveNode.GetCurvePointToWorldTransformAtPointIndex(resampledCurveNode.GetCurvePointIndexFromControlPointIndex(gridK), curvePointToWorld)
-      curvePointToWorldArray = slicer.util.arrayFromVTKMatrix(curvePointToWorld)
-      curveAxisX_RAS = curvePointToWorldArray[0:3, 0]
-      curveAxisY_RAS = curvePointToWorldArray[0:3, 1]
-      curvePoint_RAS = curvePointToWorldArray[0:3, 3]
-      for gridJ in range(gridDimensions[1]):
-        for gridI in range(gridDimensions[0]):
-          straightenedVolume_RAS = (transformGridOrigin
-            + gridI*gridSpacing[0]*transformGridAxisX
-            + gridJ*gridSpacing[1]*transformGridAxisY
-            + gridK*gridSpacing[2]*transformGridAxisZ)
-          inputVolume_RAS = (curvePoint_RAS
-            + (gridI-0.5)*sliceSizeMm[0]*curveAxisX_RAS
-            + (gridJ-0.5)*sliceSizeMm[1]*curveAxisY_RAS)
-          transformDisplacements_RAS[gridK][gridJ][gridI] = inputVolume_RAS - straightenedVolume_RAS
+    transformDisplacements_RAS[:] = inputVolume_RAS - straightenedVolume_RAS
     slicer.util.arrayFromGridTransformModified(transformToStraightenedNode)
 
     slicer.mrmlScene.RemoveNode(resampledCurveNode)  # delete temporary curve
 
+    self._pendingStraighteningState = {
+      "parameters": straighteningParameters,
+      "curveFrames": curvePointToWorldArrays,
+      "placement": (transformGridAxisX, transformGridAxisY, transformGridAxisZ, transformGridOrigin),
+    }
+    return unchangedGridSlices
+
+  @staticmethod
+  def numberOfUnchangedCurveFrames(previousCurveFrames, curveFrames, tolerance=1e-6):
+    """Returns the number of leading (4, 4) curve frames equal in both arrays"""
+    count = min(len(previousCurveFrames), len(curveFrames))
+    changed = ~np.all(np.isclose(previousCurveFrames[:count], curveFrames[:count], rtol=0, atol=tolerance), axis=(1, 2))
+    return int(np.argmax(changed)) if changed.any() else count
 
-  def straightenVolume(self, outputStraightenedVolume, volumeNode, outputStraightenedVolumeSpacing, straighteningTransformNode):
+
+  @staticmethod
+  def curvePointToWorldArrays(curveNode, numberOfControlPoints):
+    """
+    Returns the (N, 4, 4) array of the curve point to world transforms at the curve points of the N first control points
+    (see vtkMRMLMarkupsCurveNode::GetCurvePointToWorldTransformAtPointIndex).
+    Transforms are read at once from the normals, binormals and tangents arrays of the curve when available and
+    consistent with the markups API, one control point at a time otherwise.
+    """
+    curvePointIndices = np.array([curveNode.GetCurvePointIndexFromControlPointIndex(i) for i in range(numberOfControlPoints)])
+    curvePointToWorldArrays = np.zeros((numberOfControlPoints, 4, 4))
+    curvePointToWorldArrays[:, 3, 3] = 1
+
+    curvePoly = curveNode.GetCurveWorld()
+    pointData = curvePoly.GetPointData() if curvePoly else None
+    axisArrays = [pointData.GetArray(name) for name in ("Normals", "Binormals", "Tangents")] if pointData else [None]
+    if numberOfControlPoints and all(array is not None for array in axisArrays):
+      from vtk.util.numpy_support import vtk_to_numpy
+      for column, array in enumerate(axisArrays):
+        curvePointToWorldArrays[:, 0:3, column] = vtk_to_numpy(array)[curvePointIndices]
+      curvePointToWorldArrays[:, 0:3, 3] = vtk_to_numpy(curvePoly.GetPoints().GetData())[curvePointIndices]
+
+      firstCurvePointToWorld = vtk.vtkMatrix4x4()
+      curveNode.GetCurvePointToWorldTransformAtPointIndex(curvePointIndices[0], firstCurvePointToWorld)
+      if np.allclose(slicer.util.arrayFromVTKMatrix(firstCurvePointToWorld), curvePointToWorldArrays[0]):
+        return curvePointToWorldArrays
+
+    for controlPointIndex, curvePointIndex in enumerate(curvePointIndices):
+      curvePointToWorld = vtk.vtkMatrix4x4()
+      curveNode.GetCurvePointToWorldTransformAtPointIndex(curvePointIndex, curvePointToWorld)
+      curvePointToWorldArrays[controlPointIndex] = slicer.util.arrayFromVTKMatrix(curvePointToWorld)
+    return curvePointToWorldArrays
+
+  def straightenVolume(self, outputStraightenedVolume, volumeNode, outputStraightenedVolumeSpacing, straighteningTransformNode,
+                       unchangedGridSlices=0):
     """
     Compute straightened volume (useful for example for visualization of curved vessels)
+
+    unchangedGridSlices: value returned by computeStraighteningTransform. When the output was straightened by the
+    previous call from the same input volume with the same geometry, the straightened slices only depending on the
+    unchanged grid slices are kept and only the following ones are resampled.
     """
+    straighteningJob = self.straighteningJob(outputStraightenedVolume, volumeNode, outputStraightenedVolumeSpacing,
+      straighteningTransformNode, unchangedGridSlices)
+    if straighteningJob is not None:
+      self.applyStraightenedArray(outputStraightenedVolume, volumeNode, straighteningJob,
+        self.resampleStraightenedArray(straighteningJob))
+      return
+
+    self._straighteningState = self._pendingStraighteningState
+    self._straightenedVolumeState = None
+
     gridTransform = straighteningTransformNode.GetTransformFromParentAs("vtkOrientedGridTransform")
+    straightenedVolumeIJKToRASArray, outputDimensions = self.straightenedVolumeGeometry(gridTransform,
+      outputStraightenedVolumeSpacing)
+    outputStraightenedImageData = vtk.vtkImageData()
+    outputStraightenedImageData.SetExtent(0, outputDimensions[0]-1, 0, outputDimensions[1]-1, 0, outputDimensions[2]-1)
+    outputStraightenedImageData.AllocateScalars(volumeNode.GetImageData().GetScalarType(), volumeNode.GetImageData().GetNumberOfScalarComponents())
+    outputStraightenedVolume.SetAndObserveImageData(outputStraightenedImageData)
+    outputStraightenedVolume.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(straightenedVolumeIJKToRASArray))
+
+    # Resample input volume to straightened volume
+    parameters = {}
+    parameters["inputVolume"] = volumeNode.GetID()
+    parameters["outputVolume"] = outputStraightenedVolume.GetID()
+    parameters["referenceVolume"] = outputStraightenedVolume.GetID()
+    parameters["transformationFile"] = straighteningTransformNode.GetID()
+    resamplerModule = slicer.modules.resamplescalarvectordwivolume
+    parameterNode = slicer.cli.runSync(resamplerModule, None, parameters)
+
+    outputStraightenedVolume.CreateDefaultDisplayNodes()
+    outputStraightenedVolume.GetDisplayNode().CopyContent(volumeNode.GetDisplayNode())
+    slicer.mrmlScene.RemoveNode(parameterNode)
+
+  @staticmethod
+  def straightenedVolumeGeometry(gridTransform, outputStraightenedVolumeSpacing):
+    """Returns the IJK to RAS matrix (numpy array) and the dimensions of the volume straightened by gridTransform"""
     if not gridTransform:
       raise ValueError("Straightening transform is expected to contain a vtkOrientedGridTransform form parent")
 
@@ -297,50 +420,265 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
     # Set origin
     straightenedVolumeIJKToRASArray[0:3,3] = gridOrigin 
 
-    outputStraightenedImageData = vtk.vtkImageData()
-    outputStraightenedImageData.SetExtent(
-      0, int(gridExtentMm[0]/outputStraightenedVolumeSpacing[0])-1,
-      0, int(gridExtentMm[1]/outputStraightenedVolumeSpacing[1])-1,
-      0, int(gridExtentMm[2]/outputStraightenedVolumeSpacing[2])-1)
-    outputStraightenedImageData.AllocateScalars(volumeNode.GetImageData().GetScalarType(), volumeNode.GetImageData().GetNumberOfScalarComponents())
-    outputStraightenedVolume.SetAndObserveImageData(outputStraightenedImageData)
-    outputStraightenedVolume.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(straightenedVolumeIJKToRASArray))
+    outputDimensions = [int(gridExtentMm[0]/outputStraightenedVolumeSpacing[0]),
+      int(gridExtentMm[1]/outputStraightenedVolumeSpacing[1]),
+      int(gridExtentMm[2]/outputStraightenedVolumeSpacing[2])]
+    return straightenedVolumeIJKToRASArray, outputDimensions
 
-    # Resample input volume to straightened volume
-    parameters = {}
-    parameters["inputVolume"] = volumeNode.GetID()
-    parameters["outputVolume"] = outputStraightenedVolume.GetID()
-    parameters["referenceVolume"] = outputStraightenedVolume.GetID()
-    parameters["transformationFile"] = straighteningTransformNode.GetID()
-    resamplerModule = slicer.modules.resamplescalarvectordwivolume
-    parameterNode = slicer.cli.runSync(resamplerModule, None, parameters)
+  def straighteningJob(self, outputStraightenedVolume, volumeNode, outputStraightenedVolumeSpacing, straighteningTransformNode,
+                       unchangedGridSlices=0):
+    """
+    Collects in a dictionary everything resampleStraightenedArray needs to compute the straightened volume, so that the
+    resampling does not access the MRML scene and can run in a worker thread. No node is modified.
+    Returns None when the straightened volume can only be computed by the resample CLI.
+    """
+    gridTransform = straighteningTransformNode.GetTransformFromParentAs("vtkOrientedGridTransform")
+    straightenedVolumeIJKToRASArray, outputDimensions = self.straightenedVolumeGeometry(gridTransform,
+      outputStraightenedVolumeSpacing)
+    if not self.useInProcessResampling or not self.canResampleInProcess(volumeNode, straightenedVolumeIJKToRASArray, gridTransform):
+      return None
+
+    gridSpacing = gridTransform.GetDisplacementGrid().GetSpacing()
+    gridDimensions = gridTransform.GetDisplacementGrid().GetDimensions()
+    straightenedVolumeState = (outputStraightenedVolume.GetID(), volumeNode.GetID(), volumeNode.GetImageData().GetMTime(),
+      straighteningTransformNode.GetID(), np.round(straightenedVolumeIJKToRASArray, 6).tolist())
+    keptSlices = 0
+    if unchangedGridSlices > 0 and self._straightenedVolumeState == straightenedVolumeState:
+      keptSlices = self.numberOfUnchangedStraightenedSlices(outputStraightenedVolume, outputDimensions,
+        outputStraightenedVolumeSpacing[2] / gridSpacing[2], gridDimensions[2], unchangedGridSlices)
+    logging.info("Straightened slices kept: {} / {}".format(keptSlices, outputDimensions[2]))
+
+    inputRASToIJK = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(inputRASToIJK)
+    return {
+      "state": straightenedVolumeState,
+      "outputDimensions": outputDimensions,
+      "outputIJKToRAS": straightenedVolumeIJKToRASArray,
+      "outputToGridIJK": self.outputToGridIJKArray(straightenedVolumeIJKToRASArray, gridTransform),
+      "inputRASToIJK": slicer.util.arrayFromVTKMatrix(inputRASToIJK),
+      "inputArray": slicer.util.arrayFromVolume(volumeNode),
+      # Copies, the transform and the straightened volume may be updated while the job runs
+      "displacements": slicer.util.arrayFromGridTransform(straighteningTransformNode).copy(),
+      "keptSlices": keptSlices,
+      "keptArray": slicer.util.arrayFromVolume(outputStraightenedVolume)[:keptSlices].copy() if keptSlices > 0 else None,
+      # Curve frames and placement of the transform, committed with the straightened volume
+      "straighteningState": self._pendingStraighteningState,
+    }
+
+  @staticmethod
+  def gridIJKToRASArray(gridTransform):
+    """Returns the IJK to RAS matrix of the displacement grid of a vtkOrientedGridTransform as a numpy array"""
+    gridImage = gridTransform.GetDisplacementGrid()
+    gridIJKToRASArray = np.dot(slicer.util.arrayFromVTKMatrix(gridTransform.GetGridDirectionMatrix()),
+      np.diag(list(gridImage.GetSpacing()) + [1]))
+    gridIJKToRASArray[0:3, 3] = gridImage.GetOrigin()
+    return gridIJKToRASArray
+
+  @staticmethod
+  def outputToGridIJKArray(outputIJKToRASArray, gridTransform):
+    """Returns the matrix mapping the straightened volume IJK coordinates to the displacement grid IJK coordinates"""
+    return np.dot(np.linalg.inv(CurvedPlanarReformatLogic.gridIJKToRASArray(gridTransform)), outputIJKToRASArray)
+
+  @classmethod
+  def canResampleInProcess(cls, volumeNode, outputIJKToRASArray, gridTransform):
+    """
+    In process resampling handles single component volumes with a displacement grid aligned with the straightened
+    volume axes, which is the case of the straightening transforms computed by this logic.
+    """
+    if volumeNode.GetImageData().GetNumberOfScalarComponents() != 1:
+      return False
+    outputToGridIJK = cls.outputToGridIJKArray(outputIJKToRASArray, gridTransform)[0:3, 0:3]
+    return np.allclose(outputToGridIJK, np.diag(np.diag(outputToGridIJK)))
+
+  @staticmethod
+  def numberOfUnchangedStraightenedSlices(outputStraightenedVolume, outputDimensions, outputToGridSliceRatio,
+                                          numberOfGridSlices, unchangedGridSlices):
+    """
+    Returns the number of leading slices of the current straightened volume which only depend on unchanged grid slices,
+    0 if the straightened volume slice size changed.
+    """
+    imageData = outputStraightenedVolume.GetImageData()
+    if imageData is None or list(imageData.GetDimensions()[0:2]) != outputDimensions[0:2]:
+      return 0
+
+    # Each straightened slice is interpolated between grid slices gridK and gridK + 1
+    numberOfSlices = min(imageData.GetDimensions()[2], outputDimensions[2])
+    gridK = np.clip(np.floor(np.arange(numberOfSlices) * outputToGridSliceRatio), 0, max(numberOfGridSlices - 2, 0))
+    dependsOnChangedSlices = gridK + 1 >= unchangedGridSlices
+    return int(np.argmax(dependsOnChangedSlices)) if dependsOnChangedSlices.any() else numberOfSlices
+
+  def resampleStraightenedArray(self, straighteningJob, progressCallback=None, isAborted=None):
+    """
+    Trilinear resampling of the input volume in the straightened volume, without going through the resample CLI.
 
+    Each straightened voxel is moved by the linearly interpolated displacement grid of the straightening transform to
+    the input volume RAS space, then sampled in the input volume. Voxels outside of the input volume are set to 0.
+    Output slices along the curve are processed by chunks of resamplingChunkVoxels voxels spread over
+    resamplingThreadCount threads. The slices kept by straighteningJob are copied and not resampled.
+
+    Only numpy arrays of the job are accessed, the method is safe to call from a worker thread.
+    progressCallback(processedChunks, numberOfChunks) is called after each chunk, and the remaining chunks are skipped as
+    soon as isAborted() returns True. Returns the (K, J, I) straightened array, or None if aborted.
+    """
+    displacements = straighteningJob["displacements"]
+    outputToGridIJK = straighteningJob["outputToGridIJK"]
+    outputIJKToRASArray = straighteningJob["outputIJKToRAS"]
+    inputRASToIJKArray = straighteningJob["inputRASToIJK"]
+    inputArray = straighteningJob["inputArray"]
+    keptSlices = straighteningJob["keptSlices"]
+
+    outputDimensions = straighteningJob["outputDimensions"]
+    outputArray = np.empty((outputDimensions[2], outputDimensions[1], outputDimensions[0]), dtype=inputArray.dtype)
+    if keptSlices > 0:
+      outputArray[:keptSlices] = straighteningJob["keptArray"]
+    outputSliceVoxels = outputArray.shape[1] * outputArray.shape[2]
+    chunkSlices = max(1, self.resamplingChunkVoxels // max(1, outputSliceVoxels))
+
+    # Output IJK coordinates along each axis, broadcast to (K, J, I, 1) shaped arrays
+    outputI = np.arange(outputArray.shape[2]).reshape(1, 1, -1, 1)
+    outputJ = np.arange(outputArray.shape[1]).reshape(1, -1, 1, 1)
+    gridI = outputI[0, 0, :, 0] * outputToGridIJK[0, 0] + outputToGridIJK[0, 3]
+    gridJ = outputJ[0, :, 0, 0] * outputToGridIJK[1, 1] + outputToGridIJK[1, 3]
+
+    def aborted():
+      return isAborted is not None and isAborted()
+
+    def resampleChunk(firstSlice):
+      if aborted():
+        return
+      lastSlice = min(firstSlice + chunkSlices, outputArray.shape[0])
+      outputK = np.arange(firstSlice, lastSlice).reshape(-1, 1, 1, 1)
+      gridK = outputK[:, 0, 0, 0] * outputToGridIJK[2, 2] + outputToGridIJK[2, 3]
+      inputVolume_RAS = (outputIJKToRASArray[0:3, 3]
+        + outputI*outputIJKToRASArray[0:3, 0]
+        + outputJ*outputIJKToRASArray[0:3, 1]
+        + outputK*outputIJKToRASArray[0:3, 2])
+      inputVolume_RAS += self.interpolateGridDisplacements(displacements, gridK, gridJ, gridI)
+      inputVolume_IJK = np.dot(inputVolume_RAS, inputRASToIJKArray[0:3, 0:3].T) + inputRASToIJKArray[0:3, 3]
+      values = self.sampleTrilinear(inputArray, inputVolume_IJK[..., 2], inputVolume_IJK[..., 1], inputVolume_IJK[..., 0])
+      if np.issubdtype(outputArray.dtype, np.integer):
+        np.clip(values, np.iinfo(outputArray.dtype).min, np.iinfo(outputArray.dtype).max, out=values)
+      outputArray[firstSlice:lastSlice] = values
+
+    chunkFirstSlices = range(keptSlices, outputArray.shape[0], chunkSlices)
+    if self.resamplingThreadCount > 1 and len(chunkFirstSlices) > 1:
+      with ThreadPoolExecutor(max_workers=self.resamplingThreadCount) as executor:
+        futures = [executor.submit(resampleChunk, firstSlice) for firstSlice in chunkFirstSlices]
+        for processedChunks, future in enumerate(as_completed(futures), 1):
+          future.result()
+          if progressCallback is not None and not aborted():
+            progressCallback(processedChunks, len(chunkFirstSlices))
+    else:
+      for processedChunks, firstSlice in enumerate(chunkFirstSlices, 1):
+        resampleChunk(firstSlice)
+        if aborted():
+          break
+        if progressCallback is not None:
+          progressCallback(processedChunks, len(chunkFirstSlices))
+
+    return None if aborted() else outputArray
+
+  def applyStraightenedArray(self, outputStraightenedVolume, volumeNode, straighteningJob, outputArray):
+    """
+    Sets the array returned by resampleStraightenedArray in the straightened volume. The image data and the geometry are
+    replaced in a single modification, views never display a partially resampled volume.
+    """
+    from vtk.util.numpy_support import vtk_to_numpy
+    outputDimensions = straighteningJob["outputDimensions"]
+    outputStraightenedImageData = vtk.vtkImageData()
+    outputStraightenedImageData.SetExtent(0, outputDimensions[0]-1, 0, outputDimensions[1]-1, 0, outputDimensions[2]-1)
+    outputStraightenedImageData.AllocateScalars(volumeNode.GetImageData().GetScalarType(), 1)
+    vtk_to_numpy(outputStraightenedImageData.GetPointData().GetScalars()).reshape(outputArray.shape)[:] = outputArray
+
+    wasModified = outputStraightenedVolume.StartModify()
+    outputStraightenedVolume.SetAndObserveImageData(outputStraightenedImageData)
+    outputStraightenedVolume.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(straighteningJob["outputIJKToRAS"]))
+    outputStraightenedVolume.EndModify(wasModified)
     outputStraightenedVolume.CreateDefaultDisplayNodes()
     outputStraightenedVolume.GetDisplayNode().CopyContent(volumeNode.GetDisplayNode())
-    slicer.mrmlScene.RemoveNode(parameterNode)
+    self._straighteningState = straighteningJob["straighteningState"]
+    self._straightenedVolumeState = straighteningJob["state"]
 
-  def projectVolume(self, outputProjectedVolume, inputStraightenedVolume, projectionAxisIndex = 0):
-    """Create panoramic volume by mean intensity projection along an axis of the straightened volume
+
+  @staticmethod
+  def interpolateGridDisplacements(displacements, gridK, gridJ, gridI):
+    """
+    Linearly interpolates the (K, J, I, 3) displacement grid on the separable lattice of continuous grid coordinates
+    gridK x gridJ x gridI, one axis after the other. Coordinates are clamped to the grid.
+    """
+    def axisWeights(coordinates, size):
+      first = np.clip(np.floor(coordinates).astype(int), 0, max(size - 2, 0))
+      second = np.minimum(first + 1, size - 1)
+      weight = np.clip(coordinates - first, 0, 1)
+      return first, second, weight
+
+    k0, k1, wk = axisWeights(gridK, displacements.shape[0])
+    interpolated = displacements[k0] * (1 - wk)[:, None, None, None] + displacements[k1] * wk[:, None, None, None]
+    j0, j1, wj = axisWeights(gridJ, displacements.shape[1])
+    interpolated = interpolated[:, j0] * (1 - wj)[None, :, None, None] + interpolated[:, j1] * wj[None, :, None, None]
+    i0, i1, wi = axisWeights(gridI, displacements.shape[2])
+    return interpolated[:, :, i0] * (1 - wi)[None, None, :, None] + interpolated[:, :, i1] * wi[None, None, :, None]
+
+  @staticmethod
+  def sampleTrilinear(array, k, j, i, outsideValue=0):
+    """
+    Samples the 3D array at the continuous (k, j, i) index coordinates with trilinear interpolation.
+    Points further than half a voxel from the array bounds get outsideValue, neighbours are clamped to the bounds.
+    """
+    flatArray = array.reshape(-1)
+    strides = (array.shape[1] * array.shape[2], array.shape[2], 1)
+    inside = np.ones(k.shape, dtype=bool)
+    flatIndex = np.zeros(k.shape, dtype=np.intp)
+    corners = []
+    for coordinates, size, stride in zip((k, j, i), array.shape, strides):
+      inside &= (coordinates >= -0.5) & (coordinates <= size - 0.5)
+      first = np.clip(np.floor(coordinates), 0, max(size - 2, 0)).astype(np.intp)
+      weight = np.clip(coordinates - first, 0, 1)
+      corners.append((first * stride, min(stride, (size - 1) * stride), weight))
+
+    values = np.zeros(k.shape, dtype=np.float64)
+    for dk in (0, 1):
+      for dj in (0, 1):
+        for di in (0, 1):
+          weight = np.ones(k.shape)
+          flatIndex[...] = 0
+          for (offset, step, axisWeight), d in zip(corners, (dk, dj, di)):
+            flatIndex += offset + d * step
+            weight *= axisWeight if d else 1 - axisWeight
+          values += weight * np.take(flatArray, flatIndex)
+    values[~inside] = outsideValue
+    return values
+
+  def projectVolume(self, outputProjectedVolume, inputStraightenedVolume, projectionAxisIndex = 0,
+                    mode = ProjectionMode.Mean, slabThicknessMm = None):
+    """Create panoramic volume by projection along an axis of the straightened volume
+
+    mode: ProjectionMode (or its value) used to reduce the voxels along the projection axis
+    slabThicknessMm: thickness of the projected slab, centered in the straightened volume. Whole volume if None.
+    The output image data is reused when its dimensions and scalar type are unchanged.
     """
 
-    projectedImageData = vtk.vtkImageData()
-    outputProjectedVolume.SetAndObserveImageData(projectedImageData)
     straightenedImageData = inputStraightenedVolume.GetImageData()
-
     outputImageDimensions = list(straightenedImageData.GetDimensions())
     outputImageDimensions[projectionAxisIndex] = 1
-    projectedImageData.SetDimensions(outputImageDimensions)
 
-    projectedImageData.AllocateScalars(straightenedImageData.GetScalarType(), straightenedImageData.GetNumberOfScalarComponents())
+    projectedImageData = outputProjectedVolume.GetImageData()
+    if (projectedImageData is None
+      or list(projectedImageData.GetDimensions()) != outputImageDimensions
+      or projectedImageData.GetScalarType() != straightenedImageData.GetScalarType()
+      or projectedImageData.GetNumberOfScalarComponents() != straightenedImageData.GetNumberOfScalarComponents()):
+      projectedImageData = vtk.vtkImageData()
+      projectedImageData.SetDimensions(outputImageDimensions)
+      projectedImageData.AllocateScalars(straightenedImageData.GetScalarType(), straightenedImageData.GetNumberOfScalarComponents())
+      outputProjectedVolume.SetAndObserveImageData(projectedImageData)
+
     outputProjectedVolumeArray = slicer.util.arrayFromVolume(outputProjectedVolume)
     inputStraightenedVolumeArray = slicer.util.arrayFromVolume(inputStraightenedVolume)
 
-    if projectionAxisIndex == 0:
-      outputProjectedVolumeArray[:, :, 0] = inputStraightenedVolumeArray.mean(2-projectionAxisIndex)
-    elif projectionAxisIndex == 1:
-      outputProjectedVolumeArray[:, 0, :] = inputStraightenedVolumeArray.mean(2-projectionAxisIndex)
-    else:
-      outputProjectedVolumeArray[0, :, :] = inputStraightenedVolumeArray.mean(2-projectionAxisIndex)
+    firstLayer, lastLayer = self.projectionSlab(straightenedImageData.GetDimensions()[projectionAxisIndex],
+      inputStraightenedVolume.GetSpacing()[projectionAxisIndex], slabThicknessMm)
+    projection = self.projectArray(inputStraightenedVolumeArray, 2-projectionAxisIndex, mode, firstLayer, lastLayer)
+    np.copyto(outputProjectedVolumeArray.reshape(projection.shape), projection, casting="unsafe")
 
     slicer.util.arrayFromVolumeModified(outputProjectedVolume)
 
@@ -360,6 +698,62 @@ class CurvedPlanarReformatLogic(ScriptedLoadableModuleLogic):
 
     return True
 
+  @staticmethod
+  def projectionSlab(numberOfLayers, layerSpacingMm, slabThicknessMm=None):
+    """Returns the [first, last) range of the layers of a slab centered in the volume, at least one layer thick"""
+    if slabThicknessMm is None:
+      return 0, numberOfLayers
+    slabLayers = int(np.clip(round(slabThicknessMm / layerSpacingMm), 1, numberOfLayers))
+    firstLayer = (numberOfLayers - slabLayers) // 2
+    return firstLayer, firstLayer + slabLayers
+
+  def projectArray(self, array, axis, mode, firstLayer, lastLayer):
+    """
+    Reduces the [firstLayer, lastLayer) layers of the array along axis with the input ProjectionMode.
+
+    Layers are reduced by chunks of at most projectionChunkVoxels voxels in a float32 accumulator. The Gaussian slab
+    weights the layers with a gaussian centered on the slab, its standard deviation being a quarter of the slab.
+    The returned array is reused by the next call of the logic.
+    """
+    mode = self.ProjectionMode(mode)
+    outputShape = array.shape[:axis] + array.shape[axis+1:]
+    if self._projectionAccumulator is None or self._projectionAccumulator.shape != outputShape:
+      self._projectionAccumulator = np.empty(outputShape, dtype=np.float32)
+    accumulator = self._projectionAccumulator
+
+    initialValues = {self.ProjectionMode.MIP: -np.inf, self.ProjectionMode.MinIP: np.inf}
+    accumulator.fill(initialValues.get(mode, 0))
+
+    numberOfLayers = lastLayer - firstLayer
+    if mode == self.ProjectionMode.GaussianSlab:
+      sigma = max(numberOfLayers / 4.0, 0.5)
+      layerOffsets = np.arange(numberOfLayers) - (numberOfLayers - 1) / 2.0
+      weights = np.exp(-0.5 * (layerOffsets / sigma) ** 2).astype(np.float32)
+      weights /= weights.sum()
+
+    chunkLayers = max(1, self.projectionChunkVoxels // max(1, accumulator.size))
+    for chunkFirstLayer in range(firstLayer, lastLayer, chunkLayers):
+      chunkLastLayer = min(chunkFirstLayer + chunkLayers, lastLayer)
+      layerSlice = [slice(None)] * array.ndim
+      layerSlice[axis] = slice(chunkFirstLayer, chunkLastLayer)
+      chunk = array[tuple(layerSlice)]
+
+      if mode == self.ProjectionMode.MIP:
+        np.maximum(accumulator, chunk.max(axis=axis), out=accumulator)
+      elif mode == self.ProjectionMode.MinIP:
+        np.minimum(accumulator, chunk.min(axis=axis), out=accumulator)
+      elif mode == self.ProjectionMode.GaussianSlab:
+        weightShape = [1] * array.ndim
+        weightShape[axis] = chunkLastLayer - chunkFirstLayer
+        chunkWeights = weights[chunkFirstLayer - firstLayer:chunkLastLayer - firstLayer].reshape(weightShape)
+        accumulator += (chunk * chunkWeights).sum(axis=axis, dtype=np.float32)
+      else:
+        accumulator += chunk.sum(axis=axis, dtype=np.float32)
+
+    if mode == self.ProjectionMode.Mean:
+      accumulator /= max(numberOfLayers, 1)
+    return accumulator
+
 class CurvedPlanarReformatTest(ScriptedLoadableModuleTest):
   """
   This is the test case for your scripted module.
@@ -377,6 +771,18 @@ class CurvedPlanarReformatTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_CurvedPlanarReformat1()
+    self.setUp()
+    self.test_NumberOfUnchangedCurveFrames()
+    self.setUp()
+    self.test_NumberOfUnchangedStraightenedSlices()
+    self.setUp()
+    self.test_IncrementalStraightening()
+    self.setUp()
+    self.test_SampleTrilinear()
+    self.setUp()
+    self.test_InterpolateGridDisplacements()
+    self.setUp()
+    self.test_InProcessResamplingMatchesResampleCLI()
 
   def test_CurvedPlanarReformat1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -431,3 +837,195 @@ class CurvedPlanarReformatTest(ScriptedLoadableModuleTest):
     slicer.util.setSliceViewerLayers(background=straightenedVolume, fit=True, rotateToVolumePlane=True)
 
     self.delayDisplay('Test passed!')
+
+  def test_NumberOfUnchangedCurveFrames(self):
+    """Leading curve frames equal within the tolerance are unchanged, the count stops at the first modified frame"""
+    self.delayDisplay("Starting the test")
+
+    numberOfUnchangedCurveFrames = CurvedPlanarReformatLogic.numberOfUnchangedCurveFrames
+    curveFrames = np.tile(np.eye(4), (6, 1, 1))
+    curveFrames[:, 0:3, 3] = np.arange(18).reshape(6, 3)
+    self.assertEqual(numberOfUnchangedCurveFrames(curveFrames, curveFrames.copy()), 6)
+
+    # Only the frames of the shortest curve are compared
+    self.assertEqual(numberOfUnchangedCurveFrames(curveFrames[:4], curveFrames), 4)
+    self.assertEqual(numberOfUnchangedCurveFrames(curveFrames, curveFrames[:3]), 3)
+
+    modifiedCurveFrames = curveFrames.copy()
+    modifiedCurveFrames[4:, 0:3, 3] += 1.0
+    self.assertEqual(numberOfUnchangedCurveFrames(curveFrames, modifiedCurveFrames), 4)
+    modifiedCurveFrames[2, 0:3, 0] = [0, 1, 0]
+    self.assertEqual(numberOfUnchangedCurveFrames(curveFrames, modifiedCurveFrames), 2)
+    modifiedCurveFrames[0, 0, 3] += 1e-8
+    self.assertEqual(numberOfUnchangedCurveFrames(curveFrames, modifiedCurveFrames), 2)
+    modifiedCurveFrames[0, 0, 3] += 1e-3
+    self.assertEqual(numberOfUnchangedCurveFrames(curveFrames, modifiedCurveFrames), 0)
+
+    self.delayDisplay('Test passed!')
+
+  def test_NumberOfUnchangedStraightenedSlices(self):
+    """Straightened slices are kept while they are only interpolated between unchanged grid slices"""
+    self.delayDisplay("Starting the test")
+
+    numberOfUnchangedStraightenedSlices = CurvedPlanarReformatLogic.numberOfUnchangedStraightenedSlices
+    straightenedVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+    self.assertEqual(numberOfUnchangedStraightenedSlices(straightenedVolume, [3, 4, 30], 0.2, 7, 4), 0)
+
+    # 30 slices of 3x4 voxels, 5 straightened slices per grid slice
+    slicer.util.updateVolumeFromArray(straightenedVolume, np.zeros((30, 4, 3), dtype=np.int16))
+    # Slice k is interpolated between the grid slices floor(k / 5) and floor(k / 5) + 1
+    self.assertEqual(numberOfUnchangedStraightenedSlices(straightenedVolume, [3, 4, 30], 0.2, 7, 4), 15)
+    self.assertEqual(numberOfUnchangedStraightenedSlices(straightenedVolume, [3, 4, 30], 0.2, 7, 1), 0)
+    # Slices after the last grid slice are interpolated in the last grid interval
+    self.assertEqual(numberOfUnchangedStraightenedSlices(straightenedVolume, [3, 4, 40], 0.2, 7, 6), 25)
+    self.assertEqual(numberOfUnchangedStraightenedSlices(straightenedVolume, [3, 4, 40], 0.2, 7, 7), 30)
+    # Modified slice size
+    self.assertEqual(numberOfUnchangedStraightenedSlices(straightenedVolume, [3, 5, 30], 0.2, 7, 4), 0)
+
+    self.delayDisplay('Test passed!')
+
+  @staticmethod
+  def createSyntheticVolumeAndCurve():
+    """Returns a smooth volume of 1mm voxels and an arch curve, straightened slices of 20mm are inside the volume"""
+    k, j, i = np.mgrid[0:40, 0:80, 0:80].astype(np.float32)
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+    volumeNode.SetOrigin(-40.0, -40.0, -20.0)
+    slicer.util.updateVolumeFromArray(volumeNode, np.sin(i / 5.0) * np.cos(j / 7.0) * 100.0 + k)
+    volumeNode.CreateDefaultDisplayNodes()
+
+    curveNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLMarkupsCurveNode')
+    for angle in np.linspace(0, np.pi, 7):
+      curveNode.AddControlPoint(vtk.vtkVector3d(25.0 * np.cos(angle), 25.0 * np.sin(angle) - 10.0, 0.0))
+    return volumeNode, curveNode
+
+  def test_IncrementalStraightening(self):
+    """After moving the last control point, the incremental straightening gives the voxels of a full recompute"""
+    self.delayDisplay("Starting the test")
+
+    volumeNode, curveNode = self.createSyntheticVolumeAndCurve()
+    fieldOfView = [20.0, 20.0]
+    outputSpacing = [0.5, 0.5, 1.0]
+
+    def straighten(logic, straighteningTransformNode, straightenedVolume):
+      unchangedGridSlices = logic.computeStraighteningTransform(straighteningTransformNode, curveNode, fieldOfView,
+        outputSpacing[2])
+      straighteningJob = logic.straighteningJob(straightenedVolume, volumeNode, outputSpacing, straighteningTransformNode,
+        unchangedGridSlices)
+      self.assertIsNotNone(straighteningJob)
+      logic.applyStraightenedArray(straightenedVolume, volumeNode, straighteningJob,
+        logic.resampleStraightenedArray(straighteningJob))
+      return unchangedGridSlices, straighteningJob["keptSlices"]
+
+    logic = CurvedPlanarReformatLogic()
+    straighteningTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode')
+    straightenedVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+    self.assertEqual(straighten(logic, straighteningTransformNode, straightenedVolume), (0, 0))
+
+    lastPoint = np.zeros(3)
+    lastPointIndex = curveNode.GetNumberOfControlPoints() - 1
+    curveNode.GetNthControlPointPositionWorld(lastPointIndex, lastPoint)
+    curveNode.SetNthControlPointPositionWorld(lastPointIndex, lastPoint + np.array([3.0, -2.0, 1.0]))
+    unchangedGridSlices, keptSlices = straighten(logic, straighteningTransformNode, straightenedVolume)
+    self.assertGreater(unchangedGridSlices, 0)
+    self.assertGreater(keptSlices, 0)
+
+    fullLogic = CurvedPlanarReformatLogic()
+    fullLogic.incrementalStraightening = False
+    fullStraightenedVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+    straighten(fullLogic, slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode'), fullStraightenedVolume)
+
+    # The kept grid placement only moves the straightened volume, its voxels are the same
+    incrementalArray = slicer.util.arrayFromVolume(straightenedVolume)
+    fullArray = slicer.util.arrayFromVolume(fullStraightenedVolume)
+    self.assertEqual(incrementalArray.shape, fullArray.shape)
+    np.testing.assert_allclose(incrementalArray, fullArray, atol=1e-3)
+
+    self.delayDisplay('Test passed!')
+
+  def test_SampleTrilinear(self):
+    """Trilinear sampling matches a point by point interpolation, with clamped neighbours and outside points"""
+    self.delayDisplay("Starting the test")
+
+    def referenceTrilinear(array, point, outsideValue):
+      if any(coordinate < -0.5 or coordinate > size - 0.5 for coordinate, size in zip(point, array.shape)):
+        return outsideValue
+      point = [min(max(coordinate, 0), size - 1) for coordinate, size in zip(point, array.shape)]
+      first = [int(math.floor(coordinate)) for coordinate in point]
+      value = 0.0
+      for corner in np.ndindex(2, 2, 2):
+        weight = 1.0
+        index = []
+        for coordinate, axisFirst, offset, size in zip(point, first, corner, array.shape):
+          weight *= (coordinate - axisFirst) if offset else 1 - (coordinate - axisFirst)
+          index.append(min(axisFirst + offset, size - 1))
+        value += weight * array[tuple(index)]
+      return value
+
+    rng = np.random.default_rng(0)
+    # Single voxel along the last axis
+    for shape in [(4, 5, 6), (3, 4, 1)]:
+      array = rng.integers(0, 1000, shape).astype(np.int16)
+      points = rng.uniform(-1.0, 1.0, (500, 3)) + rng.uniform(0, 1, (500, 3)) * np.array(shape)
+      values = CurvedPlanarReformatLogic.sampleTrilinear(array, points[:, 0], points[:, 1], points[:, 2], outsideValue=-7)
+      expected = [referenceTrilinear(array, point, -7) for point in points]
+      np.testing.assert_allclose(values, expected, atol=1e-9)
+
+    self.delayDisplay('Test passed!')
+
+  def test_InterpolateGridDisplacements(self):
+    """Separable interpolation of the displacement grid matches a point by point trilinear interpolation"""
+    self.delayDisplay("Starting the test")
+
+    def referenceDisplacement(displacements, point):
+      point = [min(max(coordinate, 0), size - 1) for coordinate, size in zip(point, displacements.shape[0:3])]
+      first = [min(int(math.floor(coordinate)), max(size - 2, 0))
+               for coordinate, size in zip(point, displacements.shape[0:3])]
+      value = np.zeros(3)
+      for corner in np.ndindex(2, 2, 2):
+        weight = 1.0
+        index = []
+        for coordinate, axisFirst, offset, size in zip(point, first, corner, displacements.shape[0:3]):
+          weight *= (coordinate - axisFirst) if offset else 1 - (coordinate - axisFirst)
+          index.append(min(axisFirst + offset, size - 1))
+        value += weight * displacements[tuple(index)]
+      return value
+
+    rng = np.random.default_rng(0)
+    displacements = rng.normal(size=(6, 2, 2, 3))
+    gridK = np.linspace(-0.5, 5.5, 13)
+    gridJ = np.array([-0.2, 0.0, 0.3, 1.0, 1.2])
+    gridI = np.array([0.0, 0.5, 0.9, 1.4])
+    interpolated = CurvedPlanarReformatLogic.interpolateGridDisplacements(displacements, gridK, gridJ, gridI)
+
+    self.assertEqual(interpolated.shape, (len(gridK), len(gridJ), len(gridI), 3))
+    for k, j, i in np.ndindex(*interpolated.shape[0:3]):
+      expected = referenceDisplacement(displacements, (gridK[k], gridJ[j], gridI[i]))
+      np.testing.assert_allclose(interpolated[k, j, i], expected, atol=1e-12)
+
+    self.delayDisplay('Test passed!')
+
+  def test_InProcessResamplingMatchesResampleCLI(self):
+    """The in process straightening gives the volume straightened by the resample CLI"""
+    self.delayDisplay("Starting the test")
+
+    volumeNode, curveNode = self.createSyntheticVolumeAndCurve()
+    fieldOfView = [20.0, 20.0]
+    outputSpacing = [0.5, 0.5, 1.0]
+
+    straightenedArrays = []
+    for useInProcessResampling in [True, False]:
+      logic = CurvedPlanarReformatLogic()
+      logic.useInProcessResampling = useInProcessResampling
+      straighteningTransformNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLTransformNode')
+      logic.computeStraighteningTransform(straighteningTransformNode, curveNode, fieldOfView, outputSpacing[2])
+      straightenedVolume = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode')
+      logic.straightenVolume(straightenedVolume, volumeNode, outputSpacing, straighteningTransformNode)
+      straightenedArrays.append(slicer.util.arrayFromVolume(straightenedVolume).astype(np.float64))
+
+    inProcessArray, cliArray = straightenedArrays
+    self.assertEqual(inProcessArray.shape, cliArray.shape)
+    # Border voxels depend on how each implementation handles the bounds of the grid
+    interior = (slice(1, -1),) * 3
+    np.testing.assert_allclose(inProcessArray[interior], cliArray[interior], atol=0.01 * np.ptp(cliArray))
+
+    self.delayDisplay('Test passed!')
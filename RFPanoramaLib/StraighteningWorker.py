@@ -0,0 +1,117 @@
+import queue
+import threading
+from time import sleep
+
+import qt
+
+
+class StraighteningWorker(object):
+  """
+  Resamples straightened volumes in a worker thread, keeping the GUI responsive.
+
+  Follows the main_queue pattern of SimpleFiltersLogic : the worker thread only computes numpy arrays with
+  CurvedPlanarReformatLogic.resampleStraightenedArray and puts callables in main_queue, which is processed on the main
+  thread by a QTimer. The MRML scene is only accessed by these callables.
+
+  Usage example :
+    job = logic.straighteningJob(straightenedVolume, volumeNode, spacing, transformNode)
+    worker.start(job, onProgress=lambda processed, total: ..., onFinished=lambda job, array: ...)
+  """
+
+  def __init__(self, logic):
+    self.logic = logic
+    self.main_queue = queue.Queue()
+    self.main_queue_running = False
+    self.thread = threading.Thread()
+    self.abort = False
+    self._main_queue_scheduled = False
+
+  def __del__(self):
+    self.cancel()
+
+  @property
+  def isRunning(self):
+    return self.thread.is_alive() or self.main_queue_running
+
+  def yieldPythonGIL(self, seconds=0):
+    sleep(seconds)
+
+  def thread_doit(self, straighteningJob, onProgress, onFinished, onError):
+    try:
+      def progressCallback(processedChunks, numberOfChunks):
+        self.main_queue.put(lambda p=processedChunks, n=numberOfChunks: onProgress(p, n))
+        self.yieldPythonGIL()
+
+      outputArray = self.logic.resampleStraightenedArray(straighteningJob, progressCallback=progressCallback,
+                                                         isAborted=lambda: self.abort)
+      if not self.abort:
+        self.main_queue.put(lambda: onFinished(straighteningJob, outputArray))
+
+    except Exception as e:
+      msg = str(e)
+      self.abort = True
+      self.main_queue.put(lambda: onError(msg))
+    finally:
+      self.main_queue.put(self.main_queue_stop)
+
+  def start(self, straighteningJob, onProgress=None, onFinished=None, onError=None):
+    """
+    Starts resampling straighteningJob, cancelling the current job if any.
+    onProgress(processedChunks, numberOfChunks), onFinished(straighteningJob, outputArray) and onError(message) are called
+    on the main thread.
+    """
+    self.cancel()
+
+    noop = lambda *args: None
+    self.abort = False
+    self.thread = threading.Thread(target=lambda: self.thread_doit(straighteningJob, onProgress or noop,
+                                                                   onFinished or noop, onError or noop))
+    self.main_queue_start()
+    self.thread.start()
+
+  def cancel(self):
+    """Aborts the current job. Its pending callables are dropped : onFinished is not called for a cancelled job."""
+    self.abort = True
+    if self.thread.is_alive():
+      self.thread.join()
+
+    while not self.main_queue.empty():
+      self.main_queue.get_nowait()
+    self.main_queue_running = False
+
+  def main_queue_start(self):
+    """Begins monitoring of main_queue for callables"""
+    self.main_queue_running = True
+    if not self._main_queue_scheduled:
+      self._main_queue_scheduled = True
+      qt.QTimer.singleShot(0, self.main_queue_process)
+
+  def main_queue_stop(self):
+    """End monitoring of main_queue for callables"""
+    self.main_queue_running = False
+    if self.thread.is_alive():
+      self.thread.join()
+
+  def main_queue_process(self):
+    """processes the main_queue of callables"""
+    self._main_queue_scheduled = False
+    try:
+      while not self.main_queue.empty():
+        f = self.main_queue.get_nowait()
+        if callable(f):
+          f()
+
+      if self.main_queue_running:
+        # Yield the GIL to allow the worker thread to do some python work
+        self.yieldPythonGIL(.01)
+        self._main_queue_scheduled = True
+        qt.QTimer.singleShot(0, self.main_queue_process)
+
+    except Exception as e:
+      import sys
+      sys.stderr.write("StraighteningWorker error in main_queue: \"{0}\"".format(e))
+
+      # if there was an error try to resume
+      if not self.main_queue.empty() or self.main_queue_running:
+        self._main_queue_scheduled = True
+        qt.QTimer.singleShot(0, self.main_queue_process)
@@ -1 +1,2 @@
 from .CurvedPlanarReformat import CurvedPlanarReformatLogic
+from .StraighteningWorker import StraighteningWorker
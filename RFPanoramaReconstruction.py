@@ -1,5 +1,6 @@
 import logging
 import os
+import unittest
 from itertools import chain
 
 import ctk
@@ -10,7 +11,7 @@ from slicer.ScriptedLoadableModule import *
 
 from RFReconstruction import RFReconstructionLogic
 from RFViewerHomeLib import RFViewerWidget, createFileSelector, translatable, showVolumeOnSlices, wrapInQTimer, \
-  removeNodesFromMRMLScene
+  removeNodesFromMRMLScene, profiled
 from RFVisualizationLib import RFLayoutType, ViewTag
 
 
@@ -39,7 +40,6 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
     self._mnriLineEdit = None
     self._mnri_file_path = ""
     self._logic = RFPanoramaReconstructionLogic()
-    self.projectionsVolume = None
     self.panoramaVolume = None
     self._reconstructButton = None
 
@@ -57,14 +57,19 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
     #
     self.initialAngleSliderWidget = self.createInitialAngleSlider()
     self.initialAngleSliderWidget.connect("valueChanged(double)", self.onParameterModified)
+    self.initialAngleSliderWidget.connect("valueIsChanging(double)",
+                                          lambda value: self.onParameterChanging(initialAngle=value))
     parametersFormLayout.addRow(self.tr("Initial angle"), self.initialAngleSliderWidget)
 
     self.numberOfAnglesSliderWidget = self.createNumberOfAnglesSlider()
     self.numberOfAnglesSliderWidget.connect("valueChanged(double)", self.onParameterModified)
+    self.numberOfAnglesSliderWidget.connect("valueIsChanging(double)",
+                                            lambda value: self.onParameterChanging(numberOfAngles=value))
     parametersFormLayout.addRow(self.tr("Field of View"), self.numberOfAnglesSliderWidget)
 
     self.startXSliderWidget = self.createStartXSlider()
     self.startXSliderWidget.connect("valueChanged(double)", self.onParameterModified)
+    self.startXSliderWidget.connect("valueIsChanging(double)", lambda value: self.onParameterChanging(startX=value))
     parametersFormLayout.addRow(self.tr("Extent"), self.startXSliderWidget)
 
     self.layout.addLayout(parametersFormLayout)
@@ -90,6 +95,7 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
     initialAngleSliderWidget.singleStep = 1.0
     initialAngleSliderWidget.minimum = -180
     initialAngleSliderWidget.maximum = 180
+    initialAngleSliderWidget.tracking = False
     initialAngleSliderWidget.setToolTip(self.tr("Offset initial angle."))
     return initialAngleSliderWidget
 
@@ -98,6 +104,7 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
     numberOfAnglesSlider.singleStep = 1.0
     numberOfAnglesSlider.minimum = 1
     numberOfAnglesSlider.maximum = 180
+    numberOfAnglesSlider.tracking = False
     numberOfAnglesSlider.setToolTip(self.tr("Set the angle range to consider."))
     return numberOfAnglesSlider
 
@@ -106,6 +113,7 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
     startXSlider.singleStep = 1.0
     startXSlider.minimum = 0
     startXSlider.maximum = 100
+    startXSlider.tracking = False
     startXSlider.setToolTip(self.tr("Set the number of pixels per angle to consider."))
     return startXSlider
 
@@ -131,30 +139,42 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
     if self._reconstructButton.checkState == qt.Qt.Checked:
       self.onStartReconstruction()
 
+  def onParameterChanging(self, **changingValues):
+    """
+    Called while a slider is dragged, update a draft panorama if reconstruct button checkbox is checked.
+    The dragged value is given by the signal : without tracking, the slider value is the value before the drag.
+    """
+    if self._reconstructButton.checkState == qt.Qt.Checked:
+      self.reconstructPanorama(draft=True, **changingValues)
+
   def onStartReconstruction(self):
     """
     Read an MNRI file,
     Called when reconstruct button is clicked, or when a parameter is modified
     if reconstruct button checkbox is checked.
     """
+    self.reconstructPanorama(draft=False)
+
+  def reconstructPanorama(self, draft, initialAngle=None, numberOfAngles=None, startX=None):
+    """Parameters which are not given are read from the sliders"""
     # Unload current Node from the scene
     slicer.modules.RFViewerHomeWidget.getDataLoader().setCurrentVolumeNode(None)
 
     mnri_file_path = os.path.normpath(self._mnriLineEdit.currentPath)
-    initialAngle = self.initialAngleSliderWidget.value
-    numberOfAngles = self.numberOfAnglesSliderWidget.value
-    startX = self.startXSliderWidget.value
-
-    [self.panoramaVolume, self.projectionsVolume] = self._logic.run(
-      mnri_file_path,
-      initialAngle,
-      numberOfAngles,
-      startX,
-      self.panoramaVolume,
-      self.projectionsVolume if mnri_file_path == self._mnri_file_path else None)
+    if initialAngle is None:
+      initialAngle = self.initialAngleSliderWidget.value
+    if numberOfAngles is None:
+      numberOfAngles = self.numberOfAnglesSliderWidget.value
+    if startX is None:
+      startX = self.startXSliderWidget.value
+
+    previousPanoramaVolume = self.panoramaVolume
+    self.panoramaVolume = self._logic.run(mnri_file_path, initialAngle, numberOfAngles, startX, self.panoramaVolume,
+                                          draft)
 
     self._mnri_file_path = mnri_file_path
-    self.showPanoramaView()
+    if not draft or self.panoramaVolume is not previousPanoramaVolume:
+      self.showPanoramaView()
     self._mnriLineEdit.addCurrentPathToHistory()
 
   def showPanoramaView(self):
@@ -166,28 +186,18 @@ class RFPanoramaReconstructionWidget(RFViewerWidget):
     showVolumeOnSlices("", ViewTag.mainViewTags())
 
   def setVolumeNode(self, volumeNode):
-    removeNodesFromMRMLScene([self.panoramaVolume, self.projectionsVolume])
+    removeNodesFromMRMLScene([self.panoramaVolume])
     self.panoramaVolume = None
-    self.projectionsVolume = None
 
 
 #
 # RFPanoramaReconstructionLogic
 #
 
-def stitchColumns(columnList):
-  return np.concatenate(columnList, axis=1)
-
 def getColumn(array2D, x, width):
   return array2D[:, int(x + 0.5):int(x+width+0.5)]
   # return array2D[:, (x-width/2):(x+width/2)]
 
-def get2DSlice(array, nSlice):
-  return array[nSlice, :, :]
-
-def get3DSlice(array, nSlice):
-  return get2DSlice(array, nSlice)[np.newaxis]
-
 class RFPanoramaReconstructionLogic(RFReconstructionLogic):
   """
   2D panorama reconstruction from stack of frames
@@ -197,7 +207,8 @@ class RFPanoramaReconstructionLogic(RFReconstructionLogic):
     super(RFPanoramaReconstructionLogic, self).__init__()
     self._projectionName = 'PanoramaReconProjectionVol'
     self._panoramaName = self._projectionName + "-panorama"
-    self._initNames = True
+    self._projections = None
+    self._preview = None
 
   @staticmethod
   def generateNodeName(baseName):
@@ -205,67 +216,41 @@ class RFPanoramaReconstructionLogic(RFReconstructionLogic):
     slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(nodeName)
     return nodeName
 
-  def run(self, mnri_file_path, initialAngleOffset=0, numberOfAngles=80, startX=0, panoramaVolume=None,
-          projectionsVolume=None):
+  def projections(self, mnri_file_path):
     """
-    Run the actual algorithm
+    Returns the memory mapped projections of the MNRI file, see RFReconstructionLogic.mapProjections.
+    The mapping is kept until another or a modified MNRI file is requested.
     """
+    key = (os.path.normpath(mnri_file_path), os.stat(mnri_file_path).st_mtime_ns)
+    if self._projections is None or self._projections[0] != key:
+      logging.info('Map frames from MNRI')
+      self._projections = (key, self.mapProjections(mnri_file_path))
+    return self._projections[1]
 
-    if self._initNames:
-      self.generateNodeName(self._projectionName)
-      self.generateNodeName(self._panoramaName)
-
-    logging.info('Reconstruct Panorama')
-    mnri_settings = self.MNRISettings(mnri_file_path)
-    if projectionsVolume is None:
-      logging.info('Load frames from MNRI')
-
-      mhdFilePath = self.createMhdFile(mnri_file_path)
-      # TODO: load volume silently
-      projectionsVolume = slicer.util.loadVolume(mhdFilePath,
-                                                 {'show': False, 'name': self.generateNodeName(self._projectionName)})
-    inputImageData = projectionsVolume.GetImageData()
-
-    # Get input image info
-    inputSize = inputImageData.GetDimensions()
-    numberOfSlices = inputSize[2]
-    sliceSize = list(inputSize[0:2])
-    inputOrigin = projectionsVolume.GetOrigin()
-    inputSpacing = projectionsVolume.GetSpacing()
-    inputImageDirections = [[0] * 3] * 3
-    projectionsVolume.GetIJKToRASDirections(inputImageDirections)
-
-    logging.info('inputSize: {}'.format(inputSize))
-    logging.info('numberOfSlices: {}'.format(numberOfSlices))
-    logging.info('sliceSize: {}'.format(sliceSize))
-    logging.info('inputOrigin: {}'.format(inputOrigin))
-    logging.info('inputSpacing: {}'.format(inputSpacing))
-    logging.info('inputImageDirections: {}'.format(inputImageDirections))
-
-    array = slicer.util.arrayFromVolume(projectionsVolume)
+  @staticmethod
+  def panoramaColumnWindows(mnri_settings, initialAngleOffset=0, numberOfAngles=80, startX=0):
+    """
+    Returns the (sliceIndex, firstColumn, lastColumn) list of the projection column strips stitched in the panorama,
+    in stitching order. Columns are clipped to the frame width.
+    """
+    numberOfSlices = int(mnri_settings.value("Frame/FrameCount"))
+    frameWidth = mnri_settings.value("Frame/FrameWidth")
     totalAngle = mnri_settings.value("Geometry/TotalAngle") # 360
-    offsetOrient = mnri_settings.value("Geometry/OffsetOrient") # -0.3
     firstSliceAngle = mnri_settings.value("Geometry/InitAngle")
 
+    logging.info('numberOfSlices: {}'.format(numberOfSlices))
     logging.info('totalAngle: {}'.format(totalAngle))
-    logging.info('offsetOrient: {}'.format(offsetOrient))
 
     def relativeAngleToSliceIndex(angle):
       # Convert an angle to a slice index where 0 is frontAngle
       projectionAngle = 90 + firstSliceAngle + angle + initialAngleOffset
       return int(projectionAngle * (numberOfSlices / totalAngle))
-      # return int((angle + initialAngle - offsetOrient) * (numberOfSlices / totalAngle))
-
-    # angles = [-160, -130, -100, -70, -40, 0, 40, 70, 100, 130, 160]
-    # angles = range(-180, 160, 3)
-    # indices = [sliceIndexForAngleFromInitialAngle(angle) for angle in angles]
 
     reverse = -90 < initialAngleOffset < 90
     firstSlice = relativeAngleToSliceIndex(-numberOfAngles) % numberOfSlices
     lastSlice = relativeAngleToSliceIndex(numberOfAngles) % numberOfSlices
-    print(firstSlice, lastSlice, reverse)
+    logging.info('firstSlice: {}, lastSlice: {}, reverse: {}'.format(firstSlice, lastSlice, reverse))
 
-    slices = []
     if firstSlice < lastSlice:
       slices = range(firstSlice, lastSlice)
     else:
@@ -274,73 +259,254 @@ class RFPanoramaReconstructionLogic(RFReconstructionLogic):
     slices = list(slices)
     if reverse:
       slices.reverse()
-    print(slices)
-
-    columns = []
 
-    # sliceWidth = sliceSize[0]
-    frameWidth = mnri_settings.value("Frame/FrameWidth")
-    # columnWidth = int(frameWidth / len(slices))
     # N slices are covering frameWidth - (2*startX) pixels
-    columnWidth = (frameWidth - 2*startX) / len(slices)
-    # middle of middle slice shoul
     # For slice 0, column should start at startX
-    # For middle slice, column should be start frameWidth/2-columnWidth/2
     # For slice n-1, column should start at frameWidth-columnWidth-startX
-    # inc = (frameWidth-columnWidth)/ ((len(slices) - 1))
+    columnWidth = (frameWidth - 2*startX) / len(slices)
     inc = (frameWidth-columnWidth-startX) / (len(slices) - 1)
-    i = 0
-    for index in slices:
-      slice = get2DSlice(array, index)
-      column = getColumn(slice, i * inc + startX, columnWidth)
-      columns.append(column)
-      i += 1
-
-    # columns.reverse()
-    stiched = stitchColumns(columns)
-    stiched3D = stiched[np.newaxis]
-
-    volumesLogic = slicer.modules.volumes.logic()
-    if panoramaVolume is None:
-      panoramaVolume = volumesLogic.CloneVolumeWithoutImageData(
-        slicer.mrmlScene, projectionsVolume, self.generateNodeName(self._panoramaName))
-      panoramaVolume.SetOrigin(inputOrigin)
-      panoramaVolume.SetSpacing(inputSpacing)
-      coronal_direction = [[-1, 0, 0], [0, 0, 1], [0, -1, 0]]
-      panoramaVolume.SetIJKToRASDirections(coronal_direction)
-      panoramaVolume.CreateDefaultDisplayNodes()
-      panoramaVolume.CreateDefaultStorageNode()
-
-    stiched3D = self.scaleFromRawToAttenuation(stiched3D, mnri_settings)
-    stiched3D = self.scaleFromAttenuationToHounsfieldUnits(stiched3D, mnri_settings)
-    slicer.util.updateVolumeFromArray(panoramaVolume, stiched3D)
+    windows = []
+    for i, index in enumerate(slices):
+      x = i * inc + startX
+      first = min(int(x + 0.5), int(frameWidth))
+      last = max(first, min(int(x + columnWidth + 0.5), int(frameWidth)))
+      windows.append((index, first, last))
+    return windows
 
-    logging.info('Processing completed')
+  @staticmethod
+  def panoramaSpacing(mnri_settings, rowStep=1):
+    """Returns the panorama pixel spacing, rows being sampled every rowStep projection rows"""
+    return [mnri_settings.value("Frame/FrameLengthWidth") / mnri_settings.value("Frame/FrameWidth"),
+            mnri_settings.value("Frame/FrameLengthHeight") / mnri_settings.value("Frame/FrameHeight") * rowStep,
+            1]
 
-    return [panoramaVolume, projectionsVolume]
+  def createPanoramaVolume(self, mnri_settings):
+    """
+    Creates an empty panorama volume with the projection pixel spacing and a coronal orientation
+    """
+    panoramaVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode",
+                                                        self.generateNodeName(self._panoramaName))
+    panoramaVolume.SetSpacing(self.panoramaSpacing(mnri_settings))
+    coronal_direction = [[-1, 0, 0], [0, 0, 1], [0, -1, 0]]
+    panoramaVolume.SetIJKToRASDirections(coronal_direction)
+    panoramaVolume.CreateDefaultDisplayNodes()
+    panoramaVolume.CreateDefaultStorageNode()
+    return panoramaVolume
+
+  def panoramaPreview(self, mnri_file_path, panoramaVolume=None):
+    """
+    Returns the preview engine stitching the panorama of the MNRI file in the input volume.
+    The engine of the previous call is reused for the same MNRI file and volume, a new panorama volume is created when
+    none is given.
+    """
+    preview = self._preview
+    projections = self.projections(mnri_file_path)
+    if panoramaVolume is None or preview is None or preview.panoramaVolume is not panoramaVolume or \
+        preview.projections is not projections:
+      if panoramaVolume is None:
+        panoramaVolume = self.createPanoramaVolume(self.MNRISettings(mnri_file_path))
+      preview = RFPanoramaPreview(self, mnri_file_path, panoramaVolume)
+      self._preview = preview
+    return preview
+
+  @profiled("Reconstruct panorama", "panorama")
+  def run(self, mnri_file_path, initialAngleOffset=0, numberOfAngles=80, startX=0, panoramaVolume=None,
+          draft=False):
+    """
+    Run the actual algorithm.
+    The projections are memory mapped and only the column strips stitched in the panorama are read. When called again
+    for the same MNRI file and panorama volume, only the projection columns not converted yet are read.
+
+    :param draft: if True, only one projection row out of RFPanoramaPreview.DRAFT_ROW_STEP is stitched
+    :return: panorama volume
+    """
+    logging.info('Reconstruct Panorama')
+    preview = self.panoramaPreview(mnri_file_path, panoramaVolume)
+    preview.update(initialAngleOffset, numberOfAngles, startX, draft)
+    logging.info('Processing completed')
+    return preview.panoramaVolume
 
   @staticmethod
-  def scaleFromAttenuationToHounsfieldUnits(att_arr, mnri_settings):
+  def hounsfieldUnitsPreset(mnri_settings):
     """
-    Convert input array from raw values to Hounsfield Units
+    Returns the (air, water) normalized attenuation values of the CT value preset of the MNRI file
     """
-    # Extract air and water normalized values from presets
     CTValuePreset = qt.QSettings('CTValuePreset.ini', qt.QSettings.IniFormat)  # File must be next to RFViewer.ini
     selected_preset = int(mnri_settings.value('Volume/TFPresetIndex'))
     air_norm_value = float(CTValuePreset.value('CTValuePreset{:04d}_Air'.format(selected_preset), 0))
     water_norm_value = float(CTValuePreset.value('CTValuePreset{:04d}_Water'.format(selected_preset), 0.018))
+    return air_norm_value, water_norm_value
 
-    # Normalize array and scale the array
-    shift = -water_norm_value
-    scale = 1000. / (water_norm_value - air_norm_value)
-
-    return (att_arr + shift) * scale
+  @staticmethod
+  def scaleFromAttenuationToHounsfieldUnits(att_arr, mnri_settings):
+    """
+    Convert input array from attenuation values to Hounsfield Units
+    """
+    air_norm_value, water_norm_value = RFPanoramaReconstructionLogic.hounsfieldUnitsPreset(mnri_settings)
+    return RFReconstructionLogic.attenuationToHounsfieldUnits(att_arr, air_norm_value, water_norm_value)
 
   @staticmethod
   def scaleFromRawToAttenuation(array, mnri_settings):
     # Frame is normalized between [0, 2^NBB]
     iDark, i0 = RFReconstructionLogic.range(mnri_settings)
-    #att_arr = -np.log(max( (array- iDark) / (i0 - iDark), 1))
-    att_arr = array
-    att_arr[att_arr <= 0] = 1
-    return -np.log((att_arr - iDark) / (i0 - iDark))
+    return RFReconstructionLogic.rawToAttenuation(array, iDark, i0)
+
+  @staticmethod
+  def scaleFromRawToHounsfieldUnits(array, mnri_settings, out=None):
+    """
+    Convert input array from raw values to Hounsfield Units in one pass, see RFReconstructionLogic.rawToHounsfieldUnits
+    """
+    iDark, i0 = RFReconstructionLogic.range(mnri_settings)
+    air_norm_value, water_norm_value = RFPanoramaReconstructionLogic.hounsfieldUnitsPreset(mnri_settings)
+    return RFReconstructionLogic.rawToHounsfieldUnits(array, iDark, i0, air_norm_value, water_norm_value, out=out)
+
+
+class RFPanoramaPreview(object):
+  """
+  Incremental panorama stitching used while the panorama parameters are tuned.
+
+  The stitched panorama is written in Hounsfield Units directly in the image buffer of the panorama volume. Projection
+  columns converted to Hounsfield Units are cached by slice and projection column : a parameter change shifting the
+  column strips only reads and converts the projection columns which were not stitched yet, the others are copied from
+  the cache. Output strips whose (slice, columns) source did not change are not written again. Draft updates stitch one
+  projection row out of DRAFT_ROW_STEP for a fast feedback while a slider is dragged, the following final update
+  restitches the whole panorama.
+  """
+
+  DRAFT_ROW_STEP = 4
+  # Maximum number of converted voxels cached for each row step, the cache is cleared when exceeded
+  MAXIMUM_CACHED_VOXELS = 2 ** 27
+
+  def __init__(self, logic, mnri_file_path, panoramaVolume):
+    self.panoramaVolume = panoramaVolume
+    self.projections = logic.projections(mnri_file_path)
+    self._mnriSettings = logic.MNRISettings(mnri_file_path)
+    iDark, i0 = RFReconstructionLogic.range(self._mnriSettings)
+    self._hounsfieldUnitsParameters = (iDark, i0) + tuple(logic.hounsfieldUnitsPreset(self._mnriSettings))
+    self._shape = None
+    self._rowStep = None
+    self._columns = {}
+    # (first column, converted columns array) by slice index, for each row step
+    self._convertedColumns = {}
+
+  def allocate(self, shape, rowStep):
+    """Allocates the image buffer of the panorama volume, all columns will be restitched"""
+    self.panoramaVolume.SetSpacing(RFPanoramaReconstructionLogic.panoramaSpacing(self._mnriSettings, rowStep))
+    slicer.util.updateVolumeFromArray(self.panoramaVolume, np.zeros(shape, dtype=np.float32))
+    self._shape = shape
+    self._rowStep = rowStep
+    self._columns = {}
+
+  def update(self, initialAngleOffset=0, numberOfAngles=80, startX=0, draft=False):
+    """
+    Stitch the panorama for the input parameters, see RFPanoramaReconstructionLogic.panoramaColumnWindows.
+
+    :return: number of column strips updated
+    """
+    windows = RFPanoramaReconstructionLogic.panoramaColumnWindows(self._mnriSettings, initialAngleOffset,
+                                                                  numberOfAngles, startX)
+    rowStep = self.DRAFT_ROW_STEP if draft else 1
+    frameHeight = self.projections[0].shape[0]
+    shape = (1, len(range(0, frameHeight, rowStep)), sum(last - first for _, first, last in windows))
+    if shape != self._shape or rowStep != self._rowStep or self.panoramaVolume.GetImageData() is None:
+      self.allocate(shape, rowStep)
+
+    panorama = slicer.util.arrayFromVolume(self.panoramaVolume)[0]
+    columns = {}
+    updatedCount = 0
+    convertedCount = 0
+    x = 0
+    for window in windows:
+      index, first, last = window
+      width = last - first
+      if self._columns.get(x) != window:
+        strip, converted = self.convertedColumns(index, first, last, rowStep)
+        panorama[:, x:x + width] = strip
+        updatedCount += 1
+        convertedCount += converted
+      columns[x] = window
+      x += width
+
+    self._columns = columns
+    if updatedCount:
+      slicer.util.arrayFromVolumeModified(self.panoramaVolume)
+    logging.info('Panorama strips updated: {} / {}, projection columns converted: {} / {}'.format(
+      updatedCount, len(windows), convertedCount, shape[2]))
+    return updatedCount
+
+  def convertedColumns(self, index, first, last, rowStep):
+    """
+    Returns the projection columns [first, last) of the slice index in Hounsfield Units, one row out of rowStep, and
+    the number of columns read and converted for this call. The cached columns of the slice are extended to cover the
+    requested ones.
+    """
+    cache = self._convertedColumns.setdefault(rowStep, {})
+    cachedFirst, cachedArray = cache.get(index, (first, None))
+    cachedLast = cachedFirst + (cachedArray.shape[1] if cachedArray is not None else 0)
+    if cachedArray is not None and cachedFirst <= first and last <= cachedLast:
+      return cachedArray[:, first - cachedFirst:last - cachedFirst], 0
+
+    if cachedArray is None:
+      cachedFirst = cachedLast = first
+    newFirst, newLast = min(first, cachedFirst), max(last, cachedLast)
+    cachedVoxels = sum(array.size for _, array in cache.values() if array is not None)
+    rows = self.projections[index][::rowStep]
+    if cachedVoxels + rows.shape[0] * (newLast - newFirst) > self.MAXIMUM_CACHED_VOXELS:
+      cache.clear()
+      cachedArray = None
+      cachedFirst = cachedLast = newFirst = first
+      newLast = last
+
+    newArray = np.empty((rows.shape[0], newLast - newFirst), dtype=np.float32)
+    if cachedArray is not None:
+      newArray[:, cachedFirst - newFirst:cachedLast - newFirst] = cachedArray
+    converted = 0
+    # Columns before and after the cached ones
+    for convertFirst, convertLast in [(newFirst, cachedFirst), (cachedLast, newLast)]:
+      if convertLast > convertFirst:
+        RFReconstructionLogic.rawToHounsfieldUnits(getColumn(rows, convertFirst, convertLast - convertFirst),
+                                                   *self._hounsfieldUnitsParameters,
+                                                   out=newArray[:, convertFirst - newFirst:convertLast - newFirst])
+        converted += convertLast - convertFirst
+    cache[index] = (newFirst, newArray)
+    return newArray[:, first - newFirst:last - newFirst], converted
+
+
+class RFPanoramaReconstructionLogicTestCase(unittest.TestCase):
+  class MNRISettings(object):
+    def __init__(self, **values):
+      self.values = values
+
+    def value(self, key):
+      return self.values[key]
+
+  def an_mnri_settings(self, initAngle=0):
+    return self.MNRISettings(**{"Frame/FrameCount": 360, "Frame/FrameWidth": 100, "Geometry/TotalAngle": 360,
+                                "Geometry/InitAngle": initAngle})
+
+  def test_panorama_column_windows_cover_the_frame_width_in_reverse_slice_order_for_front_angles(self):
+    windows = RFPanoramaReconstructionLogic.panoramaColumnWindows(self.an_mnri_settings(), 0, 10, 0)
+    self.assertEqual([(99 - i, 5 * i, 5 * i + 5) for i in range(20)], windows)
+
+  def test_panorama_column_windows_are_not_reversed_for_back_angles(self):
+    windows = RFPanoramaReconstructionLogic.panoramaColumnWindows(self.an_mnri_settings(), 180, 10, 0)
+    self.assertEqual(list(range(260, 280)), [index for index, _, _ in windows])
+
+  def test_panorama_column_windows_wrap_around_the_first_slice(self):
+    windows = RFPanoramaReconstructionLogic.panoramaColumnWindows(self.an_mnri_settings(initAngle=-85), 0, 10, 0)
+    expected = list(range(355, 360)) + list(range(0, 15))
+    self.assertEqual(expected[::-1], [index for index, _, _ in windows])
+
+  def test_panorama_column_windows_start_at_start_x_and_are_clipped_to_the_frame_width(self):
+    windows = RFPanoramaReconstructionLogic.panoramaColumnWindows(self.an_mnri_settings(), 0, 10, 10)
+    self.assertEqual(20, len(windows))
+    self.assertEqual(10, windows[0][1])
+    for _, first, last in windows:
+      self.assertTrue(0 <= first <= last <= 100)
+    self.assertEqual(sorted(windows, key=lambda window: window[1]), windows)
+
+
+class RFPanoramaReconstructionTest(ScriptedLoadableModuleTest):
+  def runTest(self):
+    suite = unittest.TestLoader().loadTestsFromTestCase(RFPanoramaReconstructionLogicTestCase)
+    unittest.TextTestRunner(verbosity=3).run(suite)
@@ -1,7 +1,14 @@
 ﻿import errno
+import hashlib
+import json
+from collections.abc import Mapping
+from dataclasses import dataclass
+from types import MappingProxyType
 import shutil
 import logging
 import os
+import queue
+import threading
 import unittest
 import sys
 import numpy
@@ -15,7 +22,7 @@ from slicer.ScriptedLoadableModule import *
 import chardet
 import math
 from RFViewerHomeLib import createButton, createFileSelector, translatable, RFViewerWidget, removeNodeFromMRMLScene, \
-    TemporarySymlink, ExportDirectorySettings, DataLoader
+    TemporarySymlink, ExportDirectorySettings, DataLoader, strToBool, Signal, profiler, profiled, profileSpan
 import time
 import re
 import CropVolumeSequence
@@ -44,7 +51,10 @@ class RFReconstructionWidget(RFViewerWidget):
         self._mnriLineEdit = None
         self._reconstructButton = None
         self._logic = RFReconstructionLogic()
+        self._evenLogic = RFReconstructionLogic()
         self._cliNode = None
+        self._evenCliNode = None
+        self._reconstructionSpan = None
         self._editCliWidget = None
         self._reconstructedVolume = None
         self._volumeFiltersUI = None
@@ -96,8 +106,8 @@ class RFReconstructionWidget(RFViewerWidget):
         Enable reconstruction when the MNRI file path is correctly set and update the CLI edition in the advanced
         section.
         """
-        isEnabled = os.path.isfile(self._mnriLineEdit.currentPath) and (
-                    self._cliNode is None or not self._cliNode.IsBusy())
+        isEnabled = os.path.isfile(self._mnriLineEdit.currentPath) and all(
+                    cliNode is None or not cliNode.IsBusy() for cliNode in (self._cliNode, self._evenCliNode))
         self._reconstructButton.setEnabled(isEnabled)
 
         self._editCliWidget.setEnabled(self._cliNode is not None)
@@ -136,20 +146,48 @@ class RFReconstructionWidget(RFViewerWidget):
             self.reconstruct(isCliSynchronous=False, mnriPath=self._mnriLineEdit.currentPath)
             # self.launchVolumeFilter1()
     def reconstructForTwoImages(self, mnrifilepath):
-        self._logic.converting_files(mnrifilepath)
-        
+        """
+        Reconstruct the odd and even projections of a dual image acquisition concurrently and load both volumes
+        stacked along Z once the two CLIs are over.
+
+        :return: the first CLI node which did not complete, or the odd CLI node if both reconstructions completed
+        """
         self._dir_path = os.path.dirname(mnrifilepath)
-        
-        self.oddMnriPath = os.path.join(self._dir_path, "frame1/NAOMICT.mnri") 
-        self.evenMnriPath = os.path.join(self._dir_path, "frame2/NAOMICT.mnri") 
-        cliNode = self.reconstruct_odd(isCliSynchronous=True, mnriPath = self.oddMnriPath )
-        shutil.rmtree(os.path.join(self._dir_path, "frame1"))
-        shutil.rmtree(os.path.join(self._dir_path, "frame2"))
-        shutil.rmtree(os.path.join(self._dir_path, "frame_result1"))
-        shutil.rmtree(os.path.join(self._dir_path, "frame_result2"))
-        # tmp = CropVolumeSequence.CropVolumeSequenceWidget()
-        # tmp.onApplyButton()
-        return cliNode
+        self.oddMnriPath, self.evenMnriPath = self._logic.converting_files(mnrifilepath)
+
+        # Create CLI Nodes if necessary
+        if self._cliNode is None:
+            self._cliNode = slicer.cli.createNode(slicer.modules.simplertk)
+        if self._evenCliNode is None:
+            self._evenCliNode = slicer.cli.createNode(slicer.modules.simplertk)
+        self.removeObserver(self._cliNode, self._cliNode.StatusModifiedEvent, self.onCLIModified)
+
+        # Launch both reconstructions before waiting for either of them. Each CLI has its own logic as the logic
+        # symlink points to the reconstructed MNRI directory.
+        self.addProgressBar.emit(self._progressText)
+        self._cliNode = self._logic.reconstruct_odd(self.oddMnriPath, cliNode=self._cliNode, sync=False)
+        self._evenCliNode = self._evenLogic.reconstruct_even(self.evenMnriPath, cliNode=self._evenCliNode, sync=False)
+        self.updateReconstructButtonEnabled()
+
+        cliNodes = [self._cliNode, self._evenCliNode]
+        with profileSpan("Reconstruct dual image", "reconstruction", mnri=mnrifilepath):
+            self._logic.waitForCLINodes(cliNodes)
+        self.removeProgressBar.emit(self._progressText)
+
+        for cliNode in cliNodes:
+            logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
+            if cliNode.GetErrorText():
+                logging.debug('{}\n'.format(cliNode.GetErrorText()))
+
+        failedCliNodes = [cliNode for cliNode in cliNodes if cliNode.GetStatusString() != 'Completed']
+        if not failedCliNodes:
+            self.integratTwoRawFiles(self._dir_path)
+
+        shutil.rmtree(os.path.dirname(self.oddMnriPath), ignore_errors=True)
+        shutil.rmtree(os.path.dirname(self.evenMnriPath), ignore_errors=True)
+        self.updateReconstructButtonEnabled()
+        return failedCliNodes[0] if failedCliNodes else self._cliNode
+
     def reconstruct(self, mnriPath, isCliSynchronous):
         # Mar
         mnri_settings = self._logic.MNRISettings(mnriPath)
@@ -199,6 +237,7 @@ class RFReconstructionWidget(RFViewerWidget):
         updateCliObserver(self._cliNode, self._cliNode.StatusModifiedEvent, self.onCLIModified)
 
         # Reconstruct the geometry
+        self._reconstructionSpan = profiler.startSpan("Reconstruct", "reconstruction", mnri=mnriPath)
         self._cliNode = self._logic.reconstruct(mnriPath, cliNode=self._cliNode, sync=isCliSynchronous)
 
         # Load the reconstructed geometry if synchronous
@@ -208,84 +247,6 @@ class RFReconstructionWidget(RFViewerWidget):
         self.updateReconstructButtonEnabled()
         return self._cliNode
 
-    def reconstruct_odd(self, mnriPath, isCliSynchronous):
-        # Synchronize line edit file path with input file path if necessary
-        if self._mnriLineEdit.currentPath != mnriPath:
-            self._mnriLineEdit.setCurrentPath(mnriPath)
-
-        # Create CLI Node if necessary
-        if self._cliNode is None:
-            self._cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-
-        # Add or remove CLI observer depending on if the execution is synchronous
-        updateCliObserver = self.addObserver if not isCliSynchronous else self.removeObserver
-        updateCliObserver(self._cliNode, self._cliNode.StatusModifiedEvent, self.onCLIModified)
-
-        # Reconstruct the geometry
-        self._cliNode = self._logic.reconstruct_odd(mnriPath, cliNode=self._cliNode, sync=True)
-
-        # Load the reconstructed geometry if synchronous
-        if isCliSynchronous:
-            self.onCLIModified_odd(self._cliNode, self._cliNode.StatusModifiedEvent)
-            self.reconstruct_even(isCliSynchronous=True, mnriPath = self.evenMnriPath)
-        self.updateReconstructButtonEnabled()
-        self.onReconstructedfortwoimage(self._cliNode)
-        return self._cliNode
-    def reconstruct_even(self, mnriPath, isCliSynchronous):
-        # Synchronize line edit file path with input file path if necessary
-        # if self._mnriLineEdit.currentPath != mnriPath:
-        #     self._mnriLineEdit.setCurrentPath(mnriPath)
-
-        # Create CLI Node if necessary
-        if self._cliNode is None:
-            self._cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-
-        # Add or remove CLI observer depending on if the execution is synchronous
-        updateCliObserver = self.addObserver if not isCliSynchronous else self.removeObserver
-        updateCliObserver(self._cliNode, self._cliNode.StatusModifiedEvent, self.onCLIModified)
-
-        # Reconstruct the geometry
-        self._cliNode = self._logic.reconstruct_even(mnriPath, cliNode=self._cliNode, sync=True)
-
-        # Load the reconstructed geometry if synchronous
-        if isCliSynchronous:
-            self.onCLIModified_even(self._cliNode, self._cliNode.StatusModifiedEvent)
-            self.integratTwoRawFiles(self._dir_path)
-        self.updateReconstructButtonEnabled()
-        
-        
-
-        return self._cliNode    
-    def onCLIModified_odd(self, cliNode, event):
-        logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
-
-        if self._cliNode.GetErrorText():
-            logging.debug('{}\n'.format(self._cliNode.GetErrorText()))
-
-        if cliNode.GetStatusString() == 'Scheduled':
-            self.addProgressBar.emit(self._progressText)
-
-        if not cliNode.IsBusy():
-            self.removeProgressBar.emit(self._progressText)
-
-            # if cliNode.GetStatusString() == 'Completed':
-            #     self.onReconstructed_odd(cliNode)
-        self.updateReconstructButtonEnabled()
-    def onCLIModified_even(self, cliNode, event):
-        logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
-
-        if self._cliNode.GetErrorText():
-            logging.debug('{}\n'.format(self._cliNode.GetErrorText()))
-
-        if cliNode.GetStatusString() == 'Scheduled':
-            self.addProgressBar.emit(self._progressText)
-
-        if not cliNode.IsBusy():
-            self.removeProgressBar.emit(self._progressText)
-
-            # if cliNode.GetStatusString() == 'Completed':
-            #     self.onReconstructed_even(cliNode)
-        self.updateReconstructButtonEnabled()
     def onCLIModified(self, cliNode, event):
         logging.info('{}:{}'.format(cliNode.GetParameterAsString('output'), cliNode.GetStatusString()))
 
@@ -297,41 +258,16 @@ class RFReconstructionWidget(RFViewerWidget):
 
         if not cliNode.IsBusy():
             self.removeProgressBar.emit(self._progressText)
+            if self._reconstructionSpan is not None:
+                self._reconstructionSpan.finish(status=cliNode.GetStatusString())
 
             if cliNode.GetStatusString() == 'Completed':
                 self.onReconstructed(cliNode)
         self.updateReconstructButtonEnabled()
     def integratTwoRawFiles(self, dir_path):
-        
-        mhdfilepath1 = os.path.join(dir_path,"frame1/reconstructed-volume1.raw")
-        # if os.path.exists(mhdfilepath1):
-        #     self.itkimage1 = sitk.ReadImage(mhdfilepath1)
-        mhdfilepath2 = os.path.join(dir_path,"frame2/reconstructed-volume2.raw")
-        mhdfilepath3 = os.path.join(dir_path,"reconstructed-volume1.raw")
-        # if not os.path.exists(mhdfilepath2):
-        #     time.sleep(30)
-        # if not os.path.exists(mhdfilepath3):
-        #     time.sleep(30)
-        
-        num_type = numpy.uint16
-        with open(mhdfilepath1, "rb") as rawfile:
-            self.volume1 = numpy.frombuffer(bytearray(rawfile.read()), dtype=num_type)
-        with open(mhdfilepath2, "rb") as rawfile:
-            self.volume2 = numpy.frombuffer(bytearray(rawfile.read()), dtype=num_type)    
-        with open(mhdfilepath3, "wb") as raw_file:
-            raw_file.write(bytearray(self.volume1.astype(self.volume1.dtype).flatten()))         
-            raw_file.write(bytearray(self.volume2.astype(self.volume2.dtype).flatten()))
-        shutil.copy(os.path.join(dir_path,"frame1/reconstructed-volume1.mhd"), os.path.join(dir_path,"reconstructed-volume1.mhd"))
-        with open(os.path.join(dir_path,"frame1/reconstructed-volume1.mhd"), "r") as mhdfile:
-            s = mhdfile.read()
-            # Read grid dimensions
-        m = re.search('DimSize = ([0-9]*) ([0-9]*) ([0-9]*)', s)
-        dimstr = 'DimSize = ' + m.group(1) + " " + m.group(2) + " " + m.group(3) 
-        dimstr1 = 'DimSize = ' + m.group(1) + " " + m.group(2) + " " + str(int(m.group(3)) * 2) 
-        s = s.replace(dimstr, dimstr1)
-        with open(os.path.join(dir_path,"reconstructed-volume1.mhd"), "w") as mhdfile:
-            mhdfile.write(s)
-        self._dataLoaderWidget.loadData(os.path.join(dir_path,"reconstructed-volume1.mhd"))   
+        self._logic.integrateDualImageVolumes(dir_path)
+        self.onReconstructedfortwoimage(self._cliNode)
+    @profiled("Load reconstructed volume", "reconstruction")
     def onReconstructed(self, cliNode):
         # Load reconstructed volume
         logging.info('Loading: {}'.format(cliNode.GetParameterAsString('output')))
@@ -362,6 +298,7 @@ class RFReconstructionWidget(RFViewerWidget):
 
         # Save MNRI directory as next session direction
         qt.QSettings().setValue("SessionDirectory", os.path.dirname(self._mnriLineEdit.currentPath))
+    @profiled("Load reconstructed dual image volume", "reconstruction")
     def onReconstructedfortwoimage(self, cliNode):
         # Load reconstructed volume
         logging.info('Loading: {}'.format(cliNode.GetParameterAsString('output')))
@@ -385,71 +322,143 @@ class RFReconstructionWidget(RFViewerWidget):
             elif filter == 'lowpass':
                 self._volumeFiltersLogic.applySharpenFilter(self._reconstructedVolume)
 
-    def onReconstructed_even(self, cliNode):
-        # Load reconstructed volume
-        logging.info('Loading: {}'.format(cliNode.GetParameterAsString('output')))
-        if self._dataLoaderWidget is not None:
-            self._reconstructedVolume = self._dataLoaderWidget.loadData(cliNode.GetParameterAsString('output'))
-        else:
-            self._reconstructedVolume = slicer.util.loadVolume(cliNode.GetParameterAsString('output'))
-        if self._reconstructedVolume is not None:
-            # msg = qt.QMessageBox()
-            # msg.setText(self._reconstructedVolume)
-            # msg.exec_()
-            self._volumeFiltersUI.setEnabled(True)
-            mnri_settings = self._logic.MNRISettings(self.evenMnriPath)
-            filter = mnri_settings.value('SieraRE/ProjSmoothFilterType', '').lower()
-            kernelSize = mnri_settings.value('SieraRE/ProjSmoothFilterW')
-            if filter == 'median':
-                self._volumeFiltersLogic.applyMedianFilter(self._reconstructedVolume, kernelSize)
-            elif filter == 'gauss':
-                self._volumeFiltersLogic.applyGaussianFilter(self._reconstructedVolume, kernelSize)
-            elif filter == 'lowpass':
-                self._volumeFiltersLogic.applySharpenFilter(self._reconstructedVolume)
     def clean(self):
         # Cancel previously running reconstruction if necessary on session reload
         if self._cliNode:
             self._cliNode.Cancel()
             removeNodeFromMRMLScene(self._cliNode)
             self._cliNode = None
+        if self._evenCliNode:
+            self._evenCliNode.Cancel()
+            removeNodeFromMRMLScene(self._evenCliNode)
+            self._evenCliNode = None
 
 
 class RFReconstructionLogic(ScriptedLoadableModuleLogic):
 
+    class MNRISection(Mapping):
+        """Read-only view on the values of one INI section, also accessible as attributes (frame.FrameWidth)"""
+        def __init__(self, values):
+            object.__setattr__(self, "_values", MappingProxyType(dict(values)))
+
+        def __getitem__(self, key):
+            return self._values[key]
+
+        def __iter__(self):
+            return iter(self._values)
+
+        def __len__(self):
+            return len(self._values)
+
+        def __getattr__(self, name):
+            if name.startswith("_"):
+                raise AttributeError(name)
+            try:
+                return self._values[name]
+            except KeyError:
+                raise AttributeError(name)
+
+        def __setattr__(self, name, value):
+            raise AttributeError("MNRI sections are read-only")
+
+    @dataclass(frozen=True)
+    class MNRIRecord:
+        """
+        Immutable snapshot of an INI / MNRI file.
+        values holds every "Section/Key" value converted once to float when numeric, str otherwise,
+        rawValues the values as stored in the file.
+        """
+        path: str
+        mtime_ns: int
+        size: int
+        values: Mapping
+        rawValues: Mapping
+        Frame: Mapping
+        Geometry: Mapping
+        BackProjection: Mapping
+        Process: Mapping
+        DicomPatientInfo: Mapping
+
+        @staticmethod
+        def toValue(raw):
+            """Returns raw as float if it is a number, "" if None, raw otherwise"""
+            if raw is None:
+                return ""
+            try:
+                return float(raw)
+            except (TypeError, ValueError):
+                return raw
+
+        @classmethod
+        def fromFile(cls, ini_file_path):
+            stat = os.stat(ini_file_path)
+            settings = qt.QSettings(ini_file_path, qt.QSettings.IniFormat)
+            settings.setIniCodec("UTF-8")
+            rawValues = {key: settings.value(key) for key in settings.allKeys()}
+            values = {key: cls.toValue(raw) for key, raw in rawValues.items()}
+
+            def section(name):
+                prefix = name + "/"
+                return RFReconstructionLogic.MNRISection(
+                    {key[len(prefix):]: value for key, value in values.items() if key.startswith(prefix)})
+
+            return cls(path=ini_file_path, mtime_ns=stat.st_mtime_ns, size=stat.st_size,
+                       values=MappingProxyType(values), rawValues=MappingProxyType(rawValues),
+                       Frame=section("Frame"), Geometry=section("Geometry"), BackProjection=section("BackProjection"),
+                       Process=section("Process"), DicomPatientInfo=section("DicomPatientInfo"))
+
     class Settings:
-        """Convenient class to access INI values in original type"""
+        """
+        Convenient class to access INI values in original type.
+        Files are parsed once per process into an MNRIRecord, and parsed again only when their modification time or
+        size changes.
+        """
+        _records = {}
+
         def __init__(self, ini_file_path):
             if not os.path.isfile(ini_file_path):
                 raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), ini_file_path)
-            
-            self.settings = qt.QSettings()
-            self.settings.setIniCodec("UTF-8")        
 
-            self.settings = qt.QSettings(ini_file_path, qt.QSettings.IniFormat)
-            self.settings.setIniCodec("UTF-8")  
+            self.record = self.cachedRecord(ini_file_path)
+            self._lowerCaseKeys = None
+
+        @classmethod
+        def cachedRecord(cls, ini_file_path):
+            """Returns the parsed content of the INI file, from the process wide cache if the file didn't change"""
+            key = os.path.normcase(os.path.abspath(ini_file_path))
+            stat = os.stat(ini_file_path)
+            record = cls._records.get(key)
+            if record is None or (record.mtime_ns, record.size) != (stat.st_mtime_ns, stat.st_size):
+                record = RFReconstructionLogic.MNRIRecord.fromFile(ini_file_path)
+                cls._records[key] = record
+            return record
+
+        @classmethod
+        def clearCache(cls):
+            cls._records.clear()
+
+        def _key(self, name):
+            """Returns the record key matching name, ignoring the case as QSettings does on Windows"""
+            if name in self.record.values:
+                return name
+            if self._lowerCaseKeys is None:
+                self._lowerCaseKeys = {key.lower(): key for key in self.record.values}
+            return self._lowerCaseKeys.get(name.lower())
+
         def value(self, name, default=None):
             """Read INI value with input name section and return value as float if number else as str"""
-            try:
-                value = self.settings.value(name, default)
-                if value is None:
-                    return ""
-                else:    
-                    return float(value)
-            except ValueError:
-                # value =value.encode("utf-8")
-                # value = value.decode("utf-8")
-                return value        
+            key = self._key(name)
+            if key is None:
+                return self.record.toValue(default)
+            return self.record.values[key]
         #RF_20220203_yori
         def IDvalue(self, name, default=None) -> str:
-            """Read INI value with input name section and return value as float if number else as str"""
-            try:
-                value = self.settings.value(name, default)
-                if value is None:
-                    return ""
-                else:
-                    return str(value)
-            except ValueError:
-                return value
+            """Read INI value with input name section and return value as str, keeping leading zeros"""
+            key = self._key(name)
+            value = default if key is None else self.record.rawValues[key]
+            if value is None:
+                return ""
+            return str(value)
         #RF_20220203_end
         def sectionValue(self, section, name, default=None):
             return self.value('{}/{}'.format(section, name), default)
@@ -478,6 +487,18 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             #     os.rename(tmpfile, mnri_file_path)
             super().__init__(mnri_file_path)
 
+    # Contiguous projection stack written next to an MNRI file in place of the per frame image_NNN.img files
+    PROJECTION_STACK_FILE_NAME = "projections.raw"
+    PROJECTION_STACK_INDEX_FILE_NAME = "projections.json"
+    FRAME_DTYPE = np.dtype('<u2')
+    FRAME_CHUNK_BYTES = 64 * 1024 * 1024
+
+    # Stack index content per index file path, shared by every logic instance
+    _projectionStackIndexes = {}
+
+    # Raw to Hounsfield Units lookup tables per (iDark, i0, air, water) conversion parameters
+    _rawToHounsfieldUnitsLUTs = {}
+
     def __init__(self):
         super(RFReconstructionLogic, self).__init__()
         self._tmpSymlink = TemporarySymlink()
@@ -522,6 +543,7 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         mnri_data["XSpacing"] = mnri_data["FrameLengthWidth"] / mnri_data["FrameWidth"]
         mnri_data["YSpacing"] = mnri_data["FrameLengthHeight"] / mnri_data["FrameHeight"]
         mnri_data["LastFrameIndex"] = mnri_data["FrameCount"] - 1
+        mnri_data["HeaderSize"], mnri_data["ElementDataFile"] = self.elementDataFile(mnri_file_path, mnri_data)
 
         imageFormatToElementType = {
             'Bmp':'MET_USHORT',
@@ -538,11 +560,11 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             NDims = 3
             DimSize = {FrameWidth:.0f} {FrameHeight:.0f} {FrameCount:.0f}
             ElementType = {ElementType}
-            HeaderSize = -1
+            HeaderSize = {HeaderSize}
             ElementSize = 1 1 1
             ElementSpacing = {XSpacing:.5f} {YSpacing:.5f} 1
             ElementByteOrderMSB = False
-            ElementDataFile = {FrameFolder}/{FrameBaseName}%0{FrameNameDigit:.0f}d.{ImageFileExt} 0 {LastFrameIndex:.0f} 1
+            ElementDataFile = {ElementDataFile}
             """.format(**mnri_data)
 
         return self.stripWhiteSpace(mhd)
@@ -555,6 +577,12 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         :raises: ValueError if MNRI file doesn't exist
         :return: full path to the created MHD file
         """
+        if self.isProjectionStackPackingEnabled():
+            try:
+                self.packProjectionStack(mnri_file_path)
+            except (OSError, ValueError) as e:
+                logging.warning("Failed to pack projection stack, using frame files instead: {}".format(e))
+
         mhd_file_text = self.convertMnriToMhd(mnri_file_path)
 
         out_file_name = os.path.basename(mnri_file_path).replace(".mnri", ".mhd")
@@ -565,6 +593,143 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
 
         return output_path
 
+    def elementDataFile(self, mnri_file_path, mnri_data):
+        """
+        Returns the MHD HeaderSize and ElementDataFile values for the projections of the input MNRI file.
+        The contiguous projection stack is used when an up to date one exists next to the MNRI file, the frame file list
+        otherwise.
+        """
+        layout = (int(mnri_data["LastFrameIndex"]) + 1, (int(mnri_data["FrameHeight"]), int(mnri_data["FrameWidth"])),
+                  self.frameDtype(mnri_data["ImageFormat"]))
+        if self.projectionStackPath(mnri_file_path, layout) is not None:
+            return 0, self.PROJECTION_STACK_FILE_NAME
+
+        return -1, "{FrameFolder}/{FrameBaseName}%0{FrameNameDigit:.0f}d.{ImageFileExt} 0 {LastFrameIndex:.0f} 1".format(
+            **mnri_data)
+
+    @staticmethod
+    def isProjectionStackPackingEnabled():
+        """Packing the frames in a contiguous projection stack is opt-in through the Reconstruction/PackProjectionStack
+        setting"""
+        return strToBool(qt.QSettings().value("Reconstruction/PackProjectionStack", False))
+
+    @classmethod
+    def frameDtype(cls, image_format):
+        """Returns the numpy dtype of the frame pixels for the MNRI Frame/ImageFormat value"""
+        return np.dtype(np.uint8) if image_format == 'Raw8' else cls.FRAME_DTYPE
+
+    @classmethod
+    def projectionLayout(cls, mnri_settings):
+        """Returns the (FrameCount, (FrameHeight, FrameWidth), dtype) of the projections described by the MNRI file"""
+        frame_count = int(mnri_settings.value("Frame/FrameCount"))
+        frame_shape = (int(mnri_settings.value("Frame/FrameHeight")), int(mnri_settings.value("Frame/FrameWidth")))
+        return frame_count, frame_shape, cls.frameDtype(mnri_settings.value("Frame/ImageFormat"))
+
+    @staticmethod
+    def frameSignature(frame_paths):
+        """Returns the [path, mtime, size] list used to detect modified frames"""
+        signature = []
+        for path in frame_paths:
+            stat = os.stat(path)
+            signature.append([os.path.normpath(path), stat.st_mtime_ns, stat.st_size])
+        return signature
+
+    @classmethod
+    def writeProjectionStackIndex(cls, stack_path, mnri_file_path, frame_paths, layout, source=None):
+        """
+        Writes the index describing a contiguous projection stack next to it.
+        The index records the MNRI file and its signature, the (frame count, frame shape, dtype) layout of the stack and
+        the signature of the frames the stack was computed from.
+
+        :param source: JSON serializable description of how the stack is computed from the frames, for stacks that are
+        not a copy of them. The reconstruction cache keys these stacks on the frames and this description.
+        """
+        frame_count, frame_shape, dtype = layout
+        index = {
+            "mnri": os.path.normpath(mnri_file_path),
+            "mnri_signature": cls.frameSignature([mnri_file_path])[0],
+            "frame_count": int(frame_count),
+            "shape": list(frame_shape),
+            "dtype": np.dtype(dtype).str,
+            "stack_size": os.path.getsize(stack_path),
+            "frames": cls.frameSignature(frame_paths),
+        }
+        if source is not None:
+            index["source"] = source
+        index_path = os.path.join(os.path.dirname(stack_path), cls.PROJECTION_STACK_INDEX_FILE_NAME)
+        with open(index_path, "w") as f:
+            json.dump(index, f)
+        cls._projectionStackIndexes.pop(index_path, None)
+
+    @classmethod
+    def readProjectionStackIndex(cls, index_path):
+        """Returns the content of the stack index file, cached until the file is modified"""
+        mtime = os.stat(index_path).st_mtime_ns
+        cached = cls._projectionStackIndexes.get(index_path)
+        if cached is None or cached[0] != mtime:
+            with open(index_path, "r") as f:
+                cached = (mtime, json.load(f))
+            cls._projectionStackIndexes[index_path] = cached
+        return cached[1]
+
+    def projectionStackPath(self, mnri_file_path, layout=None):
+        """
+        Returns the path of the contiguous projection stack next to the MNRI file if it is up to date with the MNRI
+        file and its source frames, None otherwise.
+
+        :param layout: (frame count, frame shape, dtype) the stack must have, read from the MNRI file if None
+        """
+        dir_path = os.path.dirname(mnri_file_path)
+        stack_path = os.path.join(dir_path, self.PROJECTION_STACK_FILE_NAME)
+        index_path = os.path.join(dir_path, self.PROJECTION_STACK_INDEX_FILE_NAME)
+        try:
+            index = self.readProjectionStackIndex(index_path)
+            if index["mnri"] != os.path.normpath(mnri_file_path) or index["stack_size"] != os.path.getsize(stack_path):
+                return None
+            if index["mnri_signature"] != self.frameSignature([mnri_file_path])[0]:
+                return None
+            frame_count, frame_shape, dtype = layout if layout is not None else self.projectionLayout(
+                self.MNRISettings(mnri_file_path))
+            if (index["frame_count"], index["shape"], index["dtype"]) != (frame_count, list(frame_shape),
+                                                                          np.dtype(dtype).str):
+                return None
+            if index["frames"] != self.frameSignature([frame[0] for frame in index["frames"]]):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return stack_path
+
+    @profiled("Pack projection stack", "reconstruction")
+    def packProjectionStack(self, mnri_file_path, chunk_bytes=FRAME_CHUNK_BYTES):
+        """
+        Concatenates the projection frames of the MNRI file in one contiguous raw file next to it.
+        The stack is only written if missing or out of date.
+
+        :param mnri_file_path: full path to an existing MNRI file
+        :param chunk_bytes: upper bound of the data copied at once
+        :return: full path to the projection stack
+        """
+        stack_path = self.projectionStackPath(mnri_file_path)
+        if stack_path is not None:
+            return stack_path
+
+        mnri_settings = self.MNRISettings(mnri_file_path)
+        dir_path = os.path.dirname(mnri_file_path)
+        layout = self.projectionLayout(mnri_settings)
+        frame_count, frame_shape, dtype = layout
+        frame_paths = self.frameFilePaths(mnri_settings, dir_path, frame_count)
+        frames = self.mapFrames(frame_paths, frame_shape, dtype)
+
+        chunk_size = max(1, chunk_bytes // (int(np.prod(frame_shape)) * dtype.itemsize))
+        stack_path = os.path.join(dir_path, self.PROJECTION_STACK_FILE_NAME)
+        with open(stack_path, "wb") as stack_file:
+            for start in range(0, frame_count, chunk_size):
+                np.stack(frames[start:start + chunk_size]).tofile(stack_file)
+        del frames
+
+        self.writeProjectionStackIndex(stack_path, mnri_file_path, frame_paths, layout)
+        return stack_path
+
     def convertMnriToMhd1(self, mnri_file_path):
         """
         Creates an mhd string corresponding to the information contained in the input mnri file path.
@@ -585,6 +750,7 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         mnri_data["XSpacing"] = mnri_data["FrameLengthWidth"] / mnri_data["FrameWidth"]
         mnri_data["YSpacing"] = mnri_data["FrameLengthHeight"] / mnri_data["FrameHeight"]
         mnri_data["LastFrameIndex"] = mnri_data["FrameCount1"] - 1
+        mnri_data["HeaderSize"], mnri_data["ElementDataFile"] = self.elementDataFile(mnri_file_path, mnri_data)
 
         imageFormatToElementType = {
             'Bmp':'MET_USHORT',
@@ -599,11 +765,11 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             NDims = 3
             DimSize = {FrameWidth:.0f} {FrameHeight:.0f} {FrameCount1:.0f}
             ElementType = {ElementType}
-            HeaderSize = -1
+            HeaderSize = {HeaderSize}
             ElementSize = 1 1 1
             ElementSpacing = {XSpacing:.5f} {YSpacing:.5f} 1
             ElementByteOrderMSB = False
-            ElementDataFile = {FrameFolder}/{FrameBaseName}%0{FrameNameDigit:.0f}d.{ImageFileExt} 0 {LastFrameIndex:.0f} 1
+            ElementDataFile = {ElementDataFile}
             """.format(**mnri_data)
 
         return self.stripWhiteSpace(mhd)
@@ -645,6 +811,7 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         mnri_data["XSpacing"] = mnri_data["FrameLengthWidth"] / mnri_data["FrameWidth"]
         mnri_data["YSpacing"] = mnri_data["FrameLengthHeight"] / mnri_data["FrameHeight"]
         mnri_data["LastFrameIndex"] = mnri_data["FrameCount2"] - 1
+        mnri_data["HeaderSize"], mnri_data["ElementDataFile"] = self.elementDataFile(mnri_file_path, mnri_data)
 
         imageFormatToElementType = {
             'Bmp':'MET_USHORT',
@@ -659,11 +826,11 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             NDims = 3
             DimSize = {FrameWidth:.0f} {FrameHeight:.0f} {FrameCount2:.0f}
             ElementType = {ElementType}
-            HeaderSize = -1
+            HeaderSize = {HeaderSize}
             ElementSize = 1 1 1
             ElementSpacing = {XSpacing:.5f} {YSpacing:.5f} 1
             ElementByteOrderMSB = False
-            ElementDataFile = {FrameFolder}/{FrameBaseName}%0{FrameNameDigit:.0f}d.{ImageFileExt} 0 {LastFrameIndex:.0f} 1
+            ElementDataFile = {ElementDataFile}
             """.format(**mnri_data)
 
         return self.stripWhiteSpace(mhd)
@@ -1124,6 +1291,64 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         i0 = pow(2, pixelDepth)
         return [iDark, i0]
 
+    @staticmethod
+    def rawToAttenuation(raw, i_dark, i0, out=None):
+        """
+        Converts raw projection values to attenuation : -log((raw - iDark) / (i0 - iDark)), raw values <= 0 being
+        considered as 1. The input is never modified, the float32 result is written to out when given.
+        """
+        if out is None:
+            out = np.empty(np.shape(raw), dtype=np.float32)
+        np.copyto(out, raw, casting="unsafe")
+        np.putmask(out, out <= 0, 1)
+        out -= i_dark
+        out *= 1. / (i0 - i_dark)
+        np.log(out, out=out)
+        np.negative(out, out=out)
+        return out
+
+    @staticmethod
+    def attenuationToHounsfieldUnits(attenuation, air_value, water_value, out=None):
+        """
+        Scales attenuation values to Hounsfield Units : (attenuation - water) * 1000 / (water - air). The result is
+        written to out when given, out may be the input array.
+        """
+        scale = 1000. / (water_value - air_value)
+        out = np.multiply(attenuation, scale, out=out, dtype=np.float32)
+        out -= water_value * scale
+        return out
+
+    @classmethod
+    def rawToHounsfieldUnitsLUT(cls, i_dark, i0, air_value, water_value):
+        """Returns the read-only float32 Hounsfield Units of every 16 bit raw value, computed once per parameters"""
+        key = (float(i_dark), float(i0), float(air_value), float(water_value))
+        lut = cls._rawToHounsfieldUnitsLUTs.get(key)
+        if lut is None:
+            lut = cls.rawToAttenuation(np.arange(65536, dtype=np.float32), key[0], key[1])
+            cls.attenuationToHounsfieldUnits(lut, key[2], key[3], out=lut)
+            lut.flags.writeable = False
+            cls._rawToHounsfieldUnitsLUTs[key] = lut
+        return lut
+
+    @classmethod
+    def rawToHounsfieldUnits(cls, raw, i_dark, i0, air_value, water_value, out=None):
+        """
+        Converts raw projection values to Hounsfield Units in float32 without modifying the input.
+
+        8 and 16 bit unsigned inputs are looked up in the 65536 entries table of rawToHounsfieldUnitsLUT, other inputs
+        go through rawToAttenuation and attenuationToHounsfieldUnits in the output buffer.
+
+        :param out: optional float32 array of the input shape receiving the result
+        :return: Hounsfield Units array
+        """
+        raw = np.asarray(raw)
+        if raw.dtype in (np.uint8, np.uint16):
+            lut = cls.rawToHounsfieldUnitsLUT(i_dark, i0, air_value, water_value)
+            return np.take(lut, raw, out=out, mode="clip")
+
+        out = cls.rawToAttenuation(raw, i_dark, i0, out=out)
+        return cls.attenuationToHounsfieldUnits(out, air_value, water_value, out=out)
+
     def cleanupMhdFile(self, mhd_file_path):
         if os.path.exists(mhd_file_path):
             os.remove(mhd_file_path)
@@ -1164,214 +1389,295 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
     def int_to_signed_short(self, value):
         return -(value & 0x8000) | (value & 0x7fff)
 
-    def filesubtration(self,totalcount,count, dir_path, filename1, filename2):
-        print("filename1")
-        print("filename2") 
-
-        img_path = os.path.join(dir_path, "frame/" + filename1)
-        img_path1 = os.path.join(dir_path, "frame/"+ filename2)
-        tmpcount = int(count//2)
-        tmpcount1 = int(totalcount // 2) + tmpcount
-        if tmpcount < 10:
-            newfilename = "image_00" + str(tmpcount) + ".img"
-        elif tmpcount< 100:
-            newfilename = "image_0" + str(tmpcount) + ".img"
-        else:
-            newfilename = "image_" + str(tmpcount) + ".img"
-        
-        if tmpcount1 < 10:
-            newfilename1 = "image_00" + str(tmpcount1) + ".img"
-        elif tmpcount1< 100:
-            newfilename1 = "image_0" + str(tmpcount1) + ".img"
-        else:
-            newfilename1 = "image_" + str(tmpcount1) + ".img"
+    @staticmethod
+    def frameFilePaths(mnri_settings, dir_path, frame_count):
+        """Returns the path of the first frame_count projection frames described in the MNRI [Frame] section"""
+        folder = mnri_settings.value("Frame/FrameFolder") or "frame"
+        base_name = mnri_settings.value("Frame/FrameBaseName") or "image_"
+        digits = int(mnri_settings.value("Frame/FrameNameDigit") or 3)
+        extension = mnri_settings.value("Frame/ImageFileExt") or "img"
+        return [os.path.join(dir_path, folder, "{}{:0{}d}.{}".format(base_name, i, digits, extension))
+                for i in range(frame_count)]
+
+    @staticmethod
+    def mapFrames(frame_paths, frame_shape, dtype=FRAME_DTYPE):
+        """
+        Memory-map every projection frame as a (FrameHeight, FrameWidth) array, little endian uint16 by default.
+        Pixel data is read from the end of each file, the same way HeaderSize = -1 does in the MHD headers.
+        """
+        frame_bytes = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+        return [np.memmap(path, dtype=dtype, mode='r', offset=os.path.getsize(path) - frame_bytes, shape=frame_shape)
+                for path in frame_paths]
 
-        print(newfilename)
-        print(newfilename1) 
-        # arraysize = int (os.stat(img_path).st_size / 2 + 1)
+    def mapProjections(self, mnri_file_path):
+        """
+        Memory-map the projections of the MNRI file without reading them.
+        The contiguous projection stack is used when an up to date one exists, the frame files otherwise. Indexing the
+        returned sequence with a frame index gives a (FrameHeight, FrameWidth) array, only the pages actually accessed
+        are read from disk.
+        """
+        if self.isProjectionStackPackingEnabled():
+            try:
+                self.packProjectionStack(mnri_file_path)
+            except (OSError, ValueError) as e:
+                logging.warning("Failed to pack projection stack, using frame files instead: {}".format(e))
 
-        # resultfile = self.read_file(img_path, "little")
-        # resultfile1 = self.read_file(img_path1, "little")
-        # tmp_result = [None] * len(resultfile);    
+        mnri_settings = self.MNRISettings(mnri_file_path)
+        layout = self.projectionLayout(mnri_settings)
+        frame_count, frame_shape, dtype = layout
 
-        # for i in range(0, len(resultfile)):    
-        #     if i< 40 :
-        #         tmp_result[i] = resultfile[i] 
-        #     else:
-        #         tmp_result[i] = resultfile[i] - round(resultfile1[i] * 0.017)     
-        
-        result_dir = os.path.join(dir_path,"frame_result1")
-        if not os.path.exists(result_dir):
-            os.mkdir(result_dir)
-        
-        shutil.copy(img_path, result_dir)
-        os.rename(os.path.join(result_dir, filename1), os.path.join(result_dir, newfilename))
-        dir = os.path.join(dir_path,"frame1")
-        if not os.path.exists(dir):
-            os.mkdir(dir)
-        shutil.copy(os.path.join(dir_path, "NAOMICT.mnri"), dir)
-        
-        dir = os.path.join(dir_path,"frame1/frame")
-        if not os.path.exists(dir):
-            os.mkdir(dir)    
-        shutil.copy(os.path.join(result_dir, newfilename), dir)
-        
+        stack_path = self.projectionStackPath(mnri_file_path, layout)
+        if stack_path is not None:
+            return np.memmap(stack_path, dtype=dtype, mode='r', shape=(frame_count,) + frame_shape)
 
-        result_dir = os.path.join(dir_path,"frame_result2")
-        if not os.path.exists(result_dir):
-            os.mkdir(result_dir)
-
-        shutil.copy(img_path1, result_dir)
-        os.rename(os.path.join(result_dir, filename2), os.path.join(result_dir, newfilename))
-        dir = os.path.join(dir_path,"frame2")
-        if not os.path.exists(dir):
-            os.mkdir(dir)
-        shutil.copy(os.path.join(dir_path, "NAOMICT.mnri"), dir)
-        dir = os.path.join(dir_path,"frame2/frame")
-        if not os.path.exists(dir):
-            os.mkdir(dir) 
-        shutil.copy(os.path.join(result_dir, newfilename), dir)
-        print(os.path.join(result_dir, filename1))
-        print(os.path.join(result_dir, filename2))
-        print(os.path.join(result_dir, newfilename))
-        #     dir = os.path.join(dir_path,"frame2")    
-        #     if not os.path.exists(dir):
-        #         os.mkdir(dir)
-        #     result_img_path = os.path.join(dir_path, "frame2/"+ newfilename)
-        #     my_array = np.array( tmp_result , dtype='H')
-        #     self.write_file(result_img_path, my_array)
-        #     shutil.copy(result_img_path, result_dir)
-        # return "ok"
-    def converting_files(self, mnri_file_path):
-        
+        frame_paths = self.frameFilePaths(mnri_settings, os.path.dirname(mnri_file_path), frame_count)
+        return self.mapFrames(frame_paths, frame_shape, dtype)
+
+    @staticmethod
+    def iterLagCorrectedFrames(frames, lag, chunk_bytes=FRAME_CHUNK_BYTES):
+        """
+        Yields (first_index, chunk) with chunk holding frame[i] - lag * frame[i - 1] for consecutive frames.
+
+        The subtraction is done in float32 on chunks of at most chunk_bytes, always starting on an even frame index.
+        The first frame is kept as is and negative values are clipped to 0.
+        """
+        if not frames:
+            return
+
+        frame_shape = frames[0].shape
+        chunk_size = max(2, chunk_bytes // (frames[0].size * 4) // 2 * 2)
+        source = np.zeros((chunk_size + 1,) + frame_shape, dtype=np.float32)
+        corrected = np.empty((chunk_size,) + frame_shape, dtype=np.float32)
+
+        for start in range(0, len(frames), chunk_size):
+            count = min(chunk_size, len(frames) - start)
+            for i in range(count):
+                source[i + 1] = frames[start + i]
+
+            result = corrected[:count]
+            np.multiply(source[:count], -lag, out=result)
+            result += source[1:count + 1]
+            np.clip(result, 0, np.iinfo(np.uint16).max, out=result)
+            yield start, result.astype(np.uint16)
+
+            # Last frame of this chunk is the previous frame of the next one
+            source[0] = source[count]
+
+    @profiled("Convert dual image frames", "reconstruction")
+    def converting_files(self, mnri_file_path, chunk_bytes=FRAME_CHUNK_BYTES):
+        """
+        Lag corrects the projections of a dual image acquisition (Frame/Type == 1) and splits them in two stacks.
+
+        Each frame is corrected as frame[i] - Subtraction * frame[i - 1]. Odd frames are written to
+        frame1/projections.raw and even frames to frame2/projections.raw, next to a copy of the MNRI file and
+        its MHD header. The source frames are memory-mapped once and left untouched.
+
+        :param mnri_file_path: full path to the dual image MNRI file
+        :param chunk_bytes: upper bound of the float32 working buffer used for the subtraction
+        :return: paths of the odd and even MNRI files
+        """
         mnri_settings = self.MNRISettings(mnri_file_path)
-        # typevalues = mnri_settings.value("Frame/Type")
-        # if typevalues == 1:
         dir_path = os.path.dirname(mnri_file_path)
-        filecount = int(mnri_settings.value("Frame/FrameCount"))
-        print("filecount: " , filecount )
+        frame_count = int(mnri_settings.value("Frame/FrameCount"))
+        frame_shape = (int(mnri_settings.value("Frame/FrameHeight")), int(mnri_settings.value("Frame/FrameWidth")))
         try:
-            rangeValue =  float(mnri_settings.value("Frame/Subtraction"))
-        except:
-            rangeValue =  0.017
-        
-        result_dir11 = os.path.join(dir_path,"framecal")
-        if not os.path.exists(result_dir11):
-            os.mkdir(result_dir11)
-        img_path = ""
-        
-        for i in range(1, filecount, 1):
-            j = i - 1
-            if i < 10:
-                img_path = "image_00" + str(i) + ".img"
-            elif i< 100:
-                img_path = "image_0" + str(i) + ".img"
-            else:
-                img_path = "image_" + str(i) + ".img"
-            img_file_path = os.path.join(dir_path, "frame/" + img_path)
-          
-            if j < 10:
-                img_path1 = "image_00" + str(j) + ".img"
-            elif j< 100:
-                img_path1 = "image_0" + str(j) + ".img"
-            else:
-                img_path1 = "image_" + str(j) + ".img"    
-            img_file_path1 = os.path.join(dir_path, "frame/" + img_path1)
-           
-            resultfile = np.fromfile(img_file_path, dtype=np.uint16)
-            resultfile1 = np.fromfile(img_file_path1, dtype=np.uint16)
-            
-            
-            tmp_result = resultfile - resultfile1 * rangeValue  
-            my_array = np.array( tmp_result , dtype=np.uint16)
-            
-            
-            
-            my_array.tofile(result_dir11 + "/" + img_path)
-
-            # print("result file2:", os.path.join(result_dir11,  img_path))
-            # resultfile2 = np.fromfile(os.path.join(result_dir11,  img_path), dtype=np.uint16)
-            # print("resultfile2: "+ resultfile2)
-        print("1")
-        shutil.copyfile(dir_path+ "/frame/image_000.img", dir_path+ "/framecal/image_000.img")
-        os.rename(dir_path + "/" + "frame", dir_path + "/" + "frame_original")
-        os.rename(result_dir11, dir_path + "/" + "frame") 
-        print("2")
-        img_path = ""
-        img_path1 = ""
-        for i in range(1, filecount, 2 ):  
-            j = i - 1  
-            if i < 10:
-                img_path = "image_00" + str(i) + ".img"
-            elif i< 100:
-                img_path = "image_0" + str(i) + ".img"
-            else:
-                img_path = "image_" + str(i) + ".img"
-            
-            if j < 10:
-                img_path1 = "image_00" + str(j) + ".img"
-            elif j< 100:
-                img_path1 = "image_0" + str(j) + ".img"
-            else:
-                img_path1 = "image_" + str(j) + ".img"
-            
-            print("img_path", img_path)
-            
-            print("img_path1", img_path1)
-            self.filesubtration(filecount, i, dir_path, img_path, img_path1)
-
-            # oldpath = os.path.join(dir_path,"frame")
-            # tmppath = os.path.join(dir_path,"frame_tmp")
-            # if os.path.exists(oldpath):
-            #     os.rename(oldpath, tmppath)
-
-            # oldpath = os.path.join(dir_path,"frame_result")
-            # tmppath = os.path.join(dir_path,"frame")
-            # if os.path.exists(oldpath):
-            #     os.rename(oldpath, tmppath)
-        
-         
-        # filename1 = ""
-        # source_dir = os.path.join(dir_path,"frame1")
-        # if os.path.exists(source_dir):
-        #     file_names = os.listdir(source_dir)
-        #     ii = 0
-        #     for file_name in file_names:
-        #         # shutil.copy(os.path.join(source_dir, file_name), newpath)
-        #         if ii < 10:
-        #             filename1 = "image_00" + str(ii) + ".img"
-        #         elif ii < 100:
-        #             filename1 = "image_0" + str(ii) + ".img"
-        #         else:
-        #             filename1 = "image_" + str(ii) + ".img"
-        #         os.rename(os.path.join(source_dir, file_name), os.path.join(source_dir, filename1))
-        #         ii = ii + 1
-
-        # shutil.copy(os.path.join(tmppath, "air_0.img"), source_dir)     
-        # shutil.copy(os.path.join(tmppath, "dark_0.img"), source_dir)
-
-        # source_dir = os.path.join(dir_path,"frame2")
-        # if os.path.exists(source_dir):
-        #     file_names = os.listdir(source_dir)
-        #     jj = 0
-        #     for file_name in file_names:
-        #         # shutil.copy(os.path.join(source_dir, file_name), newpath)
-        #         if jj < 10:
-        #             filename1 = "image_00" + str(jj) + ".img"
-        #         elif jj < 100:
-        #             filename1 = "image_0" + str(jj) + ".img"
-        #         else:
-        #             filename1 = "image_" + str(jj) + ".img"
-        #         os.rename(os.path.join(source_dir, file_name), os.path.join(source_dir, filename1))
-        #         jj = jj + 1
-
-        # shutil.copy(os.path.join(tmppath, "air_0.img"), source_dir)     
-        # shutil.copy(os.path.join(tmppath, "dark_0.img"), source_dir)
-
-        # shutil.copy(os.path.join(tmppath, "air_0.img"), newpath)     
-        # shutil.copy(os.path.join(tmppath, "dark_0.img"), newpath)
-        # shutil.copy(os.path.join(tmppath, "image_000.img"), newpath)
-    
+            lag = float(mnri_settings.value("Frame/Subtraction"))
+        except (TypeError, ValueError):
+            lag = 0.017
+
+        # Frames are paired (odd, previous even), a trailing unpaired frame is dropped
+        frame_paths = self.frameFilePaths(mnri_settings, dir_path, 2 * (frame_count // 2))
+        frames = self.mapFrames(frame_paths, frame_shape)
+
+        mnri_paths = []
+        for stack_dir in ["frame1", "frame2"]:
+            os.makedirs(os.path.join(dir_path, stack_dir), exist_ok=True)
+            mnri_paths.append(os.path.join(dir_path, stack_dir, "NAOMICT.mnri"))
+            shutil.copyfile(mnri_file_path, mnri_paths[-1])
+
+        odd_mnri_path, even_mnri_path = mnri_paths
+        odd_stack_path = os.path.join(os.path.dirname(odd_mnri_path), self.PROJECTION_STACK_FILE_NAME)
+        even_stack_path = os.path.join(os.path.dirname(even_mnri_path), self.PROJECTION_STACK_FILE_NAME)
+        with open(odd_stack_path, "wb") as odd_file, open(even_stack_path, "wb") as even_file:
+            for _, chunk in self.iterLagCorrectedFrames(frames, lag, chunk_bytes):
+                chunk[1::2].tofile(odd_file)
+                chunk[0::2].tofile(even_file)
+        del frames
+
+        stack_layout = (len(frame_paths) // 2, frame_shape, self.FRAME_DTYPE)
+        self.writeProjectionStackIndex(odd_stack_path, odd_mnri_path, frame_paths, stack_layout,
+                                       {"frames": "odd", "subtraction": lag})
+        self.writeProjectionStackIndex(even_stack_path, even_mnri_path, frame_paths, stack_layout,
+                                       {"frames": "even", "subtraction": lag})
+        self.createMhdFile1(odd_mnri_path)
+        self.createMhdFile2(even_mnri_path)
+        return odd_mnri_path, even_mnri_path
+
+    @staticmethod
+    def isDualImageAcquisition(mnri_settings):
+        """Dual image acquisitions (Frame/Type == 1) interleave two series of projections"""
+        return mnri_settings.value("Frame/Type") == 1
+
+    @profiled("Merge dual image volumes", "reconstruction")
+    def integrateDualImageVolumes(self, dir_path, chunk_bytes=FRAME_CHUNK_BYTES):
+        """
+        Stacks the odd (frame1) and even (frame2) reconstructed volumes of a dual image acquisition along Z in
+        reconstructed-volume1.mhd next to the MNRI file.
+
+        :param dir_path: directory of the dual image MNRI file
+        :param chunk_bytes: size of the buffer used to copy the volumes
+        :return: full path to the merged MHD file
+        """
+        mhdfilepath1 = os.path.join(dir_path,"frame1/reconstructed-volume1.raw")
+        mhdfilepath2 = os.path.join(dir_path,"frame2/reconstructed-volume2.raw")
+        mhdfilepath3 = os.path.join(dir_path,"reconstructed-volume1.raw")
+
+        # Both halves are written by the same CLI parameters : a size mismatch means one of the outputs is truncated
+        if os.path.getsize(mhdfilepath1) != os.path.getsize(mhdfilepath2):
+            raise ValueError(f"Odd and even reconstructed volumes differ in size : {mhdfilepath1}, {mhdfilepath2}")
+
+        # Stream both volumes in bounded chunks instead of holding the two volumes and their copies in memory
+        with open(mhdfilepath3, "wb") as raw_file:
+            for rawfilepath in (mhdfilepath1, mhdfilepath2):
+                with open(rawfilepath, "rb") as rawfile:
+                    shutil.copyfileobj(rawfile, raw_file, chunk_bytes)
+        with open(os.path.join(dir_path,"frame1/reconstructed-volume1.mhd"), "r") as mhdfile:
+            s = mhdfile.read()
+        # Read grid dimensions
+        m = re.search('DimSize = ([0-9]*) ([0-9]*) ([0-9]*)', s)
+        dimstr = 'DimSize = ' + m.group(1) + " " + m.group(2) + " " + m.group(3)
+        dimstr1 = 'DimSize = ' + m.group(1) + " " + m.group(2) + " " + str(int(m.group(3)) * 2)
+        s = s.replace(dimstr, dimstr1)
+        with open(os.path.join(dir_path,"reconstructed-volume1.mhd"), "w") as mhdfile:
+            mhdfile.write(s)
+        return os.path.join(dir_path,"reconstructed-volume1.mhd")
+
+    @staticmethod
+    def waitForCLINodes(cliNodes, poll_interval=0.05):
+        """
+        Join barrier for CLIs launched asynchronously : process application events until none of the CLI nodes is
+        busy anymore.
+        """
+        while any(cliNode.IsBusy() for cliNode in cliNodes):
+            slicer.app.processEvents()
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def mhdDataFilePaths(mhd_file_path):
+        """
+        Returns the full path of the data files referenced by the ElementDataFile field of an MHD header : the header
+        itself for LOCAL data, every file of a 'pattern first last step' file list, or the single data file otherwise.
+
+        :raises: ValueError if the header has no ElementDataFile field
+        """
+        element_data_file = None
+        with open(mhd_file_path, "rb") as f:
+            for line in f:
+                key, _, value = line.decode("latin-1").partition("=")
+                if key.strip() == "ElementDataFile":
+                    element_data_file = value.strip()
+                    break
+
+        if not element_data_file:
+            raise ValueError("No ElementDataFile in MHD header : {}".format(mhd_file_path))
+
+        if element_data_file == "LOCAL":
+            return [mhd_file_path]
+
+        dir_path = os.path.dirname(mhd_file_path)
+        fields = element_data_file.split()
+        if len(fields) == 4 and "%" in fields[0]:
+            first, last, step = (int(field) for field in fields[1:])
+            return [os.path.join(dir_path, fields[0] % i) for i in range(first, last + 1, step)]
+        return [os.path.join(dir_path, element_data_file)]
+
+    def runSimpleRTK(self, parameters, sync=False, cliNode=None):
+        """
+        Runs the simplertk CLI with the input parameters.
+
+        If the reconstruction cache holds the result of identical projections reconstructed with identical parameters,
+        the cached volume is copied to the output path and the CLI node is set to Completed without running the CLI.
+        Otherwise the output volume is added to the cache once the CLI completes.
+        """
+        if cliNode is None:
+            cliNode = slicer.cli.createNode(slicer.modules.simplertk)
+
+        cache, cache_key = self.reconstructionCacheKey(parameters)
+        if cache_key is not None and cache.restore(cache_key, parameters["output"]):
+            logging.info("Loaded reconstruction from cache : {}".format(parameters["output"]))
+            slicer.cli.setNodeParameters(cliNode, parameters)
+            # Go through Scheduled so that a reused node already Completed still notifies its status observers
+            cliNode.SetStatus(cliNode.Scheduled)
+            cliNode.SetStatus(cliNode.Completed)
+            return cliNode
+
+        if sync:
+            cliNode = slicer.cli.runSync(slicer.modules.simplertk, cliNode, parameters, update_display=False)
+        else:
+            cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
+
+        if cache_key is not None:
+            self.storeWhenCompleted(cliNode, cache, cache_key, parameters["output"])
+        return cliNode
+
+    def reconstructionCacheKey(self, parameters):
+        """
+        Returns (cache, key) for the input CLI parameters or (None, None) if the reconstruction cache is disabled or
+        the projections cannot be hashed.
+        """
+        cache = RFReconstructionCache.fromSettings()
+        if cache is None:
+            return None, None
+
+        try:
+            projection_paths = self.mhdDataFilePaths(os.path.join(parameters["path"], parameters["regexp"]))
+            projection_paths, source = self.projectionSource(projection_paths)
+            return cache, cache.key(projection_paths, parameters, source)
+        except (OSError, ValueError) as e:
+            logging.warning("Reconstruction cache skipped for {}: {}".format(parameters["output"], e))
+            return None, None
+
+    def projectionSource(self, projection_paths):
+        """
+        Returns the (frame paths, source description) the projections are computed from.
+
+        Dual image stacks are rewritten at each conversion : when the projections are an up to date stack whose index
+        describes its source, the source frames and description are returned so that the stack is not hashed again.
+        Otherwise returns (projection_paths, None).
+        """
+        if len(projection_paths) != 1 or os.path.basename(projection_paths[0]) != self.PROJECTION_STACK_FILE_NAME:
+            return projection_paths, None
+
+        try:
+            index = self.readProjectionStackIndex(
+                os.path.join(os.path.dirname(projection_paths[0]), self.PROJECTION_STACK_INDEX_FILE_NAME))
+            layout = (index["frame_count"], index["shape"], index["dtype"])
+            if "source" not in index or self.projectionStackPath(index["mnri"], layout) is None:
+                return projection_paths, None
+            return [frame[0] for frame in index["frames"]], dict(index["source"], layout=list(layout))
+        except (OSError, ValueError, KeyError, TypeError):
+            return projection_paths, None
+
+    @staticmethod
+    def storeWhenCompleted(cliNode, cache, cache_key, output_path):
+        """Adds the CLI output volume to the reconstruction cache once the CLI node completes"""
+        observer_tags = []
+
+        def onStatusModified(*args):
+            if cliNode.IsBusy():
+                return
+            while observer_tags:
+                cliNode.RemoveObserver(observer_tags.pop())
+            if cliNode.GetStatusString() != 'Completed':
+                return
+            try:
+                cache.store(cache_key, output_path)
+            except (OSError, ValueError) as e:
+                logging.warning("Failed to add {} to the reconstruction cache: {}".format(output_path, e))
+
+        observer_tags.append(cliNode.AddObserver(cliNode.StatusModifiedEvent, onStatusModified))
+        onStatusModified()
+
     def Average(self,lst): 
         return sum(lst) / len(lst) 
     def reconstruct_odd(self, mnri_file_path, sync=False, cliNode=None, out_path=None):
@@ -1387,23 +1693,10 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             mnri_settings = self.MNRISettings(mnri_file_path)
             
             parameters = self.createCLIParameters1(mnri_file_path, out_path)
-            if cliNode is None:
-                cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-            if sync:
-                cliNode = slicer.cli.runSync(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            else:
-                cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            return cliNode
+            return self.runSimpleRTK(parameters, sync=sync, cliNode=cliNode)
         except:
             parameters = self.createCLIParameters1(mnri_file_path, out_path)
-            if cliNode is None:
-                cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-
-            if sync:
-                cliNode = slicer.cli.runSync(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            else:
-                cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            return cliNode
+            return self.runSimpleRTK(parameters, sync=sync, cliNode=cliNode)
     def reconstruct_even(self, mnri_file_path, sync=False, cliNode=None, out_path=None):
         """
         Load an MRNI file, create an MHD file for all the projections,
@@ -1418,24 +1711,10 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
             # typevalues = mnri_settings.value("Frame/Type")
             # if typevalues != 0:
             parameters = self.createCLIParameters2(mnri_file_path, out_path)
-            if cliNode is None:
-                cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-
-            if sync:
-                cliNode = slicer.cli.runSync(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            else:
-                cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            return cliNode
+            return self.runSimpleRTK(parameters, sync=sync, cliNode=cliNode)
         except:
             parameters = self.createCLIParameters2(mnri_file_path, out_path)
-            if cliNode is None:
-                cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-
-            if sync:
-                cliNode = slicer.cli.runSync(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            else:
-                cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            return cliNode
+            return self.runSimpleRTK(parameters, sync=sync, cliNode=cliNode)
  
     def reconstruct(self, mnri_file_path, sync=False, cliNode=None, out_path=None):
         """
@@ -1453,13 +1732,7 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
         # self.converting_files(filecount, dir_path)
         try:
             parameters = self.createCLIParameters(mnri_file_path, out_path)
-            if cliNode is None:
-                cliNode = slicer.cli.createNode(slicer.modules.simplertk)
-            if sync:
-                cliNode = slicer.cli.runSync(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            else:
-                cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            return cliNode
+            return self.runSimpleRTK(parameters, sync=sync, cliNode=cliNode)
             # elif typevalues == 1:
             #     msg = qt.QMessageBox()
             #     msg.setText(typevalues)
@@ -1506,14 +1779,491 @@ class RFReconstructionLogic(ScriptedLoadableModuleLogic):
                 # return cliNode
         except:
             parameters = self.createCLIParameters(mnri_file_path, out_path)
-            if cliNode is None:
-                cliNode = slicer.cli.createNode(slicer.modules.simplertk)
+            return self.runSimpleRTK(parameters, sync=sync, cliNode=cliNode)
+
+
+class RFReconstructionCache(object):
+    """
+    Persistent on-disk cache of reconstructed volumes.
+
+    Entries are keyed by the SHA-1 of the projection data and of the simplertk CLI parameters, IO paths excepted : the
+    same projections reconstructed with the same geometry and filtering load the previous result instead of running
+    the CLI again. Least recently used entries are evicted once the cache grows over maxSizeBytes. Projection digests
+    are memoized per frame signature (path, modification time, size) so that unchanged projections are not hashed
+    again. Dual image stacks, rewritten at each conversion, are keyed on the frames they are computed from.
+
+    The cache is configured with the Reconstruction/ResultCacheDirectory and Reconstruction/ResultCacheSizeMB
+    settings. A size of 0 disables it.
+    """
+
+    INDEX_FILE_NAME = "index.json"
+    UNCACHED_PARAMETERS = ("path", "regexp", "output", "do_regenerate_recon")
+    DEFAULT_SIZE_MB = 10 * 1024
+    MAX_PROJECTION_DIGESTS = 1024
+
+    def __init__(self, cacheDir, maxSizeBytes):
+        self.cacheDir = cacheDir
+        self.maxSizeBytes = int(maxSizeBytes)
+        self._index = {"entries": {}, "digests": {}}
+        self.load()
+
+    @classmethod
+    def fromSettings(cls):
+        """Returns the cache configured in the application settings, None if the cache is disabled"""
+        settings = qt.QSettings()
+        sizeMB = float(settings.value("Reconstruction/ResultCacheSizeMB", cls.DEFAULT_SIZE_MB))
+        if sizeMB <= 0:
+            return None
+
+        cacheDir = settings.value("Reconstruction/ResultCacheDirectory", "")
+        if not cacheDir:
+            cacheDir = os.path.join(slicer.app.cachePath, "RFReconstruction")
+        return cls(cacheDir, sizeMB * 1024 * 1024)
+
+    @property
+    def indexFilePath(self):
+        return os.path.join(self.cacheDir, self.INDEX_FILE_NAME)
+
+    def load(self):
+        try:
+            with open(self.indexFilePath, "r") as f:
+                index = json.load(f)
+            self._index = {"entries": dict(index["entries"]), "digests": dict(index["digests"])}
+        except (OSError, ValueError, KeyError, TypeError):
+            self._index = {"entries": {}, "digests": {}}
+
+    def save(self):
+        # Write to a temporary file first to never leave a truncated index behind
+        os.makedirs(self.cacheDir, exist_ok=True)
+        tmpFilePath = self.indexFilePath + ".tmp"
+        with open(tmpFilePath, "w") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(tmpFilePath, self.indexFilePath)
+
+    def sizeBytes(self):
+        return sum(entry["size"] for entry in self._index["entries"].values())
+
+    def projectionDigest(self, projectionPaths, chunkBytes=RFReconstructionLogic.FRAME_CHUNK_BYTES):
+        """Returns the SHA-1 of the content of the projection files, hashed by chunks of at most chunkBytes"""
+        signature = RFReconstructionLogic.frameSignature(projectionPaths)
+        signatureKey = hashlib.sha1(json.dumps(signature).encode("utf-8")).hexdigest()
+        digests = self._index["digests"]
+        if signatureKey not in digests:
+            sha = hashlib.sha1()
+            for path in projectionPaths:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(chunkBytes), b""):
+                        sha.update(chunk)
+            digests[signatureKey] = {"digest": sha.hexdigest()}
+
+            # Forget the least recently used digests
+            for oldKey in sorted(digests, key=lambda k: digests[k].get("lastUsed", 0))[:-self.MAX_PROJECTION_DIGESTS]:
+                del digests[oldKey]
+
+        digests[signatureKey]["lastUsed"] = time.time()
+        self.save()
+        return digests[signatureKey]["digest"]
+
+    def key(self, projectionPaths, parameters, source=None):
+        """
+        Returns the cache key of the reconstruction of the input projections with the input CLI parameters.
+
+        :param source: description of how the reconstructed projections are computed from projectionPaths, None if
+        they are the projections themselves
+        """
+        cachedParameters = {name: str(value) for name, value in parameters.items()
+                            if name not in self.UNCACHED_PARAMETERS}
+        sha = hashlib.sha1(self.projectionDigest(projectionPaths).encode("utf-8"))
+        if source is not None:
+            sha.update(json.dumps(source, sort_keys=True).encode("utf-8"))
+        sha.update(json.dumps(cachedParameters, sort_keys=True).encode("utf-8"))
+        return sha.hexdigest()
+
+    def restore(self, key, outputPath):
+        """
+        Copies the cached volume of the input key to outputPath.
+
+        :return: True if the volume was found in the cache, False otherwise
+        """
+        entry = self._index["entries"].get(key)
+        if entry is None:
+            return False
+
+        cachedPath = os.path.join(self.cacheDir, key, entry["file"])
+        if not os.path.isfile(cachedPath):
+            logging.warning("Removing reconstruction cache entry missing on disk : {}".format(cachedPath))
+            self._removeEntry(key)
+            self.save()
+            return False
+
+        try:
+            self._copyVolume(cachedPath, outputPath)
+        except (OSError, ValueError) as e:
+            logging.warning("Failed to restore {} from the reconstruction cache: {}".format(outputPath, e))
+            return False
+
+        entry["lastUsed"] = time.time()
+        self.save()
+        return True
+
+    def store(self, key, volumePath):
+        """Copies the volume to the cache under the input key and evicts the least recently used entries if needed"""
+        self._removeEntry(key)
+        entryDir = os.path.join(self.cacheDir, key)
+        os.makedirs(entryDir)
+        try:
+            cachedPaths = self._copyVolume(volumePath, os.path.join(entryDir, os.path.basename(volumePath)))
+        except (OSError, ValueError):
+            shutil.rmtree(entryDir, ignore_errors=True)
+            raise
+
+        self._index["entries"][key] = {
+            "file": os.path.basename(volumePath),
+            "size": sum(os.path.getsize(path) for path in cachedPaths),
+            "lastUsed": time.time(),
+        }
+        self.evict()
+        self.save()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache size is below maxSizeBytes"""
+        entries = self._index["entries"]
+        cacheSize = self.sizeBytes()
+        for key in sorted(entries, key=lambda k: entries[k]["lastUsed"]):
+            if cacheSize <= self.maxSizeBytes:
+                break
+            cacheSize -= entries[key]["size"]
+            self._removeEntry(key)
+
+    def _removeEntry(self, key):
+        self._index["entries"].pop(key, None)
+        shutil.rmtree(os.path.join(self.cacheDir, key), ignore_errors=True)
+
+    @staticmethod
+    def _copyVolume(sourcePath, destinationPath):
+        """
+        Copies an MHD volume and its data file next to destinationPath. The data file is renamed after the destination
+        header.
+
+        :raises: ValueError if the volume data is split across several files
+        :return: list of the copied files
+        """
+        dataPaths = RFReconstructionLogic.mhdDataFilePaths(sourcePath)
+        if dataPaths == [sourcePath]:
+            shutil.copyfile(sourcePath, destinationPath)
+            return [destinationPath]
+        if len(dataPaths) != 1:
+            raise ValueError("Volumes split across several data files are not cached : {}".format(sourcePath))
+
+        dataFileName = os.path.splitext(os.path.basename(destinationPath))[0] + os.path.splitext(dataPaths[0])[1]
+        dataPath = os.path.join(os.path.dirname(destinationPath), dataFileName)
+        shutil.copyfile(dataPaths[0], dataPath)
+
+        with open(sourcePath, "r") as f:
+            header = f.read()
+        header = re.sub(r"^(\s*ElementDataFile\s*=).*$", lambda m: m.group(1) + " " + dataFileName, header,
+                        flags=re.MULTILINE)
+        with open(destinationPath, "w") as f:
+            f.write(header)
+        return [destinationPath, dataPath]
+
+
+class RFReconstructionBatchQueue(object):
+    """
+    Headless queue reconstructing a list of MNRI files with at most maxConcurrentJobs simplertk CLI processes running
+    at the same time. Dual image jobs run two CLIs, a job needing more CLIs than allowed runs alone.
+
+    Each job converts its MNRI file to MHD, reconstructs it and hands the reconstructed volume path to the
+    onReconstructed(job, volumePath) callback, for instance to write the MRB session. The frames of dual image jobs
+    are converted in a worker thread, the CLIs are run on the main thread once the conversion is done. Failed jobs are
+    retried up to maxRetries times. The queue is saved to queueFilePath after every change so that an interrupted run
+    resumes where it stopped when the same queue file is used again.
+
+    Usage example :
+        queue = RFReconstructionBatchQueue("D:/scans/queue.json", maxConcurrentJobs=3)
+        queue.addMnriFiles(["D:/scans"])
+        queue.start()
+        queue.wait()
+    """
+
+    Pending = "pending"
+    Running = "running"
+    Completed = "completed"
+    Failed = "failed"
+
+    def __init__(self, queueFilePath, onReconstructed=None, maxConcurrentJobs=2, maxRetries=1):
+        self.queueFilePath = queueFilePath
+        self.onReconstructed = onReconstructed
+        self.maxConcurrentJobs = max(1, int(maxConcurrentJobs))
+        self.maxRetries = int(maxRetries)
+        self.jobs = []
+
+        # Running CLIs per job MNRI path : list of (logic, cliNode, observer tag)
+        self._runs = {}
+        # Number of CLIs of the jobs being started (dual image frames being converted), per job MNRI path
+        self._startingJobs = {}
+        self._isStarted = False
+        # Callables queued by the worker threads, called on the main thread
+        self._mainQueue = queue.Queue()
+        self._workerThreads = []
+        self._isMainQueueScheduled = False
+
+        self.jobStarted = Signal("dict")
+        self.jobFinished = Signal("dict")
+        self.progress = Signal("completed job count", "total job count")
+        self.finished = Signal()
+
+        self.load()
+
+    def load(self):
+        """Load the jobs of a previous run from the queue file if it exists"""
+        if not os.path.isfile(self.queueFilePath):
+            return
+
+        with open(self.queueFilePath, "r") as f:
+            self.jobs = json.load(f)["jobs"]
+
+    def save(self):
+        tmpPath = self.queueFilePath + ".tmp"
+        with open(tmpPath, "w") as f:
+            json.dump({"jobs": self.jobs}, f, indent=2)
+        os.replace(tmpPath, self.queueFilePath)
+
+    @staticmethod
+    def findMnriFiles(dirPath):
+        """Returns one MNRI file per acquisition directory found under dirPath, NAOMICT.mnri being preferred"""
+        mnriPaths = []
+        for root, dirs, files in os.walk(dirPath):
+            # Skip the odd / even directories created for dual image reconstruction
+            dirs[:] = sorted(d for d in dirs if d not in ["frame1", "frame2"])
+            mnriFiles = sorted(f for f in files if f.lower().endswith(".mnri"))
+            if mnriFiles:
+                mnriPaths.append(os.path.join(root, "NAOMICT.mnri" if "NAOMICT.mnri" in mnriFiles else mnriFiles[0]))
+        return mnriPaths
+
+    def addMnriFiles(self, paths, mrbFileName="RFViewerSession.mrb"):
+        """
+        Add MNRI files or directories containing MNRI files to the queue. Files already queued are ignored.
+        The session of each job is written next to its MNRI file.
+        """
+        queuedPaths = {job["mnri"] for job in self.jobs}
+        for path in paths:
+            mnriPaths = self.findMnriFiles(path) if os.path.isdir(path) else [path]
+            for mnriPath in map(os.path.normpath, mnriPaths):
+                if mnriPath in queuedPaths:
+                    continue
+
+                queuedPaths.add(mnriPath)
+                self.jobs.append({"mnri": mnriPath, "mrb": os.path.join(os.path.dirname(mnriPath), mrbFileName),
+                                  "status": self.Pending, "attempts": 0, "wallTime": 0.0, "error": ""})
+        self.save()
+
+    def jobsWithStatus(self, status):
+        return [job for job in self.jobs if job["status"] == status]
+
+    def isFinished(self):
+        return not self._runs and not self._startingJobs and not self.jobsWithStatus(self.Pending)
+
+    def runningCLICount(self):
+        """Number of CLIs running or about to run, the jobs being started count all the CLIs they will run"""
+        return sum(self._startingJobs.values()) + sum(len(runs) for mnriPath, runs in self._runs.items()
+                                                      if mnriPath not in self._startingJobs)
+
+    def start(self):
+        """Start the queue. Jobs interrupted while running in a previous run are scheduled again."""
+        for job in self.jobsWithStatus(self.Running):
+            job["status"] = self.Pending
+        self._isStarted = True
+        self.save()
+        self._scheduleJobs()
+
+    def stop(self):
+        """Cancel the running jobs. They will be scheduled again on next start."""
+        self._isStarted = False
+        for job in self.jobsWithStatus(self.Running):
+            self._removeRuns(job, cancel=True)
+            job["status"] = self.Pending
+            job["attempts"] -= 1
+        self.save()
+
+    def wait(self):
+        """Process application events until every job is completed or failed"""
+        while self._isStarted and not self.isFinished():
+            slicer.app.processEvents()
+            time.sleep(0.05)
+
+    def _scheduleJobs(self):
+        if not self._isStarted:
+            return
+
+        # Jobs stopped while their frames are converted are scheduled again once the conversion is over
+        pendingJobs = [job for job in self.jobsWithStatus(self.Pending) if job["mnri"] not in self._startingJobs]
+        while pendingJobs:
+            cliCount = self._requiredCLICount(pendingJobs[0]["mnri"])
+            runningCLICount = self.runningCLICount()
+            if runningCLICount and runningCLICount + cliCount > self.maxConcurrentJobs:
+                break
+            self._startJob(pendingJobs.pop(0), cliCount)
+
+        if self.isFinished():
+            self._isStarted = False
+            self.finished.emit()
+
+    def _startJob(self, job, cliCount):
+        job["status"] = self.Running
+        job["attempts"] += 1
+        job["error"] = ""
+        job["startTime"] = time.time()
+        self.save()
+        self.jobStarted.emit(job)
+
+        self._startingJobs[job["mnri"]] = cliCount
+        if cliCount == 1:
+            self._runSteps(job, [(job["mnri"], "reconstruct")])
+        else:
+            self._runInWorkerThread(lambda: self._dualImageReconstructionSteps(job["mnri"]),
+                                    lambda steps, error: self._runSteps(job, steps, error))
+
+    def _runSteps(self, job, steps, error=""):
+        """Runs the CLIs of the (MNRI path, logic reconstruct method name) steps of the job"""
+        if job["status"] != self.Running:
+            # Stopped while the frames were converted
+            del self._startingJobs[job["mnri"]]
+            self._removeDualImageStacks(job)
+            self._scheduleJobs()
+            return
+
+        try:
+            if error:
+                raise RuntimeError(error)
+            for mnriPath, reconstruct in steps:
+                self._runCLI(job, mnriPath, reconstruct)
+        except Exception as e:
+            del self._startingJobs[job["mnri"]]
+            self._removeRuns(job, cancel=True)
+            self._removeDualImageStacks(job)
+            self._finishJob(job, str(e))
+            return
+
+        # Results loaded from the reconstruction cache complete before all the runs of the job are started
+        del self._startingJobs[job["mnri"]]
+        self._onCLIModified(job)
+
+    @staticmethod
+    def _requiredCLICount(mnriPath):
+        """Returns the number of CLIs reconstructing the MNRI file, 2 for dual image acquisitions"""
+        logic = RFReconstructionLogic()
+        try:
+            return 2 if logic.isDualImageAcquisition(logic.MNRISettings(mnriPath)) else 1
+        except Exception:
+            # Unreadable MNRI files fail when their job starts
+            return 1
+
+    @staticmethod
+    def _dualImageReconstructionSteps(mnriPath):
+        """Converts the dual image frames and returns the (MNRI path, logic reconstruct method name) of the CLIs"""
+        oddMnriPath, evenMnriPath = RFReconstructionLogic().converting_files(mnriPath)
+        return [(oddMnriPath, "reconstruct_odd"), (evenMnriPath, "reconstruct_even")]
+
+    def _runInWorkerThread(self, function, onDone):
+        """Calls function in a worker thread, then onDone(result, error message) on the main thread"""
+        def run():
+            try:
+                result, error = function(), ""
+            except Exception as e:
+                result, error = None, str(e)
+            self._mainQueue.put(lambda: onDone(result, error))
+
+        thread = threading.Thread(target=run)
+        self._workerThreads.append(thread)
+        thread.start()
+        if not self._isMainQueueScheduled:
+            self._isMainQueueScheduled = True
+            qt.QTimer.singleShot(0, self._processMainQueue)
+
+    def _processMainQueue(self):
+        self._isMainQueueScheduled = False
+        while not self._mainQueue.empty():
+            self._mainQueue.get_nowait()()
+
+        self._workerThreads = [thread for thread in self._workerThreads if thread.is_alive()]
+        if self._workerThreads or not self._mainQueue.empty():
+            self._isMainQueueScheduled = True
+            qt.QTimer.singleShot(50, self._processMainQueue)
+
+    def _runCLI(self, job, mnriPath, reconstruct):
+        # Each CLI needs its own logic as the logic symlink points to the reconstructed MNRI directory
+        logic = RFReconstructionLogic()
+        cliNode = slicer.cli.createNode(slicer.modules.simplertk)
+        tag = cliNode.AddObserver(cliNode.StatusModifiedEvent, lambda *_: self._onCLIModified(job))
+        # Registered before running, so that it is cancelled if a following step fails
+        self._runs.setdefault(job["mnri"], []).append((logic, cliNode, tag))
+        getattr(logic, reconstruct)(mnriPath, sync=False, cliNode=cliNode)
+
+    def _removeRuns(self, job, cancel=False):
+        for _, cliNode, tag in self._runs.pop(job["mnri"], []):
+            cliNode.RemoveObserver(tag)
+            if cancel and cliNode.IsBusy():
+                cliNode.Cancel()
+            removeNodeFromMRMLScene(cliNode)
+
+    @staticmethod
+    def _removeDualImageStacks(job):
+        """Removes the odd and even projection copies written by converting_files for a dual image job"""
+        logic = RFReconstructionLogic()
+        try:
+            if not logic.isDualImageAcquisition(logic.MNRISettings(job["mnri"])):
+                return
+        except Exception:
+            return
+
+        for stack_dir in ["frame1", "frame2"]:
+            shutil.rmtree(os.path.join(os.path.dirname(job["mnri"]), stack_dir), ignore_errors=True)
+
+    def _onCLIModified(self, job):
+        runs = self._runs.get(job["mnri"], [])
+        if job["mnri"] in self._startingJobs or not runs or any(cliNode.IsBusy() for _, cliNode, _ in runs):
+            return
+
+        errors = [cliNode.GetErrorText() or cliNode.GetStatusString() for _, cliNode, _ in runs
+                  if cliNode.GetStatusString() != 'Completed']
+        volumePath = runs[0][1].GetParameterAsString('output')
+        self._removeRuns(job)
+
+        if not errors:
+            try:
+                if len(runs) > 1:
+                    volumePath = RFReconstructionLogic().integrateDualImageVolumes(os.path.dirname(job["mnri"]))
+                if self.onReconstructed is not None:
+                    self.onReconstructed(job, volumePath)
+            except Exception as e:
+                errors.append(str(e))
+
+        # The odd and even stacks are only needed by the CLIs and integrateDualImageVolumes
+        self._removeDualImageStacks(job)
+        self._finishJob(job, "\n".join(errors))
+
+    def _finishJob(self, job, error):
+        job["wallTime"] = time.time() - job.pop("startTime", time.time())
+        job["error"] = error
+        if not error:
+            job["status"] = self.Completed
+        elif job["attempts"] <= self.maxRetries:
+            job["status"] = self.Pending
+        else:
+            job["status"] = self.Failed
+
+        logging.info("Batch reconstruction {} : {} in {:.1f}s {}".format(job["mnri"], job["status"], job["wallTime"],
+                                                                         job["error"]))
+        self.save()
+        self.jobFinished.emit(job)
+        unfinishedJobCount = len(self.jobsWithStatus(self.Pending)) + len(self.jobsWithStatus(self.Running))
+        self.progress.emit(len(self.jobs) - unfinishedJobCount, len(self.jobs))
+
+        # Schedule next jobs outside of the CLI node event
+        qt.QTimer.singleShot(0, self._scheduleJobs)
+
 
-            if sync:
-                cliNode = slicer.cli.runSync(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            else:
-                cliNode = slicer.cli.run(slicer.modules.simplertk, cliNode, parameters, update_display=False)
-            return cliNode
 class RFReconstructionLogicTestCase(unittest.TestCase):
     def create_mnri_file(self, fileString, outDir):
         output_path = os.path.join(outDir, "test.mnri")
@@ -1603,12 +2353,320 @@ class RFReconstructionLogicTestCase(unittest.TestCase):
         logic = RFReconstructionLogic()
         logic.cleanupMhdFile("not_an_existing_path.mhd")
 
+    def test_mnri_file_is_parsed_once_until_modified(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+        mnri_file_path = self.create_mnri_file(self.an_mnri_file(), tempDir.path())
+
+        settings = RFReconstructionLogic.MNRISettings(mnri_file_path)
+        self.assertIs(settings.record, RFReconstructionLogic.MNRISettings(mnri_file_path).record)
+        self.assertEqual(888, settings.record.Frame.FrameWidth)
+        self.assertEqual("image_", settings.value("Frame/FrameBaseName"))
+        self.assertEqual("", settings.value("Frame/NotAKey"))
+
+        with open(mnri_file_path, "a") as f:
+            f.write("Type=1\n")
+        os.utime(mnri_file_path, ns=(0, 0))
+        self.assertEqual(1, RFReconstructionLogic.MNRISettings(mnri_file_path).value("Frame/Type"))
+
+    def test_dual_image_frames_are_lag_corrected_and_split_in_odd_and_even_stacks(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        # Create fake dual image acquisition with 7 frames of 3x5 pixels
+        frames = np.arange(7 * 3 * 5, dtype=np.uint16).reshape(7, 3, 5) * 100
+        os.mkdir(os.path.join(tempDir.path(), "frame"))
+        for i, frame in enumerate(frames):
+            frame.tofile(os.path.join(tempDir.path(), "frame", "image_{:03d}.img".format(i)))
+
+        mnri_file_string = """
+            [Frame]
+            ImageFormat=Raw16
+            ImageFileExt=img
+            FrameWidth=5
+            FrameHeight=3
+            FrameLengthWidth=1.2
+            FrameLengthHeight=0.72
+            FrameCount=7
+            FrameCount1=3
+            FrameCount2=3
+            FrameFolder=frame
+            FrameBaseName=image_
+            FrameNameDigit=3
+            Subtraction=0.5
+            """
+        mnri_file_path = self.create_mnri_file(mnri_file_string, tempDir.path())
+
+        # Use a working buffer of two frames to go through several chunks
+        logic = RFReconstructionLogic()
+        odd_mnri_path, even_mnri_path = logic.converting_files(mnri_file_path, chunk_bytes=2 * frames[0].size * 4)
+
+        expected = frames.astype(np.float64)
+        expected[1:] -= 0.5 * frames[:-1]
+        expected = expected.astype(np.uint16)
+
+        odd_stack_path = os.path.join(os.path.dirname(odd_mnri_path), logic.PROJECTION_STACK_FILE_NAME)
+        even_stack_path = os.path.join(os.path.dirname(even_mnri_path), logic.PROJECTION_STACK_FILE_NAME)
+        np.testing.assert_array_equal(np.fromfile(odd_stack_path, dtype=np.uint16).reshape(3, 3, 5), expected[1:6:2])
+        np.testing.assert_array_equal(np.fromfile(even_stack_path, dtype=np.uint16).reshape(3, 3, 5), expected[0:6:2])
+        self.assertIn("ElementDataFile = " + logic.PROJECTION_STACK_FILE_NAME, logic.convertMnriToMhd1(odd_mnri_path))
+
+        # The stacks are rewritten at each conversion, the reconstruction cache keys them on their source frames
+        odd_source = logic.projectionSource([odd_stack_path])
+        self.assertEqual([os.path.normpath(os.path.join(tempDir.path(), "frame", "image_{:03d}.img".format(i)))
+                          for i in range(6)],
+                         [os.path.normpath(path) for path in odd_source[0]])
+        self.assertEqual({"frames": "odd", "subtraction": 0.5, "layout": [3, [3, 5], "<u2"]}, odd_source[1])
+        logic.converting_files(mnri_file_path)
+        self.assertEqual(odd_source, logic.projectionSource([odd_stack_path]))
+        self.assertEqual("even", logic.projectionSource([even_stack_path])[1]["frames"])
+
+    def test_dual_image_volumes_are_stacked_along_z(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        # Create fake odd and even reconstructed volumes of 2x3x4 voxels
+        volumes = np.arange(2 * 2 * 3 * 4, dtype=np.uint16).reshape(2, 2, 3, 4)
+        for i, volume in enumerate(volumes, start=1):
+            os.mkdir(os.path.join(tempDir.path(), "frame{}".format(i)))
+            volume.tofile(os.path.join(tempDir.path(), "frame{}".format(i), "reconstructed-volume{}.raw".format(i)))
+        with open(os.path.join(tempDir.path(), "frame1", "reconstructed-volume1.mhd"), "w") as mhdfile:
+            mhdfile.write("NDims = 3\nDimSize = 4 3 2\nElementType = MET_USHORT\n"
+                          "ElementDataFile = reconstructed-volume1.raw\n")
+
+        # Use a copy buffer smaller than one volume to go through several chunks
+        mhd_file_path = RFReconstructionLogic().integrateDualImageVolumes(tempDir.path(), chunk_bytes=10)
+
+        with open(mhd_file_path, "r") as mhdfile:
+            self.assertIn("DimSize = 4 3 4", mhdfile.read())
+        raw_file_path = os.path.join(tempDir.path(), "reconstructed-volume1.raw")
+        np.testing.assert_array_equal(np.fromfile(raw_file_path, dtype=np.uint16).reshape(4, 3, 4),
+                                      np.concatenate(volumes))
+
+    def test_packed_projection_stack_is_used_until_a_frame_is_modified(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        # Create fake acquisition with 3 frames of 2x2 pixels
+        mnri_file_string = self.an_mnri_file().replace("FrameWidth=888", "FrameWidth=2").replace(
+            "FrameHeight=1096", "FrameHeight=2").replace("FrameCount=509", "FrameCount=3")
+        mnri_file_path = self.create_mnri_file(mnri_file_string, tempDir.path())
+        frames = np.arange(12, dtype=np.uint16).reshape(3, 2, 2)
+        os.mkdir(os.path.join(tempDir.path(), "Frame"))
+        for i, frame in enumerate(frames):
+            frame.tofile(os.path.join(tempDir.path(), "Frame", "image_{:03d}.img".format(i)))
+
+        logic = RFReconstructionLogic()
+        stack_path = logic.packProjectionStack(mnri_file_path)
+        np.testing.assert_array_equal(np.fromfile(stack_path, dtype=np.uint16).reshape(3, 2, 2), frames)
+        self.assertIn("ElementDataFile = " + logic.PROJECTION_STACK_FILE_NAME, logic.convertMnriToMhd(mnri_file_path))
+
+        # Modified frames invalidate the stack
+        frames[1].tofile(os.path.join(tempDir.path(), "Frame", "image_001.img"))
+        os.utime(os.path.join(tempDir.path(), "Frame", "image_001.img"), ns=(0, 0))
+        self.assertIsNone(logic.projectionStackPath(mnri_file_path))
+        self.assertIn("ElementDataFile = Frame/image_%03d.img 0 2 1", logic.convertMnriToMhd(mnri_file_path))
+
+    def test_packed_projection_stack_is_not_used_once_the_mnri_file_is_modified(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        # Create fake acquisition with 4 frames of 2x2 pixels
+        mnri_file_string = self.an_mnri_file().replace("FrameWidth=888", "FrameWidth=2").replace(
+            "FrameHeight=1096", "FrameHeight=2").replace("FrameCount=509", "FrameCount=4")
+        mnri_file_path = self.create_mnri_file(mnri_file_string, tempDir.path())
+        frames = np.arange(16, dtype=np.uint16).reshape(4, 2, 2)
+        os.mkdir(os.path.join(tempDir.path(), "Frame"))
+        for i, frame in enumerate(frames):
+            frame.tofile(os.path.join(tempDir.path(), "Frame", "image_{:03d}.img".format(i)))
+
+        logic = RFReconstructionLogic()
+        logic.packProjectionStack(mnri_file_path)
+        self.assertIsNotNone(logic.projectionStackPath(mnri_file_path))
+
+        # Same stack size with another layout
+        self.assertIsNone(logic.projectionStackPath(mnri_file_path, (2, (2, 4), np.uint16)))
+        self.assertIsNone(logic.projectionStackPath(mnri_file_path, (8, (2, 2), np.uint8)))
+
+        # Frames read with another shape and count from the same frame files
+        self.create_mnri_file(mnri_file_string.replace("FrameWidth=2", "FrameWidth=1").replace(
+            "FrameCount=4", "FrameCount=8"), tempDir.path())
+        os.utime(mnri_file_path, ns=(0, 0))
+        self.assertIsNone(logic.projectionStackPath(mnri_file_path))
+
+    def test_raw_projections_are_converted_to_hounsfield_units_without_modifying_the_input(self):
+        raw = np.array([[0, 1, 100], [1000, 8000, 16383]], dtype=np.uint16)
+        raw_copy = raw.copy()
+        i_dark, i0, air_value, water_value = 0, 16384, 0.0, 0.018
+
+        intensity = np.where(raw <= 0, 1, raw).astype(np.float64)
+        expected = (-np.log((intensity - i_dark) / (i0 - i_dark)) - water_value) * 1000 / (water_value - air_value)
+
+        # uint16 input goes through the lookup table, float input through the fused kernel
+        from_lut = RFReconstructionLogic.rawToHounsfieldUnits(raw, i_dark, i0, air_value, water_value)
+        from_float = RFReconstructionLogic.rawToHounsfieldUnits(raw.astype(np.float64), i_dark, i0, air_value,
+                                                                water_value)
+        self.assertEqual(from_lut.dtype, np.float32)
+        np.testing.assert_allclose(from_lut, expected, rtol=1e-4)
+        np.testing.assert_allclose(from_float, expected, rtol=1e-4)
+        np.testing.assert_array_equal(raw, raw_copy)
+
+
+class RFReconstructionCacheTestCase(unittest.TestCase):
+    def test_cached_volume_is_restored_for_identical_inputs_and_least_recently_used_entries_are_evicted(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        # Create fake projections and reconstructed volume of 8 voxels
+        projection_path = os.path.join(tempDir.path(), "projections.raw")
+        np.arange(12, dtype=np.uint16).tofile(projection_path)
+        volume_path = os.path.join(tempDir.path(), "reconstructed-volume.mhd")
+        with open(volume_path, "w") as mhdfile:
+            mhdfile.write("NDims = 3\nDimSize = 2 2 2\nElementDataFile = reconstructed-volume.raw\n")
+        np.arange(8, dtype=np.uint16).tofile(os.path.join(tempDir.path(), "reconstructed-volume.raw"))
+
+        # Cache large enough for one volume only
+        cache = RFReconstructionCache(os.path.join(tempDir.path(), "cache"), maxSizeBytes=100)
+        parameters = {"path": tempDir.path(), "output": volume_path, "hann": 0.5}
+        key = cache.key([projection_path], parameters)
+        self.assertEqual(key, cache.key([projection_path], dict(parameters, output="other.mhd")))
+        self.assertNotEqual(key, cache.key([projection_path], dict(parameters, hann=0.6)))
+
+        cache.store(key, volume_path)
+        restored_path = os.path.join(tempDir.path(), "restored.mhd")
+        self.assertTrue(RFReconstructionCache(cache.cacheDir, 100).restore(key, restored_path))
+        np.testing.assert_array_equal(np.arange(8, dtype=np.uint16),
+                                      np.fromfile(os.path.join(tempDir.path(), "restored.raw"), dtype=np.uint16))
+
+        cache.store(cache.key([projection_path], dict(parameters, hann=0.6)), volume_path)
+        self.assertFalse(cache.restore(key, restored_path))
+
+
+class RFReconstructionBatchQueueTestCase(unittest.TestCase):
+    class FakeCLIBatchQueue(RFReconstructionBatchQueue):
+        """Queue whose CLI nodes are not run, their status is set by the tests. Jobs of dual.mnri files run two CLIs."""
+
+        def __init__(self, *args, **kwargs):
+            self.cliNodes = {}
+            super().__init__(*args, **kwargs)
+
+        @staticmethod
+        def _requiredCLICount(mnriPath):
+            return 2 if os.path.basename(mnriPath) == "dual.mnri" else 1
+
+        @staticmethod
+        def _dualImageReconstructionSteps(mnriPath):
+            return [(mnriPath, "reconstruct_odd"), (mnriPath, "reconstruct_even")]
+
+        def _runCLI(self, job, mnriPath, reconstruct):
+            cliNode = slicer.vtkMRMLCommandLineModuleNode()
+            cliNode.SetStatus(cliNode.Running)
+            tag = cliNode.AddObserver(cliNode.StatusModifiedEvent, lambda *_: self._onCLIModified(job))
+            self._runs.setdefault(job["mnri"], []).append((None, cliNode, tag))
+            self.cliNodes.setdefault(job["mnri"], []).append(cliNode)
+
+    @staticmethod
+    def processEventsUntil(condition, timeoutSeconds=5):
+        endTime = time.time() + timeoutSeconds
+        while not condition() and time.time() < endTime:
+            slicer.app.processEvents()
+            time.sleep(0.01)
+
+    def test_jobs_are_started_while_the_running_cli_count_is_under_the_limit(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        queue = self.FakeCLIBatchQueue(os.path.join(tempDir.path(), "queue.json"), maxConcurrentJobs=3)
+        queue.addMnriFiles([os.path.join(tempDir.path(), name) for name in ["dual.mnri", "a.mnri", "b.mnri", "c.mnri"]])
+        queue.start()
+
+        # The dual image job counts its two CLIs while its frames are converted
+        self.assertEqual(3, queue.runningCLICount())
+        self.processEventsUntil(lambda: not queue._startingJobs)
+        self.assertEqual([queue.Running, queue.Running, queue.Pending, queue.Pending],
+                         [job["status"] for job in queue.jobs])
+        self.assertEqual([2, 1], [len(queue.cliNodes[job["mnri"]]) for job in queue.jobs[:2]])
+        self.assertEqual(3, queue.runningCLICount())
+
+        # Completing the single image job lets one more job start
+        cliNode = queue.cliNodes[queue.jobs[1]["mnri"]][0]
+        cliNode.SetStatus(cliNode.Completed)
+        self.processEventsUntil(lambda: queue.jobs[2]["status"] == queue.Running)
+        self.assertEqual([queue.Running, queue.Completed, queue.Running, queue.Pending],
+                         [job["status"] for job in queue.jobs])
+        self.assertEqual(3, queue.runningCLICount())
+        queue.stop()
+
+    def test_failed_jobs_are_retried_then_failed_after_max_retries(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        queueFilePath = os.path.join(tempDir.path(), "queue.json")
+        queue = self.FakeCLIBatchQueue(queueFilePath, maxRetries=1)
+        queue.addMnriFiles([os.path.join(tempDir.path(), "a.mnri")])
+        job = queue.jobs[0]
+        queue.start()
+
+        for attempt in [1, 2]:
+            self.assertEqual((queue.Running, attempt), (job["status"], job["attempts"]))
+            cliNode = queue.cliNodes[job["mnri"]][-1]
+            cliNode.SetStatus(cliNode.CompletedWithErrors)
+            self.processEventsUntil(lambda: job["status"] != queue.Pending)
+
+        self.assertEqual(queue.Failed, job["status"])
+        self.assertEqual(2, len(queue.cliNodes[job["mnri"]]))
+        self.assertEqual(queue.Failed, RFReconstructionBatchQueue(queueFilePath).jobs[0]["status"])
+        self.processEventsUntil(queue.isFinished)
+        self.assertTrue(queue.isFinished())
+
+    def test_jobs_running_when_the_queue_was_interrupted_are_resumed(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        queueFilePath = os.path.join(tempDir.path(), "queue.json")
+        interruptedQueue = self.FakeCLIBatchQueue(queueFilePath)
+        interruptedQueue.addMnriFiles([os.path.join(tempDir.path(), "a.mnri")])
+        interruptedQueue.start()
+
+        # The saved queue is used again while its job is running
+        queue = self.FakeCLIBatchQueue(queueFilePath)
+        job = queue.jobs[0]
+        self.assertEqual(queue.Running, job["status"])
+        queue.start()
+        self.assertEqual((queue.Running, 2), (job["status"], job["attempts"]))
+
+        cliNode = queue.cliNodes[job["mnri"]][0]
+        cliNode.SetStatus(cliNode.Completed)
+        self.assertEqual(queue.Completed, job["status"])
+        self.assertEqual(queue.Completed, RFReconstructionBatchQueue(queueFilePath).jobs[0]["status"])
+
+    def test_one_mnri_file_is_queued_per_acquisition_directory_and_the_queue_is_persisted(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        # Create two acquisitions, one of them with its dual image odd directory
+        for acquisition in ["patient1", "patient2"]:
+            os.makedirs(os.path.join(tempDir.path(), acquisition, "frame1"))
+            for mnri in ["NAOMICT.mnri", "NAOMICT_UTF8.mnri", os.path.join("frame1", "NAOMICT.mnri")]:
+                open(os.path.join(tempDir.path(), acquisition, mnri), "w").close()
+
+        queueFilePath = os.path.join(tempDir.path(), "queue.json")
+        queue = RFReconstructionBatchQueue(queueFilePath)
+        queue.addMnriFiles([tempDir.path()])
+        queue.addMnriFiles([os.path.join(tempDir.path(), "patient1", "NAOMICT.mnri")])
+
+        expected = [os.path.normpath(os.path.join(tempDir.path(), acquisition, "NAOMICT.mnri"))
+                    for acquisition in ["patient1", "patient2"]]
+        self.assertEqual(expected, [job["mnri"] for job in queue.jobs])
+        self.assertEqual(expected, [job["mnri"] for job in RFReconstructionBatchQueue(queueFilePath).jobs])
+        self.assertEqual(2, len(queue.jobsWithStatus(RFReconstructionBatchQueue.Pending)))
+
 
 class RFReconstructionTest(ScriptedLoadableModuleTest):
     def runTest(self):
         # Gather tests for the plugin and run them in a test suite
         slicer.mrmlScene.Clear()
-        testCases = [RFReconstructionLogicTestCase]
+        testCases = [RFReconstructionLogicTestCase, RFReconstructionCacheTestCase, RFReconstructionBatchQueueTestCase]
         suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
         unittest.TextTestRunner(verbosity=3).run(suite)
         slicer.mrmlScene.Clear()
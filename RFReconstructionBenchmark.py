@@ -0,0 +1,396 @@
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import qt
+import slicer
+from slicer.ScriptedLoadableModule import *
+
+from RFReconstruction import RFReconstructionLogic
+
+
+class RFReconstructionBenchmark(ScriptedLoadableModule):
+    """
+    Module timing the reconstruction pipeline stages on synthetic MNRI acquisitions
+    """
+
+    def __init__(self, parent):
+        ScriptedLoadableModule.__init__(self, parent)
+
+        self.parent.title = "RF Reconstruction Benchmark"
+        self.parent.categories = ["RFCo"]
+        self.parent.dependencies = []
+        self.parent.contributors = []
+        self.parent.helpText = """
+        Benchmark of the reconstruction pipeline on synthetic MNRI acquisitions.
+        No module interface here, use RFReconstructionBenchmarkLogic from the Python console.
+        """
+        self.parent.acknowledgementText = ""
+        self.parent.hidden = True
+
+
+class RFReconstructionBenchmarkWidget(ScriptedLoadableModuleWidget):
+    def setup(self):
+        ScriptedLoadableModuleWidget.setup(self)
+
+
+class RFReconstructionBenchmarkLogic(ScriptedLoadableModuleLogic):
+    """
+    Generates synthetic MNRI acquisitions of a numeric phantom and times each reconstruction stage in isolation :
+    MNRI parsing, dual image frame conversion (lag subtraction and odd / even split), MHD creation, simplertk CPU
+    reconstruction, Hounsfield Units scaling and session save.
+
+    The timings are written to a JSON report which can be compared with the report of another commit.
+
+    Usage example :
+        logic = RFReconstructionBenchmarkLogic()
+        report = logic.run("D:/benchmark", frameCount=360, frameWidth=888, frameHeight=1096, dualImage=True)
+        logic.saveReport(report, "D:/benchmark/report.json")
+        logic.compareReports(logic.loadReport("D:/benchmark/baseline.json"), report)
+    """
+
+    REPORT_VERSION = 1
+
+    # Spheres of the numeric phantom : center (x, y, z) and radius in fraction of the detector width, attenuation
+    # in mm^-1
+    PHANTOM_SPHERES = [
+        ((0.0, 0.0, 0.0), 0.30, 0.020),
+        ((0.10, 0.05, 0.05), 0.08, 0.040),
+        ((-0.12, -0.06, -0.04), 0.06, 0.060),
+        ((0.02, -0.12, 0.10), 0.04, 0.100),
+    ]
+
+    # Attenuation ratio of the second image of dual image acquisitions
+    DUAL_IMAGE_ATTENUATION_RATIO = 0.6
+
+    # Name of the reconstructed volume saved in the benchmark session
+    SESSION_VOLUME_NAME = "BenchmarkSessionVolume"
+
+    @staticmethod
+    def phantomMnriString(frameCount, frameWidth, frameHeight, pixelDepth, dualImage, pixelSpacing=0.24):
+        """Returns the content of the MNRI file describing a synthetic acquisition, reconstructed on the CPU"""
+        volumeDim = max(frameWidth, frameHeight) // 2
+        angleCount = frameCount // 2 if dualImage else frameCount
+        geometry = {
+            "XSrcDetectDist": 500.0,
+            "XSrcObjectDist": 400.0,
+            "InitAngle": 0.0,
+            "TotalAngle": 360.0 * (angleCount - 1) / max(angleCount, 1),
+            "OffsetOrient": 0.0,
+            "AntiClkRotDir": 0,
+            "TomoTheta": 90.0,
+            "OffsetHoriz": 0.0,
+            "OffsetVertical": 0.0,
+            "DetectOffset": 0.0,
+        }
+        backProjection = {}
+        for axis in "XYZ":
+            backProjection["Vol{}Dim".format(axis)] = volumeDim
+            backProjection["Vol{}Pitch".format(axis)] = 2.0
+            backProjection["Vol{}Start".format(axis)] = -volumeDim
+        frameCounts = "\nFrameCount1={0}\nFrameCount2={0}".format(frameCount // 2) if dualImage else ""
+
+        # Dual image parameters are read from the 1 and 2 suffixed keys
+        def section(values):
+            suffixes = ["", "1", "2"] if dualImage else [""]
+            return "\n".join("{}{}={}".format(key, suffix, value)
+                             for suffix in suffixes for key, value in values.items())
+
+        return """[Frame]
+ImageFormat=Raw16
+ImageFileExt=img
+PixelDepth={pixelDepth}
+FrameWidth={frameWidth}
+FrameHeight={frameHeight}
+FrameLengthWidth={frameLengthWidth}
+FrameLengthHeight={frameLengthHeight}
+ImageFlipNeed=None
+FrameCount={frameCount}{frameCounts}
+FrameFolder=frame
+FrameBaseName=image_
+FrameNameDigit=4
+Type={frameType}
+Subtraction=0.017
+divisions=1
+subsetSize=6
+
+[Geometry]
+{geometry}
+
+[BackProjection]
+{backProjection}
+
+[Process]
+FrequencyCut=0.5
+HFilterType=None
+RadiusCropPercentage=7
+
+[Volume]
+TFPresetIndex=0
+
+[Reconstruction]
+hardware=cpu
+""".format(pixelDepth=pixelDepth, frameWidth=frameWidth, frameHeight=frameHeight,
+           frameLengthWidth=frameWidth * pixelSpacing, frameLengthHeight=frameHeight * pixelSpacing,
+           frameCount=frameCount, frameCounts=frameCounts, frameType=1 if dualImage else 0,
+           geometry=section(geometry), backProjection=section(backProjection))
+
+    @classmethod
+    def phantomFrame(cls, angle, frameWidth, frameHeight, pixelDepth, pixelSpacing=0.24, attenuationRatio=1.0):
+        """
+        Returns the (frameHeight, frameWidth) uint16 projection of the phantom spheres at the input angle in degrees,
+        approximating the cone beam with parallel rays.
+        """
+        width = frameWidth * pixelSpacing
+        u = (np.arange(frameWidth, dtype=np.float32) - frameWidth / 2) * pixelSpacing
+        v = (np.arange(frameHeight, dtype=np.float32) - frameHeight / 2) * pixelSpacing
+        theta = np.deg2rad(angle)
+
+        lineIntegral = np.zeros((frameHeight, frameWidth), dtype=np.float32)
+        for (x, y, z), radius, attenuation in cls.PHANTOM_SPHERES:
+            uCenter = (x * np.cos(theta) + y * np.sin(theta)) * width
+            squaredDistance = (u[np.newaxis, :] - uCenter) ** 2 + (v[:, np.newaxis] - z * width) ** 2
+            chord = 2 * np.sqrt(np.maximum((radius * width) ** 2 - squaredDistance, 0))
+            lineIntegral += attenuation * attenuationRatio * chord
+
+        i0 = 2 ** pixelDepth - 1
+        return np.clip(np.rint(i0 * np.exp(-lineIntegral)), 0, i0).astype(RFReconstructionLogic.FRAME_DTYPE)
+
+    def createPhantomDataset(self, outputDir, frameCount=180, frameWidth=256, frameHeight=192, pixelDepth=14,
+                             dualImage=False):
+        """
+        Writes a synthetic acquisition of the numeric phantom in outputDir : NAOMICT.mnri and its projection frames.
+        Dual image acquisitions interleave two projections per angle, the second one less attenuated.
+
+        :return: full path to the created MNRI file
+        """
+        os.makedirs(outputDir, exist_ok=True)
+        mnriFilePath = os.path.join(outputDir, "NAOMICT.mnri")
+        with open(mnriFilePath, "w") as f:
+            f.write(self.phantomMnriString(frameCount, frameWidth, frameHeight, pixelDepth, dualImage))
+
+        mnriSettings = RFReconstructionLogic.MNRISettings(mnriFilePath)
+        framePaths = RFReconstructionLogic.frameFilePaths(mnriSettings, outputDir, frameCount)
+        os.makedirs(os.path.dirname(framePaths[0]), exist_ok=True)
+
+        totalAngle = mnriSettings.value("Geometry/TotalAngle")
+        angleCount = frameCount // 2 if dualImage else frameCount
+        for i, framePath in enumerate(framePaths):
+            angleIndex, isSecondImage = divmod(i, 2) if dualImage else (i, 0)
+            angle = totalAngle * angleIndex / max(angleCount - 1, 1)
+            ratio = self.DUAL_IMAGE_ATTENUATION_RATIO if isSecondImage else 1.0
+            self.phantomFrame(angle, frameWidth, frameHeight, pixelDepth, attenuationRatio=ratio).tofile(framePath)
+
+        return mnriFilePath
+
+    @staticmethod
+    @contextmanager
+    def _timed(timings, stage):
+        start = time.perf_counter()
+        yield
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+
+    def run(self, outputDir, frameCount=180, frameWidth=256, frameHeight=192, pixelDepth=14, dualImage=False,
+            repeats=3, reconstruct=True, saveSession=True):
+        """
+        Creates a synthetic acquisition in outputDir and times every stage of the reconstruction pipeline repeats
+        times. The simplertk reconstruction and session save stages run once as they dominate the benchmark.
+
+        :return: report dictionary, see saveReport
+        """
+        mnriFilePath = self.createPhantomDataset(outputDir, frameCount, frameWidth, frameHeight, pixelDepth, dualImage)
+        logic = RFReconstructionLogic()
+        timings = {}
+
+        for _ in range(repeats):
+            with self._timed(timings, "mnri_parse"):
+                RFReconstructionLogic.MNRISettings.clearCache()
+                mnriSettings = RFReconstructionLogic.MNRISettings(mnriFilePath)
+
+        reconstructedMnriPaths = [mnriFilePath]
+        if dualImage:
+            for _ in range(repeats):
+                with self._timed(timings, "converting_files"):
+                    reconstructedMnriPaths = list(logic.converting_files(mnriFilePath))
+
+        createMhdFiles = [logic.createMhdFile1, logic.createMhdFile2] if dualImage else [logic.createMhdFile]
+        for _ in range(repeats):
+            with self._timed(timings, "mhd_creation"):
+                for createMhdFile, path in zip(createMhdFiles, reconstructedMnriPaths):
+                    createMhdFile(path)
+
+        for _ in range(repeats):
+            with self._timed(timings, "hu_scaling"):
+                self.scaleProjectionsToHounsfieldUnits(mnriFilePath, mnriSettings)
+
+        volumePath = None
+        if reconstruct and hasattr(slicer.modules, "simplertk"):
+            with self._timed(timings, "simplertk_cpu_reconstruction"):
+                volumePath = self.reconstructOnCPU(reconstructedMnriPaths, dualImage)
+        elif reconstruct:
+            logging.warning("simplertk module not found, skipping reconstruction benchmark")
+
+        if saveSession and volumePath is not None:
+            with self._timed(timings, "session_save"):
+                self.saveSession(volumePath, os.path.join(outputDir, "RFViewerSession.mrb"))
+
+        return {
+            "version": self.REPORT_VERSION,
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": self.currentCommit(),
+            "platform": {
+                "system": platform.platform(),
+                "processor": platform.processor(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+            },
+            "dataset": {
+                "frameCount": frameCount,
+                "frameWidth": frameWidth,
+                "frameHeight": frameHeight,
+                "pixelDepth": pixelDepth,
+                "dualImage": dualImage,
+            },
+            "stages": {stage: self.summarize(seconds) for stage, seconds in timings.items()},
+        }
+
+    @staticmethod
+    def scaleProjectionsToHounsfieldUnits(mnriFilePath, mnriSettings):
+        """Scales every projection frame from raw values to Hounsfield Units the way the panorama reconstruction does"""
+        from RFPanoramaReconstruction import RFPanoramaReconstructionLogic
+
+        frameShape = (int(mnriSettings.value("Frame/FrameHeight")), int(mnriSettings.value("Frame/FrameWidth")))
+        framePaths = RFReconstructionLogic.frameFilePaths(mnriSettings, os.path.dirname(mnriFilePath),
+                                                          int(mnriSettings.value("Frame/FrameCount")))
+        projections = np.stack(RFReconstructionLogic.mapFrames(framePaths, frameShape))
+        return RFPanoramaReconstructionLogic.scaleFromRawToHounsfieldUnits(projections, mnriSettings)
+
+    @staticmethod
+    def reconstructOnCPU(mnriFilePaths, dualImage):
+        """
+        Runs the simplertk CLI without going through the reconstruction cache, concurrently for dual image acquisitions.
+
+        :return: output volume path of the first CLI
+        """
+        cliRuns = []
+        createParameters = ["createCLIParameters1", "createCLIParameters2"] if dualImage else ["createCLIParameters"]
+        for method, mnriFilePath in zip(createParameters, mnriFilePaths):
+            # Each CLI needs its own logic as the logic symlink points to the reconstructed MNRI directory
+            logic = RFReconstructionLogic()
+            parameters = getattr(logic, method)(mnriFilePath)
+            parameters["hardware"] = "cpu"
+            cliNode = slicer.cli.run(slicer.modules.simplertk, None, parameters, update_display=False)
+            cliRuns.append((logic, cliNode))
+
+        cliNodes = [cliNode for _, cliNode in cliRuns]
+        RFReconstructionLogic.waitForCLINodes(cliNodes)
+        for cliNode in cliNodes:
+            if cliNode.GetStatusString() != 'Completed':
+                raise RuntimeError("Benchmark reconstruction failed : {}".format(cliNode.GetErrorText()))
+            slicer.mrmlScene.RemoveNode(cliNode)
+        return cliNodes[0].GetParameterAsString('output')
+
+    @classmethod
+    def saveSession(cls, volumePath, sessionFilePath):
+        # The data loader would otherwise make the reconstructed volume the current volume and remove the previous one
+        slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(cls.SESSION_VOLUME_NAME)
+        volumeNode = slicer.util.loadVolume(volumePath, {'show': False, 'name': cls.SESSION_VOLUME_NAME})
+        try:
+            if not slicer.util.saveScene(sessionFilePath):
+                raise RuntimeError("Failed to save benchmark session : {}".format(sessionFilePath))
+        finally:
+            slicer.mrmlScene.RemoveNode(volumeNode)
+
+    @staticmethod
+    def summarize(seconds):
+        return {
+            "runs": len(seconds),
+            "min": min(seconds),
+            "median": statistics.median(seconds),
+            "mean": statistics.mean(seconds),
+            "seconds": seconds,
+        }
+
+    @staticmethod
+    def currentCommit():
+        """Returns the git commit of the module sources, empty string if not in a git repository"""
+        try:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                           stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    @staticmethod
+    def saveReport(report, reportFilePath):
+        with open(reportFilePath, "w") as f:
+            json.dump(report, f, indent=2)
+
+    @staticmethod
+    def loadReport(reportFilePath):
+        with open(reportFilePath, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def compareReports(baseline, current, tolerance=0.1):
+        """
+        Compares the median timings of the stages present in both reports.
+
+        :param tolerance: relative slowdown above which a stage is reported as a regression
+        :return: dictionary of stage name to (baseline median, current median, ratio, is regression)
+        """
+        if baseline.get("dataset") != current.get("dataset"):
+            logging.warning("Comparing benchmark reports of different datasets")
+
+        comparison = {}
+        for stage in sorted(set(baseline["stages"]) & set(current["stages"])):
+            before = baseline["stages"][stage]["median"]
+            after = current["stages"][stage]["median"]
+            ratio = after / before if before > 0 else float("inf")
+            comparison[stage] = (before, after, ratio, ratio > 1 + tolerance)
+            logging.info("{}: {:.3f}s -> {:.3f}s ({:+.0%}){}".format(stage, before, after, ratio - 1,
+                                                                     " REGRESSION" if ratio > 1 + tolerance else ""))
+        return comparison
+
+
+class RFReconstructionBenchmarkLogicTestCase(unittest.TestCase):
+    def test_phantom_dataset_is_benchmarked_and_reports_can_be_compared(self):
+        tempDir = qt.QTemporaryDir()
+        tempDir.setAutoRemove(True)
+
+        logic = RFReconstructionBenchmarkLogic()
+        report = logic.run(tempDir.path(), frameCount=8, frameWidth=32, frameHeight=24, dualImage=True, repeats=2,
+                           reconstruct=False)
+
+        # The phantom attenuates the center of the frames
+        frame = np.fromfile(os.path.join(tempDir.path(), "frame", "image_0000.img"), dtype=np.uint16).reshape(24, 32)
+        self.assertLess(frame[12, 16], frame[0, 0])
+        self.assertEqual(2 ** 14 - 1, frame[0, 0])
+
+        self.assertEqual({"mnri_parse", "converting_files", "mhd_creation", "hu_scaling"}, set(report["stages"]))
+        self.assertEqual(2, report["stages"]["mhd_creation"]["runs"])
+
+        reportFilePath = os.path.join(tempDir.path(), "report.json")
+        logic.saveReport(report, reportFilePath)
+        baseline = logic.loadReport(reportFilePath)
+        baseline["stages"]["hu_scaling"]["median"] = report["stages"]["hu_scaling"]["median"] / 2
+        comparison = logic.compareReports(baseline, report)
+        self.assertTrue(comparison["hu_scaling"][3])
+        self.assertFalse(comparison["mnri_parse"][3])
+
+
+class RFReconstructionBenchmarkTest(ScriptedLoadableModuleTest):
+    def runTest(self):
+        # Gather tests for the plugin and run them in a test suite
+        slicer.mrmlScene.Clear()
+        testCases = [RFReconstructionBenchmarkLogicTestCase]
+        suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
+        unittest.TextTestRunner(verbosity=3).run(suite)
+        slicer.mrmlScene.Clear()
@@ -6,7 +6,7 @@ import slicer
 from slicer.ScriptedLoadableModule import *
 
 from RFViewerHomeLib import translatable, RFViewerWidget, removeNodeFromMRMLScene, createButton, showVolumeOnSlices, \
-    wrapInQTimer, WindowLevelUpdater, Signal, nodeID, getNodeByID, toggleCheckBox, strToBool
+    wrapInQTimer, WindowLevelUpdater, Signal, nodeID, getNodeByID, toggleCheckBox, strToBool, profiler
 from RFVisualizationLib import setNodeVisibleInMainViewsOnly, ViewTag
 
 
@@ -46,6 +46,7 @@ class RFSegmentationUI(qt.QWidget):
         self._segmentationVolumeNode = None
         self._windowLevelUpdater = None
         self._resampleCLI = None
+        self._resampleSpan = None
 
         settings = qt.QSettings()
         settings.beginGroup("Segmentations")
@@ -148,6 +149,9 @@ class RFSegmentationUI(qt.QWidget):
         if cliNode.GetStatusString() == "Scheduled":
             self.addProgressBar.emit(self._progressText)
 
+        if not cliNode.IsBusy() and self._resampleSpan is not None:
+            self._resampleSpan.finish(status=cliNode.GetStatusString())
+
         if cliNode.GetStatusString() == "Completed":
             self._onResamplingDone()
 
@@ -187,6 +191,8 @@ class RFSegmentationUI(qt.QWidget):
                     "InputVolume": self._volumeNode.GetID(),  #
                     "OutputVolume": self._resampledVolumeNode.GetID()}
 
+        self._resampleSpan = profiler.startSpan("Resample segmentation volume", "segmentation",
+                                                spacing=cliParam["outputPixelSpacing"])
         self._resampleCLI = slicer.cli.run(module, self._resampleCLI, cliParam)
 
     def _onResamplingDone(self):
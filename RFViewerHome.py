@@ -6,13 +6,15 @@ from slicer.ScriptedLoadableModule import *
 from RFViewerHomeLib import *
 from RFVisualizationLib import RFVisualizationUI, RFLayoutType
 from RFReconstruction import *
-from RFReconstruction import RFReconstructionLogic
+from RFReconstruction import RFReconstructionLogic, RFReconstructionBatchQueue
 from RFViewerHomeLib import DataLoader, ModuleWidget, ToolbarWidget, createButton, Icons, \
-    translatable, ProgressBar, RFSessionSerialization, ExportDirectorySettings, RFViewerWidget, warningMessageBox, wrapInCollapsibleButton
+    translatable, ProgressBar, RFSessionSerialization, ExportDirectorySettings, RFViewerWidget, warningMessageBox, wrapInCollapsibleButton, \
+    profiler, profiled
 import ScreenCapture
 import pydicom
 # from oct2py import Oct2Py
 import threading
+import unittest
 import os.path
 from os import path
 from datetime import datetime
@@ -218,6 +220,19 @@ class RFViewerHomeWidget(RFViewerWidget):
         main_window.onDropEvent.connect(self.onDropEvent)
         # self.dock_content.setFixedWidth(600)
 
+        # Export the recent profiling spans on demand for support
+        self._exportTraceShortcut = qt.QShortcut(qt.QKeySequence("Ctrl+Shift+T"), main_window)
+        self._exportTraceShortcut.connect("activated()", self.onExportProfilingTrace)
+
+    def onExportProfilingTrace(self):
+        """Save the recent profiling spans as a Chrome trace file, readable with chrome://tracing or ui.perfetto.dev"""
+        defaultPath = os.path.join(ExportDirectorySettings.load(),
+                                   "RFViewer-trace-{}.json".format(datetime.now().strftime("%Y%m%d-%H%M%S")))
+        filePath = qt.QFileDialog.getSaveFileName(None, self.tr("Export profiling trace"), defaultPath,
+                                                  self.tr("Trace File") + " (*.json)")
+        if filePath:
+            profiler.exportChromeTrace(filePath)
+
     def onDropEvent(self, event):
         """On drop event, try to load Data as Volume"""
         urls = event.mimeData().urls()
@@ -323,7 +338,7 @@ class RFViewerHomeWidget(RFViewerWidget):
     def _connectDataLoading(self):
         for moduleWidget in self._rfModuleWidgets():
             self._dataLoaderWidget.volumeNodeChanged.connect(
-                moduleWidget.setVolumeNode)
+                profiled(type(moduleWidget).__name__ + ".setVolumeNode", "load")(moduleWidget.setVolumeNode))
 
     def _connectWidgetProgressReporting(self):
         for moduleWidget in self._rfModuleWidgets():
@@ -800,6 +815,7 @@ class RFViewerHomeWidget(RFViewerWidget):
         self._dataLoaderWidget.restoreCurrentNodeFromID(
             parameterNode.GetParameter("CurrentNodeID"))
 
+    @profiled("Reconstruct and save session", "reconstruction")
     def reconstructAndSaveSession(self, mnriPath, mrbOutputPath):
         # Disable loading notifications
         self._dataLoaderWidget.setVolumeAddedNotificationEnabled(False)
@@ -841,7 +857,119 @@ class RFViewerHomeWidget(RFViewerWidget):
         # Enable notifications
         self._dataLoaderWidget.setVolumeAddedNotificationEnabled(True)
 
+    def batchReconstructAndSaveSessions(self, mnriPaths, queueFilePath, maxConcurrentJobs=2, maxRetries=1):
+        """
+        Reconstruct every MNRI file of mnriPaths (files or directories searched recursively) with at most
+        maxConcurrentJobs simplertk CLI processes running at the same time, and save one MRB session next to each MNRI
+        file.
+
+        The queue is persisted to queueFilePath. Calling this method again with the same queue file resumes an
+        interrupted run.
+
+        :return: list of the job dictionaries with their status, number of attempts, wall time and error
+        """
+        progressText = self.tr("Batch reconstruction...")
+        queue = RFReconstructionBatchQueue(queueFilePath, self._saveBatchReconstructedSession, maxConcurrentJobs,
+                                           maxRetries)
+        queue.addMnriFiles(mnriPaths)
+        queue.progress.connect(lambda done, total: logging.info("Batch reconstruction {}/{}".format(done, total)))
+
+        # Disable loading notifications
+        self._dataLoaderWidget.setVolumeAddedNotificationEnabled(False)
+        self.onAddProgressBar(progressText)
+        try:
+            queue.start()
+            queue.wait()
+        finally:
+            self.onRemoveProgressBar(progressText)
+            self._dataLoaderWidget.setVolumeAddedNotificationEnabled(True)
+
+        return queue.jobs
+
+    def _saveBatchReconstructedSession(self, job, volumePath):
+        self._dataLoaderWidget.loadData(volumePath)
+
+        # Set new volume for the different widgets
+        for widget in self._rfModuleWidgets():
+            widget.setVolumeNode(self._dataLoaderWidget.getCurrentVolumeNode())
+
+        # Wait until all widgets are updated with reconstructed volume and save the session
+        slicer.app.processEvents()
+        self._sessionSerializer.saveSession(job["mrb"], showMessageBox=False)
+
 
 class RFViewerHomeLogic(ScriptedLoadableModuleLogic):
     """Empty logic class for the module to avoid error report on module loading"""
     pass
+
+
+class UpdateSchedulerTestCase(unittest.TestCase):
+    class RecordingUpdateScheduler(UpdateScheduler):
+        """Scheduler recording the isDraft argument of its updates, the mouse interaction is set by the tests"""
+
+        def __init__(self):
+            self.updates = []
+            self.interacting = False
+            UpdateScheduler.__init__(self, lambda isDraft: self.updates.append(isDraft))
+
+        def isInteracting(self):
+            return self.interacting
+
+    def test_burst_of_requests_is_coalesced_into_one_update(self):
+        scheduler = self.RecordingUpdateScheduler()
+        for _ in range(10):
+            scheduler.requestUpdate()
+        self.assertTrue(scheduler.isPending)
+        self.assertEqual(scheduler.updates, [])
+
+        scheduler._onTimeout()
+        scheduler._onTimeout()
+        self.assertEqual(scheduler.updates, [False])
+        self.assertFalse(scheduler.isPending)
+
+    def test_final_update_is_done_once_the_interaction_ends(self):
+        scheduler = self.RecordingUpdateScheduler()
+        scheduler.interacting = True
+        scheduler.requestUpdate()
+        scheduler._onTimeout()
+        scheduler._onTimeout()
+        self.assertEqual(scheduler.updates, [True])
+        self.assertTrue(scheduler.isPending)
+
+        scheduler.interacting = False
+        scheduler._onTimeout()
+        self.assertEqual(scheduler.updates, [True, False])
+        self.assertFalse(scheduler.isPending)
+
+    def test_flush_runs_the_pending_update_in_final_quality(self):
+        scheduler = self.RecordingUpdateScheduler()
+        scheduler.flush()
+        self.assertEqual(scheduler.updates, [])
+
+        scheduler.interacting = True
+        scheduler.requestUpdate()
+        scheduler._onTimeout()
+        scheduler.flush()
+        self.assertEqual(scheduler.updates, [True, False])
+        self.assertFalse(scheduler.isPending)
+
+        scheduler._onTimeout()
+        self.assertEqual(scheduler.updates, [True, False])
+
+    def test_cancel_drops_the_pending_update(self):
+        scheduler = self.RecordingUpdateScheduler()
+        scheduler.requestUpdate()
+        scheduler.cancel()
+        self.assertFalse(scheduler.isPending)
+
+        scheduler._onTimeout()
+        scheduler.flush()
+        self.assertEqual(scheduler.updates, [])
+
+
+class RFViewerHomeTest(ScriptedLoadableModuleTest):
+    def runTest(self):
+        # Gather tests for the plugin and run them in a test suite
+        testCases = [UpdateSchedulerTestCase]
+        suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
+        unittest.TextTestRunner(verbosity=3).run(suite)
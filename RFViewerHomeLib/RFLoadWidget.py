@@ -6,7 +6,7 @@ import slicer
 import vtk
 
 from RFViewerHomeLib import Signal, removeNodeFromMRMLScene, wrapInQTimer, translatable, strToBool, warningMessageBox, \
-    nodeID, ExportDirectorySettings, listEveryFileInDirectory
+    nodeID, ExportDirectorySettings, listEveryFileInDirectory, profileSpan
 
 
 @translatable
@@ -130,7 +130,8 @@ class DataLoader(object):
             self._currentVolumeNode.SetUndoEnabled(True)
 
         if self._isVolumeAddedNotificationEnabled:
-            self.volumeNodeChanged.emit(self._currentVolumeNode)
+            with profileSpan("Notify volume listeners", "load"):
+                self.volumeNodeChanged.emit(self._currentVolumeNode)
 
     @wrapInQTimer
     def onLoadDICOMClicked(self):
@@ -222,7 +223,8 @@ class DataLoader(object):
 
         # Import volume node from file
         try:
-            node = slicer.util.loadNodeFromFile(filePath, "VolumeFile")
+            with profileSpan("Load volume file", "load", path=filePath):
+                node = slicer.util.loadNodeFromFile(filePath, "VolumeFile")
             self._previousLoadedDataDir = os.path.dirname(filePath)
         except RuntimeError:
             warningMessageBox(self.tr("Failed to import volume"), self.tr('Failed to import volume file : ') + filePath)
@@ -231,7 +233,8 @@ class DataLoader(object):
         self._isNewVolumeSettingEnabled = prevIsNewVolumeSettingEnabled
 
         # Notify new node added if correctly set
-        self._onNewVolumeAdded(node)
+        with profileSpan("Set current volume", "load"):
+            self._onNewVolumeAdded(node)
 
         # Save file path as default export path
         ExportDirectorySettings.save(filePath)
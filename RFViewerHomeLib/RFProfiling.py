@@ -0,0 +1,184 @@
+import ctypes
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+def peakRSS():
+    """
+    Returns the peak resident set size of the application process in bytes (peak working set on Windows), 0 if it
+    cannot be queried.
+    """
+    try:
+        if os.name == "nt":
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [("cb", ctypes.c_ulong),
+                            ("PageFaultCount", ctypes.c_ulong),
+                            ("PeakWorkingSetSize", ctypes.c_size_t),
+                            ("WorkingSetSize", ctypes.c_size_t),
+                            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                            ("PagefileUsage", ctypes.c_size_t),
+                            ("PeakPagefileUsage", ctypes.c_size_t)]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return 0
+            return counters.PeakWorkingSetSize
+
+        import resource
+        import sys
+        maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return maxRSS if sys.platform == "darwin" else maxRSS * 1024
+    except (OSError, AttributeError, ImportError):
+        return 0
+
+
+class ProfilingSpan(object):
+    """
+    Timed section of the application workflow. Spans are usually used through Profiler.span or the profiled decorator,
+    startSpan / finish are available for sections starting and ending in different callbacks (asynchronous CLIs).
+    """
+
+    def __init__(self, profiler, name, category, args):
+        self._profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = dict(args)
+        self.threadId = threading.get_ident()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.peakRSS = 0
+
+    @property
+    def isFinished(self):
+        return self.duration is not None
+
+    def finish(self, **args):
+        """Stops the span and records it in the profiler. Finishing a span several times has no effect."""
+        if self.isFinished:
+            return
+        self.duration = time.perf_counter() - self.start
+        self.peakRSS = peakRSS()
+        self.args.update(args)
+        self._profiler._record(self)
+
+
+class Profiler(object):
+    """
+    Lightweight profiler keeping the last spans of the application workflow in a ring buffer.
+
+    Each span records its wall time and the process peak RSS when it ends. The buffer can be exported to the Chrome
+    trace format, readable with chrome://tracing or https://ui.perfetto.dev.
+
+    Usage example :
+        with profiler.span("Load volume", "load", path=filePath):
+            ...
+
+        @profiled("Save session", "session")
+        def saveSession(self, sessionFilePath):
+            ...
+    """
+
+    def __init__(self, capacity=4096):
+        self.isEnabled = True
+        self._spans = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    @property
+    def capacity(self):
+        return self._spans.maxlen
+
+    def startSpan(self, name, category="RFViewer", **args):
+        return ProfilingSpan(self, name, category, args)
+
+    @contextmanager
+    def span(self, name, category="RFViewer", **args):
+        span = self.startSpan(name, category, **args)
+        try:
+            yield span
+        except Exception as e:
+            span.finish(error=repr(e))
+            raise
+        finally:
+            span.finish()
+
+    def _record(self, span):
+        if not self.isEnabled:
+            return
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self):
+        """Returns the finished spans, oldest first"""
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def chromeTrace(self):
+        """Returns the recorded spans as a Chrome trace dictionary with a peak RSS counter track"""
+        pid = os.getpid()
+        events = []
+        for span in self.spans():
+            timestamp = (span.start - self._origin) * 1e6
+            events.append({
+                "name": span.name,
+                "cat": span.category,
+                "ph": "X",
+                "ts": timestamp,
+                "dur": span.duration * 1e6,
+                "pid": pid,
+                "tid": span.threadId,
+                "args": {key: str(value) for key, value in span.args.items()},
+            })
+            if span.peakRSS:
+                events.append({
+                    "name": "Peak RSS (MB)",
+                    "ph": "C",
+                    "ts": timestamp + span.duration * 1e6,
+                    "pid": pid,
+                    "args": {"Peak RSS": span.peakRSS / (1024 * 1024)},
+                })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def exportChromeTrace(self, filePath):
+        with open(filePath, "w") as f:
+            json.dump(self.chromeTrace(), f)
+        return filePath
+
+
+profiler = Profiler()
+
+
+def profileSpan(name, category="RFViewer", **args):
+    """Context manager recording a span in the application profiler"""
+    return profiler.span(name, category, **args)
+
+
+def profiled(name=None, category="RFViewer"):
+    """Decorator recording every call of the decorated function as a span of the application profiler"""
+
+    def decorator(func):
+        spanName = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.span(spanName, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -4,7 +4,7 @@ import qt
 import slicer
 import ScreenCapture
 from RFViewerHomeLib import translatable, warningMessageBox, informationMessageBox, Icons, TemporarySymlink, \
-    ExportDirectorySettings
+    ExportDirectorySettings, profiled, profileSpan
 from enum import IntEnum, unique
 import vtk
 from RFExport import RFExportWidget
@@ -45,17 +45,20 @@ class RFSessionSerialization(object):
         return qt.QFileDialog.getOpenFileName(None, self.tr("Load session file"), self._lastSessionPath(),
                                               self._sessionFileFilter)
 
+    @profiled("Save session", "session")
     def saveSession(self, sessionFilePath, showMessageBox=True):
         # Notify session about to be saved
         pixmap = qt.QPixmap(":/Icons/Cursor.png")
         cursor = qt.QCursor(pixmap, 32, 32)
         qt.QApplication.setOverrideCursor(cursor)
         
-        for widget in self._rfWidgets:
-            widget.onSessionAboutToBeSaved()
+        with profileSpan("Prepare widgets for session save", "session"):
+            for widget in self._rfWidgets:
+                widget.onSessionAboutToBeSaved()
 
         # Save scene to path
-        slicer.util.saveScene(self._tmpSymlink.getSymlinkToNewPath(sessionFilePath))
+        with profileSpan("Save scene", "session", path=sessionFilePath):
+            slicer.util.saveScene(self._tmpSymlink.getSymlinkToNewPath(sessionFilePath))
 
         
         qt.QApplication.restoreOverrideCursor()
@@ -90,6 +93,7 @@ class RFSessionSerialization(object):
                                             qt.QRect(topLeft.x(), topLeft.y(), imageSize.x(), imageSize.y()))
 
         img.save(path)
+    @profiled("Load session", "session")
     def loadSession(self, sessionFilePath):
         # Deactivate load widget notifications
         self._loadWidget.setNewVolumeSettingEnabled(False)
@@ -102,13 +106,15 @@ class RFSessionSerialization(object):
         slicer.mrmlScene.Clear()
 
         # Load scene from session path
-        if os.path.exists(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath)):
-            slicer.util.loadScene(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath))
-        else:
-            slicer.util.loadScene(sessionFilePath)
+        with profileSpan("Load scene", "session", path=sessionFilePath):
+            if os.path.exists(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath)):
+                slicer.util.loadScene(self._tmpSymlink.getSymlinkToExistingPath(sessionFilePath))
+            else:
+                slicer.util.loadScene(sessionFilePath)
         # Notify scene was loaded
-        for widget in self._rfWidgets:
-            widget.onSessionLoaded()
+        with profileSpan("Restore widgets from session", "session"):
+            for widget in self._rfWidgets:
+                widget.onSessionLoaded()
         slicer.app.processEvents()
         slicer.util.forceRenderAllViews()
         # Reactivate load widget notifications
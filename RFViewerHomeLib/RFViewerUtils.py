@@ -424,6 +424,88 @@ class Signal(object):
         self.emit(*args, **kwargs)
 
 
+class UpdateScheduler(object):
+    """
+    Coalesces bursts of modification events into a single call of an update function.
+
+    The first request arms a timer and the following requests are merged into it : the update function is called at
+    most once per interval, whatever the number of events. Updates done while a mouse button is pressed (markup point
+    being dragged) are drafts, and a final update is done once the button is released.
+
+    Usage example :
+        self._updateScheduler = UpdateScheduler(self.updateModel, intervalMs=30)
+        markupNode.AddObserver(slicer.vtkMRMLMarkupsNode.PointModifiedEvent, self._updateScheduler.requestUpdate)
+
+        def updateModel(self, isDraft=False):
+            ...
+    """
+
+    def __init__(self, updateFunction, intervalMs=33, isDraftEnabled=True):
+        """
+        :param updateFunction: callable called with isDraft as keyword argument
+        :param intervalMs: minimum time between two updates
+        :param isDraftEnabled: if False, all updates are final updates
+        """
+        self._updateFunction = updateFunction
+        self.isDraftEnabled = isDraftEnabled
+        self._isUpdatePending = False
+        self._isFinalUpdatePending = False
+        self._timer = qt.QTimer()
+        self._timer.singleShot = True
+        self._timer.interval = intervalMs
+        self._timer.connect("timeout()", self._onTimeout)
+
+    @property
+    def intervalMs(self):
+        return self._timer.interval
+
+    @intervalMs.setter
+    def intervalMs(self, intervalMs):
+        self._timer.interval = intervalMs
+
+    @property
+    def isPending(self):
+        return self._isUpdatePending or self._isFinalUpdatePending
+
+    def requestUpdate(self, *args):
+        """Schedules an update. Arguments are ignored for the method to be usable as VTK observer or Qt slot."""
+        self._isUpdatePending = True
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        """Runs the pending update, if any, immediately in final quality"""
+        if not self.isPending:
+            return
+        self.cancel()
+        self._updateFunction(isDraft=False)
+
+    def cancel(self):
+        """Drops the pending update"""
+        self._timer.stop()
+        self._isUpdatePending = False
+        self._isFinalUpdatePending = False
+
+    def isInteracting(self):
+        return qt.QApplication.mouseButtons() != qt.Qt.NoButton
+
+    def _onTimeout(self):
+        if not self.isPending:
+            return
+
+        isDraft = self.isDraftEnabled and self.isInteracting()
+        if not self._isUpdatePending and isDraft:
+            # Wait for the end of the interaction to do the final update
+            self._timer.start()
+            return
+
+        self._isUpdatePending = False
+        self._isFinalUpdatePending = isDraft
+        if isDraft:
+            self._timer.start()
+        self._updateFunction(isDraft=isDraft)
+
+
 def removeNodeFromMRMLScene(node):
     """
     Remove node from slicer scene
@@ -1,4 +1,5 @@
 from .RFViewerUtils import *
+from .RFProfiling import *
 from .RFLoadWidget import *
 from .RFViewerHomePanel import *
 from .RFViewerWidget import *
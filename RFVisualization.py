@@ -7,9 +7,13 @@ import RFViewerHomeLib
 from RFViewerHomeLib import wrapInQTimer, translatable, RFViewerWidget, showVolumeOnSlices,showVolumeOnSlice, warningMessageBox, \
   getViewBySingletonTag,ExportDirectorySettings 
 from RFVisualizationLib import RFLayoutType, layoutSetup, layoutBackgroundSetup, RFVisualizationUI, IndustryType, \
-  closestPowerOfTen, getAll3DViewNodes, createDiscretizableColorTransferFunctionFromColorPreset, \
-  createColorNodeFromVolumePropertyNode, ViewTag
+  closestPowerOfTen, getAll3DViewNodes, getThreeDViewByTag, createDiscretizableColorTransferFunctionFromColorPreset, \
+  createColorNodeFromVolumePropertyNode, ViewTag, ThreeDViewTag, RFTileViewLayout, \
+  RFTileViewSynchronizer, RFProgressiveVolumeRendering, RFVolumeRenderingResources, RFVolumePyramid, \
+  downsampleVolumeArray, slidingWindowExtremum, slidingWindowMean, tileLayoutDescription, tileSliceToRASMatrices
 import threading
+import unittest
+import xml.etree.ElementTree as ElementTree
 
 from datetime import datetime
 import numpy as np
@@ -43,6 +47,7 @@ class RFVisualizationWidget(RFViewerWidget):
 
     self._layoutManager = None
     self._vrLogic = None
+    self._vrResources = None
 
     self._currentPreset3D = None
     self._currentPreset2D = None
@@ -78,6 +83,10 @@ class RFVisualizationWidget(RFViewerWidget):
     #タイルビュー用フラグ
     self.tileViewSyncFlg = False
     self.compareNodes = None
+    self._tileViewLayout = RFTileViewLayout()
+    self._tileViewSynchronizer = RFTileViewSynchronizer(self._tileViewLayout, self.tileSliceOffsetChanged)
+    #操作中は低解像度でボリュームレンダリング（対象ビューはRFLayoutで設定）
+    self._progressiveVolumeRendering = RFProgressiveVolumeRendering()
 
   def getVolumeDisplayNode3D(self):
     return self._vrLogic.GetFirstVolumeRenderingDisplayNode(self.volumeNode)
@@ -86,12 +95,14 @@ class RFVisualizationWidget(RFViewerWidget):
     # Fix initial raycast state on volume loading
     # self.ui.raycastSelector.setCurrentIndex(0)
 
-    if self.volumeNode and not self.getVolumeDisplayNode3D():
-      self._vrLogic.CreateDefaultVolumeRenderingNodes(self.volumeNode)
+    # The volume rendering display node is shared by all the 3D views, and only created once per volume
+    if self.volumeNode:
+      self._vrResources.attachView(self.volumeNode, ThreeDViewTag.Main)
     
     # print(volumeNode)
     self.ui.setVolumeNode(volumeNode=volumeNode, displayNode3D=self.getVolumeDisplayNode3D(),
                           isLoadingState=self._isLoadingState)
+    self._progressiveVolumeRendering.setVolumeNode(volumeNode)
 
     # If volume node was cleared, presets should not be set
     if not self.volumeNode:
@@ -140,6 +151,7 @@ class RFVisualizationWidget(RFViewerWidget):
       self.industry = IndustryType.Medical
     self._layoutManager = slicer.app.layoutManager()
     self._vrLogic = slicer.modules.volumerendering.logic()
+    self._vrResources = RFVolumeRenderingResources(self._vrLogic)
 
     # Apply default 3D Preset
     self._currentPreset3D = self._defaultIndustry3DPreset()
@@ -182,6 +194,7 @@ class RFVisualizationWidget(RFViewerWidget):
     #-------------------------------------------
     #--- for cephalometric & Speed up 20220924 koyanagi --- add
     self.ui.fractionCheckBox.connect("stateChanged(int)", self.onFractionChanged)#ルーラーの表示・非表示
+    self.ui.slabCacheCheckBox.connect("stateChanged(int)", self.onSlabCacheChanged)#断層厚キャッシュの有効・無効
     #-------------------------------------------
 
     self.ui.numCombo.connect("currentIndexChanged(int)", self.onTileLayoutChanged)
@@ -277,10 +290,13 @@ class RFVisualizationWidget(RFViewerWidget):
     
     if newLayout == RFLayoutType.RFTriple3D or newLayout == RFLayoutType.RFDual3D:
       self.setVRMode(self._currentVRMode)
-      views = getAll3DViewNodes()
-      for view in views:
-        self.getVolumeDisplayNode3D().AddViewNodeID(view.GetID())
+      for viewTag in ThreeDViewTag.layoutViewTags():
+        view = getThreeDViewByTag(viewTag)
+        if view is None:
+          continue
+        self._vrResources.attachView(self.volumeNode, viewTag)
         layoutBackgroundSetup(view)
+      self._progressiveVolumeRendering.updateViews()
 
     # Apply slab thickness on new slice views
     self.onSlabThicknessSliderChanged()
@@ -476,12 +492,10 @@ class RFVisualizationWidget(RFViewerWidget):
     self.tileSliceViewSet(defaultSliceLabel,defaultSliceInterval)
 
     tile3DView = None
-    l = []
     layoutManager = slicer.app.layoutManager()
     for threeDViewIndex in range(layoutManager.threeDViewCount):
       view = layoutManager.threeDWidget(threeDViewIndex).threeDView()
       threeDViewNode = view.mrmlViewNode()
-      l.append(threeDViewNode .GetID())
       if threeDViewNode.GetLayoutName() == "Tile3DView":
         tile3DView = view
         tile3DViewNode = threeDViewNode
@@ -490,11 +504,11 @@ class RFVisualizationWidget(RFViewerWidget):
     tile3DViewNode.SetBackgroundColor(0.5,0.5,0.5)
     tile3DViewNode.SetBackgroundColor2(0.8,0.8,0.8)
     
-    referenceVolumeNode = slicer.mrmlScene.GetFirstNodeByClass("vtkMRMLScalarVolumeNode")
-    volRenLogic = slicer.modules.volumerendering.logic()
-    displayNode = volRenLogic.CreateDefaultVolumeRenderingNodes(referenceVolumeNode)
-    displayNode.SetViewNodeIDs(l)#データ空の時エラーでる。
-    displayNode.SetVisibility(True)
+    #表示中ボリュームの共有VR表示ノードへタイル3Dビューを追加（再表示時はボリュームを再転送しない）
+    if self.volumeNode is not None:
+      self._vrResources.attachView(self.volumeNode, ThreeDViewTag.Tile)
+      self.getVolumeDisplayNode3D().SetVisibility(True)
+      self._progressiveVolumeRendering.updateViews()
     #３D表示位置リセット
     tile3DView.resetFocalPoint()
     
@@ -510,20 +524,6 @@ class RFVisualizationWidget(RFViewerWidget):
     #表示画像の座標データ
     baseSliceNode = slicer.app.layoutManager().sliceWidget(sliceLabel).mrmlSliceNode()
     baseSliceOffset = baseSliceNode.GetSliceOffset()
-    baseSliceToRas = baseSliceNode.GetSliceToRAS()
-    transform=vtk.vtkTransform()
-    transform.SetMatrix(baseSliceToRas)
-    
-    #表示画像の表示データID　新規スライスへ表示するデータを設定
-    sliceNode = slicer.app.layoutManager().sliceWidget(sliceLabel).mrmlSliceNode()
-    sliceLogic = slicer.app.applicationLogic().GetSliceLogic(sliceNode)
-    compositeNode = sliceLogic.GetSliceCompositeNode()
-    BackgroundVolumeID = compositeNode.GetBackgroundVolumeID()
-    
-    baseFOV = sliceNode.GetFieldOfView()
-    baseXYZOrigin = sliceNode.GetXYZOrigin()
-    
-    slicer.compareWidgets = [slicer.app.layoutManager().sliceWidget('Compare' + str(i)) for i in range(1, 17)]
 
     #UI関係の初期化
     #スライドバーの値を更新　最終は画像サイズに合わせる（min max）
@@ -541,39 +541,15 @@ class RFVisualizationWidget(RFViewerWidget):
     self.ui.directionCombo.setCurrentIndex(orientationIndex)
     #スライスインターバルの初期化
     self.ui.sliceIntervalSlider.setValue(SliceInterval)
-    
-    for compareWidget in slicer.compareWidgets:
-      #compareWidget.mrmlSceneChanged
-      #表示するデータを設定
-      compareNode = compareWidget.mrmlSliceNode()
-      compareLogic = slicer.app.applicationLogic().GetSliceLogic(compareNode)
-      compareCompositeNode = compareLogic.GetSliceCompositeNode()
-      compareCompositeNode.SetBackgroundVolumeID(BackgroundVolumeID)
-      compareCompositeNode.SetInteractionFlags(0)
-      #向き設定
-      #compareWidget.setSliceOrientation(defaultOrientation)
-      #ベースデータの座標コピー
-      compareNode = compareWidget.mrmlSliceNode()
-      compareSliceToRas = compareNode.GetSliceToRAS()
-      compareSliceToRas.DeepCopy(transform.GetMatrix())
-      compareNode.UpdateMatrices()
-      #位置関係コピー
-      #オフセット値　FOV設定　XYZOrigin
-      compareNode.SetSliceOffset(baseSliceOffset)
-      #compareNode.SetFieldOfView(*baseFOV) #縦横サイズがずれる為、一旦削除
-      compareNode.SetXYZOrigin(*baseXYZOrigin)
-      #オフセット値　インクリメント
-      baseSliceOffset = baseSliceOffset + SliceInterval
-      compareNode.Modified()
-      #Intersection（断層軸）非表示
-      compareCompositeNode.SetSliceIntersectionVisibility(0)
-      compareNode.SetWidgetVisible(0)
-    
-    #タイルビューのFOV設定
-    for compareWidget in slicer.compareWidgets:
-      compareLogic = compareWidget.sliceLogic()
-      compareLogic.FitFOVToBackground(200)
-      compareLogic.Modified()
+
+    #表示データ・向き・オフセット値・FOVを全タイルビューへまとめて設定（描画は一度のみ）
+    self.updateTileGridSize()
+    self._tileViewLayout.setupFromSliceNode(baseSliceNode, SliceInterval)
+
+  def updateTileGridSize(self):
+    #タイルビューのレイアウト（2x2, 3x3, 4x4）に合わせてビュー数を設定
+    tileGridSize = self.ui.numCombo.currentData + 2
+    self._tileViewLayout.setGridSize(tileGridSize, tileGridSize)
 
 
   #シンク状態だとレイアウト削除後に位置情報を見失い次起動時に表示されない為
@@ -582,6 +558,7 @@ class RFVisualizationWidget(RFViewerWidget):
     if self._isLoadingState:
       return
     self.tileViewSync(False)
+    self._tileViewSynchronizer.stop()
     self.tileViewSelectSliceVisible(False)
 
   def tileViewLaoutStyle(self):
@@ -591,53 +568,21 @@ class RFVisualizationWidget(RFViewerWidget):
       compareWidget.setStyleSheet("QWidget {border:2px solid black;}" "QWidget:hover {border: 2px solid red ;}")
 
   def tileViewSync(self, syncOn):
-    #タイルビュー画面　拡大・移動・スライスオフセットの同期化　割り込み設定
-    #compareNodes = [slicer.app.layoutManager().sliceWidget('Compare' + str(i)).mrmlSliceNode() for i in range(1, 17)]
-    if not syncOn:
-      #print ("syncoff")
-      self.tileViewSyncFlg = False
-      #for compareNode in compareNodes:
-        #リムーブできない為、一旦Observerのまま処理する形にする。
-        #compareNode.RemoveObserver(compareNode.tileViewChangeObserverTag)
-    else:
-      self.tileViewSyncFlg = True
-      #for compareNode in compareNodes:
-        #compareNode.tileViewChangeObserverTag = compareNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.tileSliceModified)
-        #self.tileViewSyncFlg = True
+    #タイルビュー画面　拡大・移動・スライスオフセットの同期化　有効・無効の切り替え
+    self.tileViewSyncFlg = syncOn
+    self._tileViewSynchronizer.setEnabled(syncOn)
 
   def tileViewSyncOn(self):
-    compareNodes = [slicer.app.layoutManager().sliceWidget('Compare' + str(i)).mrmlSliceNode() for i in range(1, 17)]
-    for compareNode in compareNodes:
-      compareNode.tileViewChangeObserverTag = compareNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.tileSliceModified)
-      self.tileViewSyncFlg = True
-
+    #表示中のタイルビューのスライスノードを監視（以前のObserverは削除）
+    self._tileViewSynchronizer.start()
+    self.tileViewSyncFlg = True
 
-  def tileSliceModified(self, caller, event):
-    if not self.tileViewSyncFlg:
-      return
-    #タイルビュー画面　拡大・移動・スライスオフセットの同期化
-    compareNodes = [slicer.app.layoutManager().sliceWidget('Compare' + str(i)).mrmlSliceNode() for i in range(1, 17)]
-    #if slicer.updatingSliceNodes:
-    #  # prevent infinite loop of slice node updates triggering slice node updates
-    #  return
-    #slicer.updatingSliceNodes = True
-    fov = caller.GetFieldOfView()
-    XYZori = caller.GetXYZOrigin()
-    offset = caller.GetSliceOffset()
-    node_No = 0
-    cnt = 0
-    for compareNode in compareNodes:
-      if compareNode != caller:
-        compareNode.SetFieldOfView(*fov)
-        compareNode.SetXYZOrigin(*XYZori)
-        cnt = cnt + 1
-      if compareNode == caller:
-        node_No = cnt
-    
-    cnt = 0
+  def tileSliceOffsetChanged(self, node_No, offset):
+    #タイルビュー画面　スライスオフセットの同期化
+    #拡大・移動（FOV, XYZOrigin）はRFTileViewSynchronizerで他のタイルビューへ反映済み
     interval = self.ui.sliceIntervalSlider.value
     calcCompare1_Offset = offset - (node_No * interval)
-    currentCompare1_Offset = slicer.app.layoutManager().sliceWidget('Compare1').mrmlSliceNode().GetSliceOffset()
+    currentCompare1_Offset = self._tileViewSynchronizer.sliceNodes[0].GetSliceOffset()
     if calcCompare1_Offset == currentCompare1_Offset:
       return
     self.tileViewSync(False)
@@ -646,13 +591,14 @@ class RFVisualizationWidget(RFViewerWidget):
 
   def tileViewSelectSliceVisible(self,Visible):
     #３Dビューへのスライス断面表示　割り込み制御
-    self.CrosshairNode = slicer.mrmlScene.GetFirstNodeByClass('vtkMRMLCrosshairNode')
-    
-    if Visible:
-      if self.CrosshairNode:
-        self.CrosshairNodeObserverTag = self.CrosshairNode.AddObserver(slicer.vtkMRMLCrosshairNode.CursorPositionModifiedEvent, self.sliceVisibleProcessEvent)
-    else:
+    #登録済みのObserverは削除してから登録（重複登録の防止）
+    if getattr(self, 'CrosshairNodeObserverTag', None) is not None:
       self.CrosshairNode.RemoveObserver(self.CrosshairNodeObserverTag)
+      self.CrosshairNodeObserverTag = None
+
+    self.CrosshairNode = slicer.mrmlScene.GetFirstNodeByClass('vtkMRMLCrosshairNode')
+    if Visible and self.CrosshairNode:
+      self.CrosshairNodeObserverTag = self.CrosshairNode.AddObserver(slicer.vtkMRMLCrosshairNode.CursorPositionModifiedEvent, self.sliceVisibleProcessEvent)
 
   def sliceVisibleProcessEvent(self, observee, event):
     #３Dビューへのスライス断面表示
@@ -661,21 +607,15 @@ class RFVisualizationWidget(RFViewerWidget):
     if self.CrosshairNode:
       sliceNode = self.CrosshairNode.GetCursorPositionXYZ(xyz)
 
-    slicer.compareWidgets = [slicer.app.layoutManager().sliceWidget('Compare' + str(i)) for i in range(1, 17)]
+    #監視中のタイルビューのスライスノードを使用（ビューの再取得は不要）
+    compareNodes = self._tileViewSynchronizer.sliceNodes
     if sliceNode:
-      sliceWidget = slicer.app.layoutManager().sliceWidget(sliceNode.GetName())
       self.tileViewSync(True)
-      for compareWidget in slicer.compareWidgets:
-        if sliceWidget != compareWidget:
-          compareNode = compareWidget.mrmlSliceNode()
-          compareNode.SetWidgetVisible(False)
-        else:
-          compareNode = compareWidget.mrmlSliceNode()
-          compareNode.SetWidgetVisible(True)
+      for compareNode in compareNodes:
+        compareNode.SetWidgetVisible(compareNode is sliceNode)
     else:
       self.tileViewSync(False)
-      for compareWidget in slicer.compareWidgets:
-        compareNode = compareWidget.mrmlSliceNode()
+      for compareNode in compareNodes:
         compareNode.SetWidgetVisible(False)
 
 
@@ -712,12 +652,7 @@ class RFVisualizationWidget(RFViewerWidget):
 
     #self.ui.sliceIntervalText.setText('{:.0f}'.str(interval) + " mm" )
     self.ui.sliceIntervalText.setText('{:.1f}'.format(interval) + " mm" )
-    offset = logic.GetSliceOffset()
-    for i in range(2, 17):
-      offset = offset + interval
-      compare = slicer.app.layoutManager().sliceWidget('Compare' + str(i))
-      logic = compare.sliceLogic()
-      logic.SetSliceOffset(offset)
+    self._tileViewLayout.setSliceOffsets(logic.GetSliceOffset(), interval)
     #self.tileViewSync(True)
 
   def onTileIntervalSelectorChanged(self):
@@ -732,18 +667,9 @@ class RFVisualizationWidget(RFViewerWidget):
     if self._isLoadingState:
       return
     self.tileViewSync(False)
-    compare = slicer.app.layoutManager().sliceWidget('Compare1')
-    logic = compare.sliceLogic()
     posOffset = self.ui.slicePositionSlider.value
-
-    logic.SetSliceOffset(posOffset)
-    offset = logic.GetSliceOffset()
     interval = self.ui.sliceIntervalSlider.value
-    for i in range(2, 17):
-      offset = offset + interval
-      compare = slicer.app.layoutManager().sliceWidget('Compare' + str(i))
-      logic = compare.sliceLogic()
-      logic.SetSliceOffset(offset)
+    self._tileViewLayout.setSliceOffsets(posOffset, interval)
     #self.tileViewSync(True)
 
 
@@ -783,16 +709,12 @@ class RFVisualizationWidget(RFViewerWidget):
     #連動用の割り込み処理許可
     self.ui.customMouseAction2D()#タイルビュー追加に伴い追加
     #３Dのマウス操作はウィジェット内で行っています。
-    self.tileViewSync(True)
+    self.tileViewSyncOn()
     self.tileViewSelectSliceVisible(True)
 
   def FOVset(self):
     #タイルビューのFOV設定
-    slicer.compareWidgets = [slicer.app.layoutManager().sliceWidget('Compare' + str(i)) for i in range(1, 17)]
-    for compareWidget in slicer.compareWidgets:
-      compareLogic = compareWidget.sliceLogic()
-      compareLogic.FitFOVToBackground(200)
-      compareLogic.Modified()
+    self._tileViewLayout.fitFieldOfView()
     
  
   #--- for cephalometric 20220924 koyanagi --- add
@@ -865,6 +787,14 @@ class RFVisualizationWidget(RFViewerWidget):
     self.ui.setMIPThickness(thickness)
   #-------------------------------------------
 
+  def onSlabCacheChanged(self):
+    if self._isLoadingState:
+      return
+    # Axis aligned views show precomputed slabs, oblique views compute the slab at each render
+    self.ui.slabViewManager.setEnabled(self.ui.slabCacheCheckBox.checked)
+    thickness = self.ui.slabThicknessSlider.value
+    self.ui.setMIPThickness(thickness)
+
   def setPreset3D(self, preset):
     if self._isLoadingState:
       self._currentPreset3D = preset
@@ -1017,6 +947,9 @@ class RFVisualizationWidget(RFViewerWidget):
     if self.ui.fractionCheckBox.checked:
     	self.ui.fractionCheckBox.setChecked(False)
     #----------------------------------------------------------
+    #断層厚キャッシュの画像はシーンに保存されない為、無効化してから保存
+    if self.ui.slabCacheCheckBox.checked:
+      self.ui.slabCacheCheckBox.setChecked(False)
     parameter = self.getParameterNode()
     parameter.SetParameter("VolumeNodeID", self.volumeNode.GetID())
     self.saveState()
@@ -1173,14 +1106,235 @@ class RFVisualizationWidget(RFViewerWidget):
     self.ui.slabThicknessSlider.setValue(self._NumberOfSlices_Setting[0])
     self.ui.setMIPThickness(self._NumberOfSlices_Setting[0])
     #print("_NumberOfSlices_Setting",self._NumberOfSlices_Setting[0])
-    
-
-
 
 
+class RFProgressiveVolumeRenderingTestCase(unittest.TestCase):
+  def test_volume_is_downsampled_by_the_mean_of_2x2x2_blocks_dropping_odd_last_voxels(self):
+    array = np.arange(5 * 4 * 7, dtype=np.int16).reshape(5, 4, 7)
+    downsampled = downsampleVolumeArray(array)
 
+    self.assertEqual((2, 2, 3), downsampled.shape)
+    self.assertEqual(np.int16, downsampled.dtype)
+    for k, j, i in np.ndindex(*downsampled.shape):
+      block = array[2 * k:2 * k + 2, 2 * j:2 * j + 2, 2 * i:2 * i + 2]
+      self.assertEqual(np.rint(block.mean()), downsampled[k, j, i])
 
+  def test_coarse_level_voxels_are_centered_on_their_source_blocks(self):
+    ijkToRASArray = np.array([[0.5, 0, 0, 10], [0, 0.4, 0, 20], [0, 0, 1.0, 30], [0, 0, 0, 1]])
+    array = np.zeros((8, 12, 16), dtype=np.float32)
 
+    # 1536 voxels, two levels are needed to go under 100 voxels
+    levelArray, levelIJKToRASArray = RFVolumePyramid.coarseLevel(array, ijkToRASArray, 100)
+    self.assertEqual((2, 3, 4), levelArray.shape)
+    for k, j, i in np.ndindex(*levelArray.shape):
+      block = np.array([[bi, bj, bk, 1] for bk, bj, bi in np.ndindex(4, 4, 4)]) + [4 * i, 4 * j, 4 * k, 0]
+      expectedCenter = np.dot(ijkToRASArray, block.T).mean(axis=1)
+      np.testing.assert_allclose(np.dot(levelIJKToRASArray, [i, j, k, 1]), expectedCenter)
 
+  def test_volume_under_the_voxel_limit_is_not_downsampled(self):
+    array = np.zeros((4, 4, 4), dtype=np.uint8)
+    levelArray, levelIJKToRASArray = RFVolumePyramid.coarseLevel(array, np.eye(4), 64)
+    self.assertIs(array, levelArray)
+    np.testing.assert_array_equal(np.eye(4), levelIJKToRASArray)
 
 
+class RFSlabCacheTestCase(unittest.TestCase):
+  @staticmethod
+  def bruteForceSlab(array, radius, axis, reduce):
+    array = np.moveaxis(array, axis, 0)
+    slab = np.stack([reduce(array[max(0, k - radius):k + radius + 1], axis=0) for k in range(array.shape[0])])
+    return np.moveaxis(slab, 0, axis)
+
+  def setUp(self):
+    self.array = np.random.RandomState(0).randint(-1000, 1000, (7, 5, 9)).astype(np.int16)
+
+  def test_sliding_window_extremum_matches_the_extremum_of_each_window(self):
+    for ufunc, reduce in ((np.maximum, np.max), (np.minimum, np.min)):
+      for array in (self.array, self.array.astype(np.float32)):
+        for axis in range(3):
+          # Windows larger than the axis are truncated at both borders
+          for radius in (0, 1, 2, 4, 10):
+            slab = slidingWindowExtremum(array, radius, axis, ufunc)
+            self.assertEqual(array.dtype, slab.dtype)
+            np.testing.assert_array_equal(self.bruteForceSlab(array, radius, axis, reduce), slab)
+
+  def test_sliding_window_mean_matches_the_mean_of_each_window(self):
+    for axis in range(3):
+      for radius in (0, 1, 2, 4, 10):
+        expected = self.bruteForceSlab(self.array.astype(np.float64), radius, axis, np.mean)
+        np.testing.assert_allclose(expected, slidingWindowMean(self.array.astype(np.float64), radius, axis))
+        np.testing.assert_array_equal(np.rint(expected), slidingWindowMean(self.array, radius, axis))
+
+  def test_sliding_window_writes_into_the_output_array(self):
+    out = np.empty_like(self.array)
+    self.assertIs(out, slidingWindowExtremum(self.array, 2, 1, np.maximum, out))
+    np.testing.assert_array_equal(self.bruteForceSlab(self.array, 2, 1, np.max), out)
+    self.assertIs(out, slidingWindowMean(self.array, 2, 1, out))
+    np.testing.assert_array_equal(np.rint(self.bruteForceSlab(self.array.astype(np.float64), 2, 1, np.mean)), out)
+
+
+class RFTileViewTestCase(unittest.TestCase):
+  @staticmethod
+  def tileViewTags(layoutDescription):
+    """Returns the singleton tags of the views of each row of the layout description"""
+    layout = ElementTree.fromstring(layoutDescription)
+    return [[view.get("singletontag") for view in row.iter("view")] for row in layout.findall("./item/layout")]
+
+  def test_tile_matrices_match_the_slice_node_offset_of_an_oblique_slice(self):
+    transform = vtk.vtkTransform()
+    transform.Translate(12, -30, 45)
+    transform.RotateX(30)
+    transform.RotateY(-20)
+    transform.RotateZ(15)
+    baseSliceToRAS = slicer.util.arrayFromVTKMatrix(transform.GetMatrix())
+
+    sliceOffsets = [-12.5, 0, 3, 40]
+    matrices = tileSliceToRASMatrices(baseSliceToRAS, sliceOffsets)
+    self.assertEqual((4, 4, 4), matrices.shape)
+    for sliceOffset, matrix in zip(sliceOffsets, matrices):
+      sliceNode = slicer.vtkMRMLSliceNode()
+      sliceNode.GetSliceToRAS().DeepCopy(transform.GetMatrix())
+      sliceNode.UpdateMatrices()
+      sliceNode.SetSliceOffset(sliceOffset)
+      np.testing.assert_allclose(slicer.util.arrayFromVTKMatrix(sliceNode.GetSliceToRAS()), matrix, atol=1e-9)
+      self.assertAlmostEqual(sliceOffset, sliceNode.GetSliceOffset())
+
+  def test_square_layouts_contain_the_tile_views_row_by_row(self):
+    for size in [2, 3, 4]:
+      layout = ElementTree.fromstring(tileLayoutDescription(size, size))
+      self.assertEqual("vertical", layout.get("type"))
+      self.assertEqual([["Compare{}".format(row * size + column + 1) for column in range(size)] for row in range(size)],
+                       self.tileViewTags(tileLayoutDescription(size, size)))
+
+  def test_non_square_layouts_contain_the_tile_views_row_by_row(self):
+    self.assertEqual([["Compare1", "Compare2", "Compare3"], ["Compare4", "Compare5", "Compare6"]],
+                     self.tileViewTags(tileLayoutDescription(2, 3)))
+    self.assertEqual([["Compare1"], ["Compare2"], ["Compare3"]], self.tileViewTags(tileLayoutDescription(3, 1)))
+    self.assertEqual([["Compare1", "Compare2", "Compare3", "Compare4"]], self.tileViewTags(tileLayoutDescription(1, 4)))
+
+
+class RFTileViewSynchronizerTestCase(unittest.TestCase):
+  class TileViewLayout(object):
+    def __init__(self, sliceNodes):
+      self._sliceNodes = sliceNodes
+
+    def sliceNodes(self):
+      return list(self._sliceNodes)
+
+  class CountingSynchronizer(RFTileViewSynchronizer):
+    synchronizeCount = 0
+
+    def synchronize(self, isDraft=False):
+      self.synchronizeCount += 1
+      RFTileViewSynchronizer.synchronize(self, isDraft)
+
+  def setUp(self):
+    self.sliceNodes = [slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSliceNode', 'TileSynchronizerTest{}'.format(i))
+                       for i in range(3)]
+    for sliceNode in self.sliceNodes:
+      sliceNode.SetFieldOfView(100, 80, 1)
+      sliceNode.SetXYZOrigin(0, 0, 0)
+
+    self.offsetChanges = []
+    self.synchronizer = self.CountingSynchronizer(
+      self.TileViewLayout(self.sliceNodes), lambda index, offset: self.offsetChanges.append((index, offset)))
+    self.synchronizer.start()
+
+  def tearDown(self):
+    self.synchronizer.stop()
+    for sliceNode in self.sliceNodes:
+      slicer.mrmlScene.RemoveNode(sliceNode)
+
+  def test_modifications_of_one_frame_are_synchronized_once(self):
+    sliceNode = self.sliceNodes[1]
+    sliceNode.SetFieldOfView(50, 40, 1)
+    sliceNode.SetXYZOrigin(5, -3, 0)
+    sliceNode.SetSliceOffset(12)
+    self.synchronizer._scheduler.flush()
+
+    self.assertEqual(1, self.synchronizer.synchronizeCount)
+    self.assertEqual([1], [index for index, _ in self.offsetChanges])
+    self.assertAlmostEqual(12, self.offsetChanges[0][1])
+    for sliceNode in self.sliceNodes:
+      self.assertEqual((50, 40, 1), tuple(sliceNode.GetFieldOfView()))
+      self.assertEqual((5, -3, 0), tuple(sliceNode.GetXYZOrigin()))
+
+  def test_modifications_done_by_the_synchronization_are_ignored(self):
+    self.sliceNodes[0].SetFieldOfView(50, 40, 1)
+    self.synchronizer._scheduler.flush()
+    self.assertFalse(self.synchronizer._scheduler.isPending)
+
+    # Modifications of properties which are not synchronized are ignored as well
+    self.sliceNodes[2].SetWidgetVisible(True)
+    self.assertFalse(self.synchronizer._scheduler.isPending)
+    self.assertEqual(1, self.synchronizer.synchronizeCount)
+
+  def test_slice_offset_changes_report_the_index_of_the_modified_view(self):
+    for index in [2, 0]:
+      self.sliceNodes[index].SetSliceOffset(10 * index + 5)
+      self.synchronizer._scheduler.flush()
+
+    self.assertEqual([2, 0], [index for index, _ in self.offsetChanges])
+    self.assertAlmostEqual(25, self.offsetChanges[0][1])
+    self.assertAlmostEqual(5, self.offsetChanges[1][1])
+
+  def test_stop_removes_every_observer(self):
+    observations = list(self.synchronizer._observerTags)
+    self.assertEqual(self.sliceNodes, [sliceNode for sliceNode, _ in observations])
+    self.synchronizer.stop()
+
+    for sliceNode, tag in observations:
+      self.assertIsNone(sliceNode.GetCommand(tag))
+    self.sliceNodes[0].SetFieldOfView(50, 40, 1)
+    self.assertFalse(self.synchronizer._scheduler.isPending)
+    self.assertEqual(0, self.synchronizer.synchronizeCount)
+
+
+class RFVolumeRenderingResourcesTestCase(unittest.TestCase):
+  class CountingVolumeRenderingLogic(object):
+    """Volume rendering logic counting the creations of the default volume rendering nodes"""
+
+    def __init__(self, vrLogic):
+      self._vrLogic = vrLogic
+      self.createCount = 0
+
+    def GetFirstVolumeRenderingDisplayNode(self, volumeNode):
+      return self._vrLogic.GetFirstVolumeRenderingDisplayNode(volumeNode)
+
+    def CreateDefaultVolumeRenderingNodes(self, volumeNode):
+      self.createCount += 1
+      return self._vrLogic.CreateDefaultVolumeRenderingNodes(volumeNode)
+
+  def setUp(self):
+    volumeName = slicer.mrmlScene.GetUniqueNameByString('VolumeRenderingResourcesTest')
+    slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(volumeName)
+    self.volumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', volumeName)
+    slicer.util.updateVolumeFromArray(self.volumeNode, np.zeros((4, 4, 4), dtype=np.uint8))
+    self.viewNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLViewNode')
+    self.viewNode.SetLayoutName('VolumeRenderingResourcesTest')
+
+  def tearDown(self):
+    for node in [self.volumeNode, self.viewNode]:
+      slicer.mrmlScene.RemoveNode(node)
+
+  def test_attaching_a_view_twice_creates_one_display_node_with_one_view(self):
+    vrLogic = self.CountingVolumeRenderingLogic(slicer.modules.volumerendering.logic())
+    resources = RFVolumeRenderingResources(vrLogic)
+
+    displayNode = resources.attachView(self.volumeNode, 'VolumeRenderingResourcesTest')
+    self.assertIs(displayNode, resources.attachView(self.volumeNode, 'VolumeRenderingResourcesTest'))
+
+    self.assertEqual(1, vrLogic.createCount)
+    displayNodes = [self.volumeNode.GetNthDisplayNode(i) for i in range(self.volumeNode.GetNumberOfDisplayNodes())]
+    self.assertEqual([displayNode], [node for node in displayNodes if node.IsA('vtkMRMLVolumeRenderingDisplayNode')])
+    self.assertEqual([self.viewNode.GetID()],
+                     [displayNode.GetNthViewNodeID(i) for i in range(displayNode.GetNumberOfViewNodeIDs())])
+
+
+class RFVisualizationTest(ScriptedLoadableModuleTest):
+  def runTest(self):
+    # Gather tests for the plugin and run them in a test suite
+    testCases = [RFProgressiveVolumeRenderingTestCase, RFSlabCacheTestCase, RFTileViewTestCase,
+                 RFTileViewSynchronizerTestCase, RFVolumeRenderingResourcesTestCase]
+    suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(case) for case in testCases])
+    unittest.TextTestRunner(verbosity=3).run(suite)
@@ -1,7 +1,9 @@
 from enum import IntEnum, unique, Enum
+import qt
 import slicer
 
-from RFViewerHomeLib import getViewBySingletonTag
+from RFViewerHomeLib import getViewBySingletonTag, strToBool
+from .RFTileView import tileLayoutDescription
 
 
 @unique
@@ -43,6 +45,35 @@ class ViewTag(Enum):
     return [ViewTag.PanoramaFront, ViewTag.PanoramaLateral]
 
 
+@unique
+class ThreeDViewTag(Enum):
+  """Layout names of the 3D views"""
+  Main = "1"
+  Second = "2"
+  Third = "3"
+  Tile = "Tile3DView"
+
+  @staticmethod
+  def layoutViewTags():
+    return [ThreeDViewTag.Main, ThreeDViewTag.Second, ThreeDViewTag.Third]
+
+
+def getThreeDViewByTag(tag):
+  """
+  Finds and return the first 3D view node with the given input layout name
+
+  :param tag: str or ThreeDViewTag - Layout name of the view to get
+  :return: vtkMRMLViewNode with the given input layout name if found else None
+  """
+  if isinstance(tag, Enum):
+    tag = tag.value
+
+  for viewNode in slicer.util.getNodesByClass("vtkMRMLViewNode"):
+    if viewNode.GetLayoutName() == tag:
+      return viewNode
+  return None
+
+
 def setNodeVisibleInMainViewsOnly(node):
   """
   Force input node display node to be visible in the Axial, Sagittal and Coronal views only
@@ -142,259 +173,9 @@ def layoutSetup(layoutManager):
   layoutManager.layoutLogic().GetLayoutNode().AddLayoutDescription(RFLayoutType.RFPanoramaLayout, panoramaLayout)
 
   """create Tile layout"""
-  tileLayout2x2 = """
-        <layout type=\"vertical\">
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare1\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R1</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare2\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R2</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare3\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R3</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare4\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R4</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-        </layout>
-"""
-
-  tileLayout3x3 = """
-        <layout type=\"vertical\">
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare1\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R1</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare2\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R2</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare3\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R3</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare4\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R4</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare5\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R5</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare6\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R6</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare7\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R7</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare8\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R8</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare9\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R9</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-        </layout>
-"""
-
-  tileLayout4x4 = """
-        <layout type=\"vertical\">
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare1\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R1</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare2\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R2</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare3\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R3</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare4\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R4</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare5\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R5</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare6\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R6</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare7\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R7</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare8\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R8</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare9\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R9</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare10\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R10</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare11\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R11</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare12\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R12</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-            <item>
-                <layout type=\"horizontal\">
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare13\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R13</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare14\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R14</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare15\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R15</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                    <item>
-                        <view class=\"vtkMRMLSliceNode\" singletontag=\"Compare16\">
-                            <property name=\"orientation\" action=\"default\">Axial</property>
-                            <property name=\"viewlabel\" action=\"default\">R16</property>
-                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
-                        </view>
-                    </item>
-                </layout>
-            </item>
-        </layout>
-"""
+  tileLayout2x2 = tileLayoutDescription(2, 2)
+  tileLayout3x3 = tileLayoutDescription(3, 3)
+  tileLayout4x4 = tileLayoutDescription(4, 4)
 
   layoutManager.layoutLogic().GetLayoutNode().AddLayoutDescription(RFLayoutType.RFTileLayout2x2, tileLayout2x2)
   layoutManager.layoutLogic().GetLayoutNode().AddLayoutDescription(RFLayoutType.RFTileLayout3x3, tileLayout3x3)
@@ -433,3 +214,20 @@ def showInMainViews(displayableNode):
   """ Do not show node (markup, volume, model...) in Panorama views (different coordinated system)"""
   for mainViewNodeID in getMainViewNodeIDs():
     displayableNode.GetDisplayNode().AddViewNodeID(mainViewNodeID)
+
+# Progressive volume rendering of the 3D views, by view layout name : a downsampled volume is rendered while the camera
+# moves and the full resolution volume once idle. Opt-in through the Visualization/ProgressiveVolumeRendering setting.
+progressiveVolumeRenderingViews = {
+  ThreeDViewTag.Main.value: True,
+  ThreeDViewTag.Tile.value: True,
+}
+
+def isProgressiveVolumeRenderingEnabled():
+  return strToBool(qt.QSettings().value("Visualization/ProgressiveVolumeRendering", False))
+
+def isProgressiveVolumeRenderingView(viewNode):
+  """Returns True if progressive volume rendering is enabled and configured for the 3D view"""
+  return isProgressiveVolumeRenderingEnabled() and progressiveVolumeRenderingViews.get(viewNode.GetLayoutName(), False)
+
+def setProgressiveVolumeRenderingView(viewLayoutName, isProgressive):
+  progressiveVolumeRenderingViews[viewLayoutName] = isProgressive
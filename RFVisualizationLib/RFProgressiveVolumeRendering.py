@@ -0,0 +1,281 @@
+import numpy as np
+import qt
+import slicer
+import vtk
+
+from .RFLayout import isProgressiveVolumeRenderingView
+from .RFVisualizationUtils import getAll3DViewNodes
+
+
+def downsampleVolumeArray(array):
+  """Returns the mean of the 2x2x2 voxel blocks of the KJI array. Odd last voxels are dropped."""
+  k, j, i = (dimension // 2 for dimension in array.shape)
+  blocks = array[:2 * k, :2 * j, :2 * i].reshape(k, 2, j, 2, i, 2)
+  mean = blocks.mean(axis=(1, 3, 5), dtype=np.float32)
+  if np.issubdtype(array.dtype, np.integer):
+    mean = np.rint(mean)
+  return mean.astype(array.dtype)
+
+
+class RFVolumePyramid(object):
+  """
+  Downsampled copy of a volume, for its fast rendering during interactions.
+
+  The volume is halved by 2x2x2 block means until its number of voxels is below maximumNumberOfVoxels. Only the
+  coarsest level is kept as a volume node, with the geometry and parent transform of the volume. The level volume node
+  is not saved with the scene and its name is ignored by the data loader : it never becomes the current volume.
+  """
+
+  def __init__(self, maximumNumberOfVoxels=192 ** 3):
+    self.maximumNumberOfVoxels = maximumNumberOfVoxels
+    self.volumeNode = None
+    self.levelVolumeNode = None
+    self._key = None
+
+  def clear(self):
+    if self.levelVolumeNode is not None and slicer.mrmlScene.IsNodePresent(self.levelVolumeNode):
+      slicer.mrmlScene.RemoveNode(self.levelVolumeNode)
+    self.levelVolumeNode = None
+    self._key = None
+
+  def isDownsampled(self, volumeNode):
+    """Returns True if the volume is over the voxel limit, and thus has a coarse level"""
+    imageData = volumeNode.GetImageData() if volumeNode is not None else None
+    if imageData is None:
+      return False
+    dimensions = imageData.GetDimensions()
+    return dimensions[0] * dimensions[1] * dimensions[2] > self.maximumNumberOfVoxels and min(dimensions) >= 2
+
+  def coarseVolumeNode(self, volumeNode):
+    """Returns the coarsest level of volumeNode, built again if the volume changed. None if not downsampled."""
+    if not self.isDownsampled(volumeNode):
+      self.clear()
+      return None
+
+    key = (volumeNode.GetID(), volumeNode.GetImageData().GetMTime())
+    if key != self._key or not slicer.mrmlScene.IsNodePresent(self.levelVolumeNode):
+      self.build(volumeNode)
+      self._key = key
+    return self.levelVolumeNode
+
+  @staticmethod
+  def coarseLevel(array, ijkToRASArray, maximumNumberOfVoxels):
+    """Returns the downsampled KJI array and its IJK to RAS matrix, as numpy arrays"""
+    while array.size > maximumNumberOfVoxels and min(array.shape) >= 2:
+      array = downsampleVolumeArray(array)
+      # Voxel (0, 0, 0) of the level is the center of the first 2x2x2 block
+      ijkToRASArray = np.dot(ijkToRASArray, np.array([[2, 0, 0, 0.5], [0, 2, 0, 0.5], [0, 0, 2, 0.5], [0, 0, 0, 1]]))
+    return array, ijkToRASArray
+
+  def build(self, volumeNode):
+    self.clear()
+    self.volumeNode = volumeNode
+
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASMatrix(ijkToRAS)
+    array, ijkToRASArray = self.coarseLevel(slicer.util.arrayFromVolume(volumeNode),
+                                            slicer.util.arrayFromVTKMatrix(ijkToRAS), self.maximumNumberOfVoxels)
+    self.levelVolumeNode = self._createLevelVolumeNode(volumeNode, array, ijkToRASArray)
+
+  @staticmethod
+  def _createLevelVolumeNode(volumeNode, array, ijkToRASArray):
+    # Named before being added, the data loader would otherwise replace the current volume by the level
+    levelName = slicer.mrmlScene.GetUniqueNameByString(volumeNode.GetName() + '_Pyramid')
+    slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(levelName)
+    levelVolumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', levelName)
+    levelVolumeNode.SetHideFromEditors(True)
+    levelVolumeNode.SetSelectable(False)
+    levelVolumeNode.SetSaveWithScene(False)
+    levelVolumeNode.SetIJKToRASMatrix(slicer.util.vtkMatrixFromArray(ijkToRASArray))
+    slicer.util.updateVolumeFromArray(levelVolumeNode, array)
+    levelVolumeNode.SetAndObserveTransformNodeID(volumeNode.GetTransformNodeID())
+    return levelVolumeNode
+
+
+class RFProgressiveVolumeRendering(object):
+  """
+  Renders the volume at a coarse resolution in the progressive 3D views while their camera moves, and at full resolution
+  once idle.
+
+  Progressive views are configured per view in RFLayout (isProgressiveVolumeRenderingView), volumes under the voxel
+  limit of the pyramid are always rendered at full resolution. Each progressive view has a
+  coarse volume rendering display node of the pyramid coarsest level, sharing the volume property and ROI of the full
+  resolution display node, only visible in this view. During the interaction, the view is removed from the full
+  resolution display nodes and the coarse display node is shown instead : the volume rendering pipelines of the views
+  are kept, only their visibility changes.
+
+  Usage example :
+    progressiveVR = RFProgressiveVolumeRendering()
+    progressiveVR.setVolumeNode(volumeNode)
+    progressiveVR.updateViews()  # after 3D views were added
+  """
+
+  def __init__(self, idleDelayMs=300, pyramid=None):
+    self.idleDelayMs = idleDelayMs
+    self.pyramid = pyramid if pyramid is not None else RFVolumePyramid()
+    self.volumeNode = None
+    # Progressive view states by view node ID
+    self._views = {}
+
+  def __del__(self):
+    self.setVolumeNode(None)
+
+  def setVolumeNode(self, volumeNode):
+    for viewNodeID in list(self._views.keys()):
+      self._detachView(viewNodeID)
+    self.pyramid.clear()
+    self.volumeNode = volumeNode
+    self.updateViews()
+
+  def updateViews(self):
+    """Attaches the 3D views configured as progressive and detaches the others"""
+    viewNodes = getAll3DViewNodes() if self.pyramid.isDownsampled(self.volumeNode) else []
+    progressiveViewNodeIDs = [viewNode.GetID() for viewNode in viewNodes if isProgressiveVolumeRenderingView(viewNode)]
+    for viewNodeID in list(self._views.keys()):
+      if viewNodeID not in progressiveViewNodeIDs:
+        self._detachView(viewNodeID)
+
+    for viewNode in viewNodes:
+      if viewNode.GetID() in progressiveViewNodeIDs and viewNode.GetID() not in self._views:
+        self._attachView(viewNode)
+
+    if self._views:
+      # The pyramid is built once, before the first interaction
+      self.pyramid.coarseVolumeNode(self.volumeNode)
+
+  def fullResolutionDisplayNodes(self):
+    if self.volumeNode is None:
+      return []
+    displayNodes = [self.volumeNode.GetNthDisplayNode(i) for i in range(self.volumeNode.GetNumberOfDisplayNodes())]
+    return [displayNode for displayNode in displayNodes
+            if displayNode is not None and displayNode.IsA('vtkMRMLVolumeRenderingDisplayNode')]
+
+  def isInteracting(self, viewNode):
+    view = self._views.get(viewNode.GetID())
+    return view is not None and view["hiddenDisplayNodes"] is not None
+
+  def _attachView(self, viewNode):
+    cameraNode = slicer.modules.cameras.logic().GetViewActiveCameraNode(viewNode)
+    if cameraNode is None:
+      return
+
+    viewNodeID = viewNode.GetID()
+    idleTimer = qt.QTimer()
+    idleTimer.singleShot = True
+    idleTimer.interval = self.idleDelayMs
+    idleTimer.connect("timeout()", lambda: self._onIdle(viewNodeID))
+    tag = cameraNode.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda *args: self._onCameraModified(viewNodeID))
+    self._views[viewNodeID] = {
+      "viewNode": viewNode,
+      "cameraObservation": (cameraNode, tag),
+      "idleTimer": idleTimer,
+      "coarseDisplayNode": None,
+      # Full resolution display nodes hidden in the view during the interaction, None when idle
+      "hiddenDisplayNodes": None,
+    }
+
+  def _detachView(self, viewNodeID):
+    view = self._views.get(viewNodeID)
+    if view is None:
+      return
+
+    view["idleTimer"].stop()
+    self._showFullResolution(view)
+    cameraNode, tag = view["cameraObservation"]
+    cameraNode.RemoveObserver(tag)
+    coarseDisplayNode = view["coarseDisplayNode"]
+    if coarseDisplayNode is not None and slicer.mrmlScene.IsNodePresent(coarseDisplayNode):
+      slicer.mrmlScene.RemoveNode(coarseDisplayNode)
+    del self._views[viewNodeID]
+
+  def _onCameraModified(self, viewNodeID):
+    view = self._views.get(viewNodeID)
+    if view is None:
+      return
+
+    view["idleTimer"].start()
+    if view["hiddenDisplayNodes"] is None:
+      self._showCoarseResolution(view)
+
+  def _onIdle(self, viewNodeID):
+    view = self._views.get(viewNodeID)
+    if view is None:
+      return
+
+    if qt.QApplication.mouseButtons() != qt.Qt.NoButton:
+      # Camera still grabbed, the full resolution is rendered once released
+      view["idleTimer"].start()
+      return
+    self._showFullResolution(view)
+
+  def _showCoarseResolution(self, view):
+    viewNodeID = view["viewNode"].GetID()
+    fullResolutionDisplayNodes = [displayNode for displayNode in self.fullResolutionDisplayNodes()
+                                  if displayNode.GetVisibility() and displayNode.IsDisplayableInView(viewNodeID)]
+    if not fullResolutionDisplayNodes:
+      return
+
+    coarseDisplayNode = self._getOrCreateCoarseDisplayNode(view, fullResolutionDisplayNodes[0])
+    if coarseDisplayNode is None:
+      return
+
+    view["hiddenDisplayNodes"] = []
+    for displayNode in fullResolutionDisplayNodes:
+      view["hiddenDisplayNodes"].append((displayNode, self._hideInView(displayNode, viewNodeID)))
+    coarseDisplayNode.SetVisibility(True)
+
+  def _showFullResolution(self, view):
+    if view["hiddenDisplayNodes"] is None:
+      return
+
+    viewNodeID = view["viewNode"].GetID()
+    for displayNode, isVisibilityHidden in view["hiddenDisplayNodes"]:
+      if not slicer.mrmlScene.IsNodePresent(displayNode):
+        continue
+      if isVisibilityHidden:
+        displayNode.SetVisibility(True)
+      else:
+        displayNode.AddViewNodeID(viewNodeID)
+    view["hiddenDisplayNodes"] = None
+
+    coarseDisplayNode = view["coarseDisplayNode"]
+    if coarseDisplayNode is not None and slicer.mrmlScene.IsNodePresent(coarseDisplayNode):
+      coarseDisplayNode.SetVisibility(False)
+
+  @staticmethod
+  def _hideInView(displayNode, viewNodeID):
+    """Removes the view from the display node views. Returns True if the display node had to be hidden instead."""
+    viewNodeIDs = [displayNode.GetNthViewNodeID(i) for i in range(displayNode.GetNumberOfViewNodeIDs())]
+    if not viewNodeIDs:
+      # No view node IDs means all the views
+      viewNodeIDs = [viewNode.GetID() for viewNode in getAll3DViewNodes()]
+
+    remainingViewNodeIDs = [nodeID for nodeID in viewNodeIDs if nodeID != viewNodeID]
+    if not remainingViewNodeIDs:
+      displayNode.SetVisibility(False)
+      return True
+
+    displayNode.SetViewNodeIDs(remainingViewNodeIDs)
+    return False
+
+  def _getOrCreateCoarseDisplayNode(self, view, fullResolutionDisplayNode):
+    coarseVolumeNode = self.pyramid.coarseVolumeNode(self.volumeNode)
+    if coarseVolumeNode is None:
+      return None
+
+    coarseDisplayNode = view["coarseDisplayNode"]
+    if coarseDisplayNode is None or not slicer.mrmlScene.IsNodePresent(coarseDisplayNode) or \
+        coarseDisplayNode.GetDisplayableNode() != coarseVolumeNode:
+      coarseDisplayNode = slicer.mrmlScene.AddNewNodeByClass(fullResolutionDisplayNode.GetClassName())
+      coarseDisplayNode.SetSaveWithScene(False)
+      coarseDisplayNode.SetHideFromEditors(True)
+      coarseDisplayNode.SetVisibility(False)
+      coarseDisplayNode.SetViewNodeIDs([view["viewNode"].GetID()])
+      coarseVolumeNode.AddAndObserveDisplayNodeID(coarseDisplayNode.GetID())
+      view["coarseDisplayNode"] = coarseDisplayNode
+
+    # Colors, opacities and cropping follow the full resolution rendering
+    coarseDisplayNode.SetAndObserveVolumePropertyNodeID(fullResolutionDisplayNode.GetVolumePropertyNodeID())
+    coarseDisplayNode.SetAndObserveROINodeID(fullResolutionDisplayNode.GetROINodeID())
+    coarseDisplayNode.SetCroppingEnabled(fullResolutionDisplayNode.GetCroppingEnabled())
+    return coarseDisplayNode
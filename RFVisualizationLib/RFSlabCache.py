@@ -0,0 +1,390 @@
+from collections import OrderedDict
+
+import numpy as np
+import slicer
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+from RFViewerHomeLib import UpdateScheduler
+
+
+def _chunkSlices(array, axisLength, maximumChunkSize=2 ** 25):
+  """Yields slices along the second axis of array, each chunk holding about maximumChunkSize elements"""
+  if array.ndim < 2:
+    yield slice(None)
+    return
+
+  elementsPerIndex = max(1, axisLength * int(np.prod(array.shape[2:])))
+  chunkLength = max(1, maximumChunkSize // elementsPerIndex)
+  for start in range(0, array.shape[1], chunkLength):
+    yield slice(start, start + chunkLength)
+
+
+def slidingWindowExtremum(array, radius, axis, ufunc=np.maximum, out=None):
+  """
+  Returns the extremum (ufunc is np.maximum or np.minimum) of array over the windows [k - radius, k + radius] along axis,
+  truncated at the array borders.
+
+  Running extremum stacks are computed within blocks of the window size (van Herk / Gil-Werman) : each output value is
+  the extremum of one suffix and one prefix value, whatever the window size.
+  """
+  out = np.empty_like(array) if out is None else out
+  if radius < 1:
+    out[...] = array
+    return out
+
+  array = np.moveaxis(array, axis, 0)
+  outputArray = np.moveaxis(out, axis, 0)
+  length = array.shape[0]
+  window = 2 * radius + 1
+  numberOfBlocks = -(-(length + 2 * radius) // window)
+  paddedLength = numberOfBlocks * window
+  limits = np.iinfo(array.dtype) if np.issubdtype(array.dtype, np.integer) else np.finfo(array.dtype)
+  identity = limits.min if ufunc is np.maximum else limits.max
+
+  for chunk in _chunkSlices(array, paddedLength):
+    chunkArray = array[:, chunk]
+    padded = np.full((paddedLength,) + chunkArray.shape[1:], identity, dtype=array.dtype)
+    padded[radius:radius + length] = chunkArray
+    blocks = padded.reshape((numberOfBlocks, window) + chunkArray.shape[1:])
+    prefix = ufunc.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    ufunc(suffix[:length], prefix[window - 1:window - 1 + length], out=outputArray[:, chunk])
+  return out
+
+
+def slidingWindowMean(array, radius, axis, out=None):
+  """
+  Returns the mean of array over the windows [k - radius, k + radius] along axis, truncated at the array borders.
+  Window sums are differences of the cumulative sum along axis.
+  """
+  out = np.empty_like(array) if out is None else out
+  if radius < 1:
+    out[...] = array
+    return out
+
+  array = np.moveaxis(array, axis, 0)
+  outputArray = np.moveaxis(out, axis, 0)
+  length = array.shape[0]
+  indices = np.arange(length)
+  upper = np.minimum(indices + radius + 1, length)
+  lower = np.maximum(indices - radius, 0)
+  counts = (upper - lower).reshape((length,) + (1,) * (array.ndim - 1))
+
+  for chunk in _chunkSlices(array, length + 1):
+    chunkArray = array[:, chunk]
+    cumulativeSum = np.zeros((length + 1,) + chunkArray.shape[1:], dtype=np.float64)
+    np.cumsum(chunkArray, axis=0, out=cumulativeSum[1:])
+    mean = (cumulativeSum[upper] - cumulativeSum[lower]) / counts
+    if np.issubdtype(out.dtype, np.integer):
+      mean = np.rint(mean)
+    outputArray[:, chunk] = mean
+  return out
+
+
+def alignedVolumeAxis(sliceNode, volumeNode, tolerance=1e-4):
+  """
+  Returns the IJK axis of volumeNode along the slice normal of sliceNode, or None if the slice is oblique or the volume
+  is under a non linear transform.
+  """
+  ijkToRAS = vtk.vtkMatrix4x4()
+  volumeNode.GetIJKToRASMatrix(ijkToRAS)
+  ijkToWorldArray = slicer.util.arrayFromVTKMatrix(ijkToRAS)
+
+  parentTransformNode = volumeNode.GetParentTransformNode()
+  if parentTransformNode is not None:
+    if not parentTransformNode.IsTransformToWorldLinear():
+      return None
+    parentToWorld = vtk.vtkMatrix4x4()
+    parentTransformNode.GetMatrixTransformToWorld(parentToWorld)
+    ijkToWorldArray = np.dot(slicer.util.arrayFromVTKMatrix(parentToWorld), ijkToWorldArray)
+
+  directions = ijkToWorldArray[:3, :3] / np.linalg.norm(ijkToWorldArray[:3, :3], axis=0)
+  normal = slicer.util.arrayFromVTKMatrix(sliceNode.GetSliceToRAS())[:3, 2]
+  cosines = np.abs(np.dot(normal / np.linalg.norm(normal), directions))
+  axis = int(np.argmax(cosines))
+  return axis if cosines[axis] > 1.0 - tolerance else None
+
+
+class RFSlabCache(object):
+  """
+  Least recently used cache of slab images, by volume, IJK axis, slab mode and radius.
+
+  A slab image has the geometry of its volume : its voxel k along the axis is the minimum, maximum or mean of the volume
+  voxels k - radius to k + radius. Axis aligned slice views showing the slab image get the slab with a single reslice,
+  instead of reslicing and combining all the slab slices at each render.
+  """
+
+  slabFunctions = {
+    vtk.VTK_IMAGE_SLAB_MIN: lambda a, r, axis, out: slidingWindowExtremum(a, r, axis, np.minimum, out),
+    vtk.VTK_IMAGE_SLAB_MAX: lambda a, r, axis, out: slidingWindowExtremum(a, r, axis, np.maximum, out),
+    vtk.VTK_IMAGE_SLAB_MEAN: lambda a, r, axis, out: slidingWindowMean(a, r, axis, out),
+  }
+
+  def __init__(self, maximumNumberOfSlabs=3):
+    self.maximumNumberOfSlabs = maximumNumberOfSlabs
+    self._slabs = OrderedDict()
+
+  def clear(self):
+    self._slabs.clear()
+
+  @classmethod
+  def isModeSupported(cls, mode):
+    return mode in cls.slabFunctions
+
+  def slabImageData(self, volumeNode, axis, mode, radius):
+    """Returns the vtkImageData of the slab of volumeNode along the IJK axis, computed if not in the cache"""
+    imageData = volumeNode.GetImageData()
+    key = (volumeNode.GetID(), imageData.GetMTime(), axis, mode, radius)
+    if key in self._slabs:
+      self._slabs.move_to_end(key)
+      return self._slabs[key]
+
+    slabImageData = vtk.vtkImageData()
+    slabImageData.SetDimensions(imageData.GetDimensions())
+    slabImageData.AllocateScalars(imageData.GetScalarType(), 1)
+    volumeArray = slicer.util.arrayFromVolume(volumeNode)
+    slabArray = vtk_to_numpy(slabImageData.GetPointData().GetScalars()).reshape(volumeArray.shape)
+    # Volume arrays are indexed KJI
+    self.slabFunctions[mode](volumeArray, radius, 2 - axis, slabArray)
+
+    self._slabs[key] = slabImageData
+    while len(self._slabs) > self.maximumNumberOfSlabs:
+      self._slabs.popitem(last=False)
+    return slabImageData
+
+
+class RFSlabViewManager(object):
+  """
+  Applies the slab settings to the slice views, using the precomputed slabs of RFSlabCache when enabled.
+
+  When the cache is enabled, the slice views showing the volume with an axis aligned orientation show the slab volume of
+  their axis as foreground, and their own slab is disabled. Oblique views keep the slab computed at each render.
+  Slab settings changed while interacting (thickness slider dragged) are applied without the cache, which is computed
+  once the interaction ends.
+
+  Usage example :
+    manager = RFSlabViewManager()
+    manager.setVolumeNode(volumeNode)
+    manager.setEnabled(True)
+    manager.setSlab(vtk.VTK_IMAGE_SLAB_MAX, numberOfSlices, mipThickness, slabThickness)
+  """
+
+  def __init__(self, slabCache=None):
+    self.slabCache = slabCache if slabCache is not None else RFSlabCache()
+    self.volumeNode = None
+    self.mode = vtk.VTK_IMAGE_SLAB_MAX
+    self.numberOfSlices = 1
+    self.mipThickness = 0
+    self.slabThickness = 0
+    self._isEnabled = False
+    self._isUpdating = False
+    self._slabVolumeNodes = {}
+    self._volumeDisplayObservation = None
+    # (node, observer tag) of the observed slice and slice composite nodes, by slice node ID
+    self._viewObservations = {}
+    self._scheduler = UpdateScheduler(self.updateViews)
+
+  def __del__(self):
+    self.setEnabled(False)
+
+  @property
+  def isEnabled(self):
+    return self._isEnabled
+
+  @property
+  def radius(self):
+    """
+    Slab radius in voxels, the cached slabs are 2 * radius + 1 voxels thick.
+
+    The views computing the slab sample slabThickness + 1 slices over slabThickness voxels. For odd thicknesses these
+    slices fall halfway between voxels : the radius is rounded up so that the cached slab covers every voxel they
+    interpolate, one voxel thicker than the views.
+    """
+    return max(0, (int(self.slabThickness) + 1) // 2)
+
+  def setEnabled(self, isEnabled):
+    if isEnabled == self._isEnabled:
+      return
+
+    self._isEnabled = isEnabled
+    if isEnabled:
+      self.updateViews()
+      return
+
+    self._scheduler.cancel()
+    self._removeObservers()
+    self.updateViews()
+    self._removeSlabVolumeNodes()
+    self.slabCache.clear()
+
+  def setVolumeNode(self, volumeNode):
+    if volumeNode == self.volumeNode:
+      return
+
+    if self._volumeDisplayObservation is not None:
+      displayNode, tag = self._volumeDisplayObservation
+      displayNode.RemoveObserver(tag)
+      self._volumeDisplayObservation = None
+
+    self.volumeNode = volumeNode
+    self.slabCache.clear()
+    if self._isEnabled:
+      self.updateViews()
+
+  def setSlab(self, mode, numberOfSlices, mipThickness, slabThickness):
+    """
+    Sets the slab of all the slice views.
+    :param numberOfSlices: number of slab slices of the views computing the slab
+    :param mipThickness: slab thickness in mm
+    :param slabThickness: slab thickness in voxels, used by the cached slabs
+    """
+    self.mode = mode
+    self.numberOfSlices = numberOfSlices
+    self.mipThickness = mipThickness
+    self.slabThickness = slabThickness
+    if self._isEnabled:
+      self._scheduler.requestUpdate()
+    else:
+      self.updateViews()
+
+  def updateViews(self, isDraft=False):
+    """Applies the slab settings to the slice views. Draft updates do not use the cache."""
+    self._isUpdating = True
+    try:
+      for sliceNode in slicer.util.getNodesByClass('vtkMRMLSliceNode'):
+        self._updateView(sliceNode, useCache=self._isEnabled and not isDraft)
+    finally:
+      self._isUpdating = False
+
+  def _updateView(self, sliceNode, useCache):
+    compositeNode = slicer.app.applicationLogic().GetSliceLogic(sliceNode).GetSliceCompositeNode()
+    if useCache:
+      self._observeView(sliceNode, compositeNode)
+
+    slabAxis = self._slabAxis(sliceNode, compositeNode) if useCache else None
+    if slabAxis is not None:
+      slabVolumeNode = self._updateSlabVolumeNode(slabAxis)
+      compositeNode.SetForegroundVolumeID(slabVolumeNode.GetID())
+      compositeNode.SetForegroundOpacity(1.0)
+      sliceNode.SetSlabMode(self.mode)
+      sliceNode.SetSlabNumberOfSlices(1)
+    else:
+      if self._shownSlabAxis(compositeNode) is not None:
+        compositeNode.SetForegroundVolumeID(None)
+      sliceNode.SetSlabMode(self.mode)
+      sliceNode.SetSlabNumberOfSlices(int(self.numberOfSlices))
+    sliceNode.SetMipThickness(int(self.mipThickness))
+    sliceNode.Modified()
+
+  def _slabAxis(self, sliceNode, compositeNode):
+    """Returns the IJK axis of the cached slab to show in the slice view, None if the slab is computed by the view"""
+    if self.volumeNode is None or compositeNode.GetBackgroundVolumeID() != self.volumeNode.GetID():
+      return None
+    if not self.slabCache.isModeSupported(self.mode) or self.radius < 1 or self.volumeNode.GetImageData() is None:
+      return None
+    return alignedVolumeAxis(sliceNode, self.volumeNode)
+
+  def _shownSlabAxis(self, compositeNode):
+    """Returns the IJK axis of the slab volume shown in the slice view, None if no slab volume is shown"""
+    foregroundVolumeID = compositeNode.GetForegroundVolumeID()
+    for axis, slabVolumeNode in self._slabVolumeNodes.items():
+      if foregroundVolumeID is not None and slabVolumeNode.GetID() == foregroundVolumeID:
+        return axis
+    return None
+
+  def _updateSlabVolumeNode(self, axis):
+    slabImageData = self.slabCache.slabImageData(self.volumeNode, axis, self.mode, self.radius)
+    slabVolumeNode = self._getOrCreateSlabVolumeNode(axis)
+    if slabVolumeNode.GetImageData() is not slabImageData:
+      slabVolumeNode.SetAndObserveImageData(slabImageData)
+    slabVolumeNode.CopyOrientation(self.volumeNode)
+    slabVolumeNode.SetAndObserveTransformNodeID(self.volumeNode.GetTransformNodeID())
+    self._observeVolumeDisplay()
+    return slabVolumeNode
+
+  def _getOrCreateSlabVolumeNode(self, axis):
+    slabVolumeNode = self._slabVolumeNodes.get(axis)
+    if slabVolumeNode is not None and slicer.mrmlScene.IsNodePresent(slabVolumeNode):
+      return slabVolumeNode
+
+    # The data loader would otherwise make the slab volume the current volume
+    slabVolumeName = slicer.mrmlScene.GetUniqueNameByString('SlabVolume')
+    slicer.modules.RFViewerHomeWidget.getDataLoader().addIgnoredVolumeName(slabVolumeName)
+    slabVolumeNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeNode', slabVolumeName)
+    slabVolumeNode.SetHideFromEditors(True)
+    slabVolumeNode.SetSelectable(False)
+    slabVolumeNode.SetSaveWithScene(False)
+    displayNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLScalarVolumeDisplayNode')
+    displayNode.SetSaveWithScene(False)
+    slabVolumeNode.SetAndObserveDisplayNodeID(displayNode.GetID())
+    self._slabVolumeNodes[axis] = slabVolumeNode
+    self._copyVolumeDisplay()
+    return slabVolumeNode
+
+  def _removeSlabVolumeNodes(self):
+    for slabVolumeNode in self._slabVolumeNodes.values():
+      if slicer.mrmlScene.IsNodePresent(slabVolumeNode):
+        slicer.mrmlScene.RemoveNode(slabVolumeNode.GetDisplayNode())
+        slicer.mrmlScene.RemoveNode(slabVolumeNode)
+    self._slabVolumeNodes = {}
+
+  def _observeVolumeDisplay(self):
+    """The slab volumes follow the window level and color of the volume"""
+    displayNode = self.volumeNode.GetDisplayNode() if self.volumeNode is not None else None
+    if displayNode is None or self._volumeDisplayObservation is not None:
+      return
+    tag = displayNode.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda *args: self._copyVolumeDisplay())
+    self._volumeDisplayObservation = (displayNode, tag)
+    self._copyVolumeDisplay()
+
+  def _copyVolumeDisplay(self):
+    volumeDisplayNode = self.volumeNode.GetDisplayNode() if self.volumeNode is not None else None
+    if volumeDisplayNode is None:
+      return
+
+    for slabVolumeNode in self._slabVolumeNodes.values():
+      slabDisplayNode = slabVolumeNode.GetDisplayNode()
+      if slabDisplayNode is None:
+        continue
+      wasModifying = slabDisplayNode.StartModify()
+      slabDisplayNode.SetAutoWindowLevel(False)
+      slabDisplayNode.SetWindowLevel(volumeDisplayNode.GetWindow(), volumeDisplayNode.GetLevel())
+      slabDisplayNode.SetAndObserveColorNodeID(volumeDisplayNode.GetColorNodeID())
+      slabDisplayNode.SetInterpolate(volumeDisplayNode.GetInterpolate())
+      slabDisplayNode.EndModify(wasModifying)
+
+  def _observeView(self, sliceNode, compositeNode):
+    """Views are updated when their orientation or background volume changes"""
+    if sliceNode.GetID() in self._viewObservations:
+      return
+
+    onViewModified = lambda caller, event, sliceNode=sliceNode: self._onViewModified(sliceNode)
+    self._viewObservations[sliceNode.GetID()] = [
+      (node, node.AddObserver(vtk.vtkCommand.ModifiedEvent, onViewModified)) for node in (sliceNode, compositeNode)]
+
+  def _onViewModified(self, sliceNode):
+    if self._isUpdating or not self._isEnabled or self._scheduler.isPending:
+      return
+
+    # Only the views whose orientation or background volume changed the slab to show are updated
+    compositeNode = slicer.app.applicationLogic().GetSliceLogic(sliceNode).GetSliceCompositeNode()
+    if self._slabAxis(sliceNode, compositeNode) == self._shownSlabAxis(compositeNode):
+      return
+
+    self._isUpdating = True
+    try:
+      self._updateView(sliceNode, useCache=True)
+    finally:
+      self._isUpdating = False
+
+  def _removeObservers(self):
+    for observations in self._viewObservations.values():
+      for node, tag in observations:
+        node.RemoveObserver(tag)
+    self._viewObservations = {}
+
+    if self._volumeDisplayObservation is not None:
+      displayNode, tag = self._volumeDisplayObservation
+      displayNode.RemoveObserver(tag)
+      self._volumeDisplayObservation = None
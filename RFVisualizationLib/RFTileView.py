@@ -0,0 +1,309 @@
+import numpy as np
+import slicer
+import vtk
+
+from RFViewerHomeLib import getViewBySingletonTag, UpdateScheduler
+
+
+def tileViewTag(index):
+  """Returns the singleton tag of the index-th tile view (starting at 1)"""
+  return 'Compare{}'.format(index)
+
+
+def tileLayoutDescription(numberOfRows, numberOfColumns):
+  """
+  Returns the layout description of a numberOfRows x numberOfColumns grid of tile slice views.
+  Views are tagged Compare1 to CompareN row by row.
+  """
+  viewItem = """
+                    <item>
+                        <view class=\"vtkMRMLSliceNode\" singletontag=\"{tag}\">
+                            <property name=\"orientation\" action=\"default\">Axial</property>
+                            <property name=\"viewlabel\" action=\"default\">R{index}</property>
+                            <property name=\"viewcolor\" action=\"default\">#f9a99f</property>
+                        </view>
+                    </item>"""
+  rowItem = """
+            <item>
+                <layout type=\"horizontal\">{views}
+                </layout>
+            </item>"""
+
+  rows = []
+  for row in range(numberOfRows):
+    indices = range(row * numberOfColumns + 1, (row + 1) * numberOfColumns + 1)
+    rows.append(rowItem.format(views="".join(viewItem.format(tag=tileViewTag(i), index=i) for i in indices)))
+  return """
+        <layout type=\"vertical\">{rows}
+        </layout>
+""".format(rows="".join(rows))
+
+
+def tileSliceToRASMatrices(baseSliceToRAS, sliceOffsets):
+  """
+  Returns the (len(sliceOffsets), 4, 4) slice to RAS matrices of the base slice orientation moved to the slice offsets.
+  Offsets are computed as in vtkMRMLSliceNode::SetSliceOffset : along the slice normal, in the slice coordinates.
+  """
+  baseSliceToRAS = np.asarray(baseSliceToRAS, dtype=np.float64)
+  rotation = baseSliceToRAS[:3, :3]
+  translationInSlice = np.linalg.solve(rotation, baseSliceToRAS[:3, 3])
+
+  translationsInSlice = np.repeat(translationInSlice[None, :], len(sliceOffsets), axis=0)
+  translationsInSlice[:, 2] = sliceOffsets
+
+  matrices = np.repeat(baseSliceToRAS[None, :, :], len(sliceOffsets), axis=0)
+  matrices[:, :3, 3] = np.dot(translationsInSlice, rotation.T)
+  return matrices
+
+
+class RFTileViewLayout(object):
+  """
+  Positions the tile slice views of a N x M tile layout, in one batched modification.
+
+  The slice to RAS matrices of all the views are computed at once from the base slice view and applied while the slice
+  nodes are modified together and the rendering paused : the views are rendered once instead of once per modified
+  property and per view.
+
+  Usage example :
+    tileLayout = RFTileViewLayout(4, 4)
+    tileLayout.setupFromSliceNode(redSliceNode, sliceInterval=10)
+    tileLayout.setSliceOffsets(firstSliceOffset, sliceInterval)
+  """
+
+  def __init__(self, numberOfRows=4, numberOfColumns=4):
+    self.numberOfRows = numberOfRows
+    self.numberOfColumns = numberOfColumns
+    self.fieldOfViewFit = 200
+
+  @property
+  def numberOfViews(self):
+    return self.numberOfRows * self.numberOfColumns
+
+  def setGridSize(self, numberOfRows, numberOfColumns):
+    self.numberOfRows = numberOfRows
+    self.numberOfColumns = numberOfColumns
+
+  def sliceNodes(self):
+    """Returns the slice nodes of the tile views present in the scene"""
+    sliceNodes = [getViewBySingletonTag(tileViewTag(i)) for i in range(1, self.numberOfViews + 1)]
+    return [sliceNode for sliceNode in sliceNodes if sliceNode is not None]
+
+  def sliceCompositeNodes(self, sliceNodes):
+    appLogic = slicer.app.applicationLogic()
+    return [appLogic.GetSliceLogic(sliceNode).GetSliceCompositeNode() for sliceNode in sliceNodes]
+
+  def setupFromSliceNode(self, baseSliceNode, sliceInterval, fitFieldOfView=True):
+    """
+    Shows the background volume of baseSliceNode in the tile views, with the orientation of baseSliceNode and slice offsets
+    starting at baseSliceNode offset, incremented by sliceInterval.
+    """
+    sliceNodes = self.sliceNodes()
+    if not sliceNodes:
+      return
+
+    appLogic = slicer.app.applicationLogic()
+    backgroundVolumeID = appLogic.GetSliceLogic(baseSliceNode).GetSliceCompositeNode().GetBackgroundVolumeID()
+    baseSliceToRAS = slicer.util.arrayFromVTKMatrix(baseSliceNode.GetSliceToRAS())
+    baseXYZOrigin = baseSliceNode.GetXYZOrigin()
+    sliceOffsets = baseSliceNode.GetSliceOffset() + sliceInterval * np.arange(len(sliceNodes))
+
+    slicer.app.pauseRender()
+    try:
+      # Composite nodes are updated first : the slice logics need their background layer to fit the field of view
+      compositeNodes = self.sliceCompositeNodes(sliceNodes)
+      wasModifying = [compositeNode.StartModify() for compositeNode in compositeNodes]
+      for compositeNode in compositeNodes:
+        compositeNode.SetBackgroundVolumeID(backgroundVolumeID)
+        compositeNode.SetInteractionFlags(0)
+        compositeNode.SetSliceIntersectionVisibility(0)
+      for compositeNode, wasModified in zip(compositeNodes, wasModifying):
+        compositeNode.EndModify(wasModified)
+
+      wasModifying = [sliceNode.StartModify() for sliceNode in sliceNodes]
+      try:
+        for sliceNode in sliceNodes:
+          sliceNode.SetXYZOrigin(*baseXYZOrigin)
+          sliceNode.SetWidgetVisible(0)
+        self._applySliceToRASMatrices(sliceNodes, tileSliceToRASMatrices(baseSliceToRAS, sliceOffsets))
+
+        if fitFieldOfView:
+          self._fitFieldOfView(sliceNodes, sliceOffsets)
+      finally:
+        for sliceNode, wasModified in zip(sliceNodes, wasModifying):
+          sliceNode.EndModify(wasModified)
+    finally:
+      slicer.app.resumeRender()
+
+  def setSliceOffsets(self, firstSliceOffset, sliceInterval):
+    """Moves the tile views to firstSliceOffset + i * sliceInterval, keeping their orientation"""
+    sliceNodes = self.sliceNodes()
+    if not sliceNodes:
+      return
+
+    baseSliceToRAS = slicer.util.arrayFromVTKMatrix(sliceNodes[0].GetSliceToRAS())
+    sliceOffsets = firstSliceOffset + sliceInterval * np.arange(len(sliceNodes))
+    self._modifySliceNodes(sliceNodes, lambda: self._applySliceToRASMatrices(
+      sliceNodes, tileSliceToRASMatrices(baseSliceToRAS, sliceOffsets)))
+
+  def fitFieldOfView(self):
+    """Fits the field of view of the tile views to their background volume, keeping their slice offsets"""
+    sliceNodes = self.sliceNodes()
+    if not sliceNodes:
+      return
+
+    sliceOffsets = np.array([sliceNode.GetSliceOffset() for sliceNode in sliceNodes])
+    self._modifySliceNodes(sliceNodes, lambda: self._fitFieldOfView(sliceNodes, sliceOffsets))
+
+  def _modifySliceNodes(self, sliceNodes, modify):
+    slicer.app.pauseRender()
+    wasModifying = [sliceNode.StartModify() for sliceNode in sliceNodes]
+    try:
+      modify()
+    finally:
+      for sliceNode, wasModified in zip(sliceNodes, wasModifying):
+        sliceNode.EndModify(wasModified)
+      slicer.app.resumeRender()
+
+  def _fitFieldOfView(self, sliceNodes, sliceOffsets):
+    """
+    All the tile views show the same volume with the same orientation and view size : the field of view is only fitted
+    for the first view and copied to the others.
+    """
+    firstSliceLogic = slicer.app.applicationLogic().GetSliceLogic(sliceNodes[0])
+    firstSliceLogic.FitFOVToBackground(self.fieldOfViewFit)
+
+    fittedSliceToRAS = slicer.util.arrayFromVTKMatrix(sliceNodes[0].GetSliceToRAS())
+    fieldOfView = sliceNodes[0].GetFieldOfView()
+    xyzOrigin = sliceNodes[0].GetXYZOrigin()
+    for sliceNode in sliceNodes[1:]:
+      sliceNode.SetFieldOfView(*fieldOfView)
+      sliceNode.SetXYZOrigin(*xyzOrigin)
+    self._applySliceToRASMatrices(sliceNodes, tileSliceToRASMatrices(fittedSliceToRAS, sliceOffsets))
+
+  @staticmethod
+  def _applySliceToRASMatrices(sliceNodes, matrices):
+    for sliceNode, matrix in zip(sliceNodes, matrices):
+      sliceNode.GetSliceToRAS().DeepCopy(matrix.ravel().tolist())
+      sliceNode.UpdateMatrices()
+
+
+class RFTileViewSynchronizer(object):
+  """
+  Synchronizes the field of view and XYZ origin of the tile slice views, and reports slice offset changes.
+
+  The slice nodes are cached when the synchronization starts and observed with removable observer tags. Modified events
+  only record the modified view : the synchronization is coalesced and done once per frame, from the last modified view
+  to the other views. The modifications done by the synchronization are ignored, which avoids event cascades.
+
+  Usage example :
+    synchronizer = RFTileViewSynchronizer(tileViewLayout, onSliceOffsetChanged=lambda index, offset: ...)
+    synchronizer.start()
+    ...
+    synchronizer.stop()
+  """
+
+  def __init__(self, tileViewLayout, onSliceOffsetChanged=None, intervalMs=16):
+    """
+    :param tileViewLayout: RFTileViewLayout providing the tile slice nodes
+    :param onSliceOffsetChanged: callable(viewIndex, sliceOffset) called when the offset of a view was modified
+    """
+    self.tileViewLayout = tileViewLayout
+    self.onSliceOffsetChanged = onSliceOffsetChanged
+    self._sliceNodes = []
+    self._observerTags = []
+    # Field of view, XYZ origin and slice offset of the views, by node ID, to ignore the other modifications
+    self._viewStates = {}
+    self._sourceNode = None
+    self._isEnabled = False
+    self._isSynchronizing = False
+    self._scheduler = UpdateScheduler(self.synchronize, intervalMs=intervalMs, isDraftEnabled=False)
+
+  def __del__(self):
+    self.stop()
+
+  @property
+  def sliceNodes(self):
+    return list(self._sliceNodes)
+
+  @property
+  def isEnabled(self):
+    return self._isEnabled
+
+  def setEnabled(self, isEnabled):
+    """Enables or disables the synchronization. The pending synchronization is done before disabling."""
+    if not isEnabled:
+      self._scheduler.flush()
+    self._isEnabled = isEnabled
+
+  def start(self):
+    """Observes the current tile slice nodes and enables the synchronization"""
+    self.removeObservers()
+    self._sliceNodes = self.tileViewLayout.sliceNodes()
+    for sliceNode in self._sliceNodes:
+      tag = sliceNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self._onSliceNodeModified)
+      self._observerTags.append((sliceNode, tag))
+    self._updateViewStates()
+    self.setEnabled(True)
+
+  def stop(self):
+    """Disables the synchronization and removes the slice node observers"""
+    self.setEnabled(False)
+    self.removeObservers()
+
+  def removeObservers(self):
+    self._scheduler.cancel()
+    for sliceNode, tag in self._observerTags:
+      sliceNode.RemoveObserver(tag)
+    self._observerTags = []
+    self._sliceNodes = []
+    self._viewStates = {}
+    self._sourceNode = None
+
+  @staticmethod
+  def viewState(sliceNode):
+    return sliceNode.GetFieldOfView(), sliceNode.GetXYZOrigin(), sliceNode.GetSliceOffset()
+
+  def _updateViewStates(self):
+    self._viewStates = {sliceNode.GetID(): self.viewState(sliceNode) for sliceNode in self._sliceNodes}
+
+  def _onSliceNodeModified(self, caller, event):
+    viewState = self.viewState(caller)
+    if self._isSynchronizing or not self._isEnabled:
+      self._viewStates[caller.GetID()] = viewState
+      return
+    if self._viewStates.get(caller.GetID()) == viewState:
+      # Modification not related to the synchronized properties (widget visibility, ...)
+      return
+    self._sourceNode = caller
+    self._scheduler.requestUpdate()
+
+  def synchronize(self, isDraft=False):
+    """Copies the field of view and XYZ origin of the last modified view to the other tile views"""
+    sourceNode, self._sourceNode = self._sourceNode, None
+    if sourceNode is None or sourceNode not in self._sliceNodes:
+      return
+
+    fieldOfView = sourceNode.GetFieldOfView()
+    xyzOrigin = sourceNode.GetXYZOrigin()
+    modifiedNodes = [sliceNode for sliceNode in self._sliceNodes if sliceNode is not sourceNode and (
+      sliceNode.GetFieldOfView() != fieldOfView or sliceNode.GetXYZOrigin() != xyzOrigin)]
+
+    self._isSynchronizing = True
+    try:
+      if modifiedNodes:
+        slicer.app.pauseRender()
+        wasModifying = [sliceNode.StartModify() for sliceNode in modifiedNodes]
+        try:
+          for sliceNode in modifiedNodes:
+            sliceNode.SetFieldOfView(*fieldOfView)
+            sliceNode.SetXYZOrigin(*xyzOrigin)
+        finally:
+          for sliceNode, wasModified in zip(modifiedNodes, wasModifying):
+            sliceNode.EndModify(wasModified)
+          slicer.app.resumeRender()
+
+      if self.onSliceOffsetChanged is not None:
+        self.onSliceOffsetChanged(self._sliceNodes.index(sourceNode), sourceNode.GetSliceOffset())
+    finally:
+      self._updateViewStates()
+      self._isSynchronizing = False
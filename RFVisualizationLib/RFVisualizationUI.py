@@ -7,7 +7,7 @@ from RFReconstruction import RFReconstructionLogic
 
 
 from RFViewerHomeLib import translatable, toggleCheckBox, createButton, getNodeByID
-from RFVisualizationLib import RFLayoutType
+from RFVisualizationLib import RFLayoutType, RFSlabViewManager
 
 @unique
 class IndustryType(Enum):
@@ -32,6 +32,7 @@ class RFVisualizationUI(qt.QStackedWidget):
     self.spacing = 0 #スペース削減
     self.industry = industryType
     self.isCephalo = False
+    self.slabViewManager = RFSlabViewManager() #断層厚の反映（キャッシュ有効時は事前計算した断層厚画像を使用）
     self.addLayoutSection()
     self.add3DSection(vrLogic, preset)
     self.add2DSection()
@@ -53,6 +54,8 @@ class RFVisualizationUI(qt.QStackedWidget):
 
 
   def setVolumeNode(self, volumeNode, displayNode3D, isLoadingState):
+    self.slabViewManager.setVolumeNode(volumeNode)
+
     # Select volume in VolumeRenderingWidget selector for volume cropping and deactivate previous cropping settings
     self._volumeSelector.setCurrentNode(volumeNode)
 
@@ -431,6 +434,10 @@ class RFVisualizationUI(qt.QStackedWidget):
     self.fractionCheckBox.setToolTip(self.tr("間引き表示の切り替え"))
     layoutPre.addWidget(self.fractionCheckBox)
     toggleCheckBox(self.fractionCheckBox, lastCheckedState=False)
+
+    self.slabCacheCheckBox = qt.QCheckBox(self.tr("断層厚キャッシュ"))
+    self.slabCacheCheckBox.setToolTip(self.tr("断層厚画像を事前計算し、軸方向の断層表示を高速化"))
+    layoutPre.addWidget(self.slabCacheCheckBox)
     
     layoutPre.addWidget(qt.QLabel("")) #位置合わせにスペース追加
     layoutPre.addWidget(self._createLabel(self.tr(""))) #位置合わせにスペース追加
@@ -561,7 +568,6 @@ class RFVisualizationUI(qt.QStackedWidget):
       NumberOfSlices = NumberOfSlices + 1
     
     #投影方法の反映とスライスの反映
-    sliceNodes = slicer.util.getNodesByClass('vtkMRMLSliceNode')
     data = self.raycastSelector.currentData
     mode = vtk.VTK_IMAGE_SLAB_MAX
     if data == 1:
@@ -571,11 +577,8 @@ class RFVisualizationUI(qt.QStackedWidget):
     else:
       mode = vtk.VTK_IMAGE_SLAB_MIN
     
-    for slice in sliceNodes:
-      slice.SetSlabMode(mode)#投影方法
-      slice.SetSlabNumberOfSlices(int(NumberOfSlices))#枚数入力
-      slice.SetMipThickness(int(mm_convert))#mm入力
-      slice.Modified()
+    #投影方法・枚数・mmを全スライスへ反映（キャッシュ有効時、軸方向の断層は事前計算した画像を表示）
+    self.slabViewManager.setSlab(mode, int(NumberOfSlices), int(mm_convert), thickness)
     
 
   def fitToVolumeButton(self):
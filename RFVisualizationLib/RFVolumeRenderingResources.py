@@ -0,0 +1,44 @@
+from .RFLayout import getThreeDViewByTag
+
+
+class RFVolumeRenderingResources(object):
+  """
+  Owns the volume rendering display node of each volume, shared by every 3D view.
+
+  The display node and its volume property are created once per volume and shared by every 3D view (main, dual, triple
+  and tile views) : attaching a view only adds its ID to the display node, attaching an attached view does nothing.
+  Views are not detached when their layout is hidden : they keep their GPU textures, and showing the layout again does
+  not upload the volume again.
+
+  Usage example :
+    resources = RFVolumeRenderingResources(slicer.modules.volumerendering.logic())
+    displayNode = resources.attachView(volumeNode, ThreeDViewTag.Tile)
+  """
+
+  def __init__(self, vrLogic):
+    self._vrLogic = vrLogic
+
+  def getDisplayNode(self, volumeNode, createIfMissing=True):
+    """Returns the volume rendering display node of volumeNode, created with the default nodes the first time only"""
+    if volumeNode is None:
+      return None
+
+    displayNode = self._vrLogic.GetFirstVolumeRenderingDisplayNode(volumeNode)
+    if displayNode is None and createIfMissing:
+      displayNode = self._vrLogic.CreateDefaultVolumeRenderingNodes(volumeNode)
+    return displayNode
+
+  def attachView(self, volumeNode, viewTag):
+    """
+    Shows the volume rendering of volumeNode in the view with the given ThreeDViewTag.
+
+    :return: The shared volume rendering display node, None if the volume or the view does not exist
+    """
+    displayNode = self.getDisplayNode(volumeNode)
+    viewNode = getThreeDViewByTag(viewTag)
+    if displayNode is None or viewNode is None:
+      return displayNode
+
+    # No view node IDs means all the views : the first attached view restricts the display node to the attached views
+    displayNode.AddViewNodeID(viewNode.GetID())
+    return displayNode
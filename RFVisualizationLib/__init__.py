@@ -1,3 +1,7 @@
 from .RFVisualizationUtils import *
 from .RFLayout import *
+from .RFTileView import *
+from .RFSlabCache import *
+from .RFProgressiveVolumeRendering import *
+from .RFVolumeRenderingResources import *
 from .RFVisualizationUI import *
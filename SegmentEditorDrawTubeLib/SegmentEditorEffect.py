@@ -2,6 +2,7 @@ import os
 import vtk, qt, slicer
 import logging
 from SegmentEditorEffects import *
+from RFViewerHomeLib import UpdateScheduler
 
 class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
   """This effect uses markup fiducials to segment the input volume"""
@@ -22,6 +23,7 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     self.observedSegmentation = None
     self.segmentObserver = None
     self.buttonToInterpolationTypeMap = {}
+    self.modelUpdateScheduler = UpdateScheduler(self.updateModelFromSegmentMarkupNode)
 
   def clone(self):
     # It should not be necessary to modify this method
@@ -271,6 +273,7 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     self.updateModelFromSegmentMarkupNode()
 
   def reset(self):
+    self.modelUpdateScheduler.cancel()
     if self.fiducialPlacementToggle.placeModeEnabled:
       self.fiducialPlacementToggle.setPlaceModeEnabled(False)
 
@@ -292,6 +295,9 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
       logging.warning("Cannot apply, segment markup node has less than 2 control points")
       return
 
+    # Cut with the final model
+    self.modelUpdateScheduler.flush()
+
     # Allow users revert to this state by clicking Undo
     self.scriptedEffect.saveStateForUndo()
 
@@ -373,7 +379,8 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     self.updateModelFromSegmentMarkupNode()
 
   def onSegmentMarkupNodeModified(self, observer, eventid):
-    self.updateModelFromSegmentMarkupNode()
+    # Point events are coalesced, the model is a draft while the points are dragged
+    self.modelUpdateScheduler.requestUpdate()
     self.updateGUIFromMRML()
 
   def setAndObserveSegmentEditorNode(self, segmentEditorNode):
@@ -405,10 +412,10 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
 
     self.updateGUIFromMRML()
 
-  def updateModelFromSegmentMarkupNode(self):
+  def updateModelFromSegmentMarkupNode(self, isDraft=False):
     if not self.segmentMarkupNode or not self.segmentModel:
       return
-    self.logic.updateModelFromMarkup(self.segmentMarkupNode, self.segmentModel)
+    self.logic.updateModelFromMarkup(self.segmentMarkupNode, self.segmentModel, isDraft)
 
   def interactionNodeModified(self, interactionNode):
     # Override default behavior: keep the effect active if markup placement mode is activated
@@ -445,9 +452,10 @@ class DrawTubeLogic(object):
     modelDisplayNode.SetSliceIntersectionThickness(2)
     modelDisplayNode.SetOpacity(0.3)  # Between 0-1, 1 being opaque
 
-  def updateModelFromMarkup(self, inputMarkup, outputModel):
+  def updateModelFromMarkup(self, inputMarkup, outputModel, isDraft=False):
     """
     Update model to enclose all points in the input markup list
+    Draft models are sampled with less line segments between control points.
     """
     interpolationName = self.scriptedEffect.parameter("Interpolation")
     polynomialFitType = slicer.vtkMRMLMarkupsToModelNode.MovingLeastSquares
@@ -465,6 +473,8 @@ class DrawTubeLogic(object):
       polynomialFitType = slicer.vtkMRMLMarkupsToModelNode.MovingLeastSquares
 
     NumberOfLineSegmentsBetweenControlPoints = self.scriptedEffect.integerParameter("NumberOfLineSegmentsBetweenControlPoints")
+    if isDraft:
+      NumberOfLineSegmentsBetweenControlPoints = max(1, NumberOfLineSegmentsBetweenControlPoints // 4)
 
     markupsToModel = slicer.modules.markupstomodel.logic()
     # Create tube from points
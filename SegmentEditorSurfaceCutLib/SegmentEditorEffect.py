@@ -2,6 +2,7 @@ import os
 import vtk, qt, slicer
 import logging
 from SegmentEditorEffects import *
+from RFViewerHomeLib import UpdateScheduler
 
 class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
   """This effect uses markup fiducials to segment the input volume"""
@@ -22,6 +23,7 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     self.observedSegmentation = None
     self.segmentObserver = None
     self.buttonToOperationNameMap = {}
+    self.modelUpdateScheduler = UpdateScheduler(self.updateModelFromSegmentMarkupNode)
 
   def clone(self):
     # It should not be necessary to modify this method
@@ -260,6 +262,7 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     self.updateModelFromSegmentMarkupNode()
 
   def reset(self):
+    self.modelUpdateScheduler.cancel()
     if self.fiducialPlacementToggle.placeModeEnabled:
       self.fiducialPlacementToggle.setPlaceModeEnabled(False)
 
@@ -281,6 +284,9 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
       logging.warning("Cannot apply, segment markup node has less than 3 control points")
       return
 
+    # Cut with the final model
+    self.modelUpdateScheduler.flush()
+
     # Allow users revert to this state by clicking Undo
     self.scriptedEffect.saveStateForUndo()
 
@@ -366,7 +372,8 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     self.updateModelFromSegmentMarkupNode()
 
   def onSegmentMarkupNodeModified(self, observer, eventid):
-    self.updateModelFromSegmentMarkupNode()
+    # Point events are coalesced, the model is a draft while the points are dragged
+    self.modelUpdateScheduler.requestUpdate()
     self.updateGUIFromMRML()
 
   def setAndObserveSegmentEditorNode(self, segmentEditorNode):
@@ -398,10 +405,11 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
 
     self.updateGUIFromMRML()
 
-  def updateModelFromSegmentMarkupNode(self):
+  def updateModelFromSegmentMarkupNode(self, isDraft=False):
     if not self.segmentMarkupNode or not self.segmentModel:
       return
-    smoothing = self.scriptedEffect.integerParameter("SmoothModel") != 0
+    # Smoothing is skipped for draft models
+    smoothing = self.scriptedEffect.integerParameter("SmoothModel") != 0 and not isDraft
     self.logic.updateModelFromMarkup(self.segmentMarkupNode, self.segmentModel, smoothing)
 
   def interactionNodeModified(self, interactionNode):